@@ -0,0 +1,230 @@
+import logging
+import concurrent.futures
+import tempfile
+import datetime
+import argparse
+import resource
+import tracemalloc
+import json
+import time
+import os
+import sys
+
+# Ensure the package directory is in the Python path
+PACKAGE_PARENT = '.'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+try:
+    from yt_pundit_analyzer.utils import load_config, load_prompt, create_chat_prompt_template
+    from yt_pundit_analyzer.core import process_video_set, add_video_set_tasks
+    from yt_pundit_analyzer.scheduler import StageScheduler
+    from yt_pundit_analyzer.async_engine import run_async
+    from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+    from yt_pundit_analyzer.prefetch import TranscriptPrefetcher
+    from yt_pundit_analyzer.fakes import FakeTranscriptReader, FakeGemini
+    from yt_pundit_analyzer.video_sets import video_set_urls
+    from yt_pundit_analyzer import metrics
+except ImportError as e:
+    print(f"Error importing modules. Ensure benchmark.py is in the correct directory and required packages are installed: {e}")
+    sys.exit(1)
+
+
+# --- Benchmark Scenarios ---
+# Fake latencies are scaled down (~50x) from real Gemini calls so the suite runs in minutes.
+DEFAULT_FAKE_LLM = {"latency_median": 0.05, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0}
+SCENARIOS = [
+    # name, number of sets, engine, stage pool size, rate limit (calls per period)
+    {"name": "single_set",        "sets": 1,    "engine": "stages", "workers": 4,  "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_10_serial",    "sets": 10,   "engine": "sets",   "workers": 4,  "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_10_stages",    "sets": 10,   "engine": "stages", "workers": 4,  "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_10_async",     "sets": 10,   "engine": "async",  "workers": 4,  "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_100_w4",       "sets": 100,  "engine": "stages", "workers": 4,  "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_100_w16",      "sets": 100,  "engine": "stages", "workers": 16, "rate_limit_calls": 1000, "rate_limit_period": 1},
+    {"name": "sets_100_limited",  "sets": 100,  "engine": "stages", "workers": 16, "rate_limit_calls": 100,  "rate_limit_period": 1},
+    {"name": "sets_100_flaky",    "sets": 100,  "engine": "stages", "workers": 16, "rate_limit_calls": 1000, "rate_limit_period": 1,
+     "llm": {"error_rate": 0.02, "rate_limit_rate": 0.05}},
+    {"name": "sets_100_prefetch", "sets": 100,  "engine": "stages", "workers": 16, "rate_limit_calls": 1000, "rate_limit_period": 1,
+     "prefetch": True, "fetch_latency": 0.05},
+    {"name": "sets_100_no_prefetch", "sets": 100, "engine": "stages", "workers": 16, "rate_limit_calls": 1000, "rate_limit_period": 1,
+     "fetch_latency": 0.05},
+    {"name": "sets_1000_w32",     "sets": 1000, "engine": "stages", "workers": 32, "rate_limit_calls": 2000, "rate_limit_period": 1},
+    {"name": "sets_1000_async",   "sets": 1000, "engine": "async",  "workers": 32, "rate_limit_calls": 2000, "rate_limit_period": 1},
+    # Peak memory: all sets submitted and prefetched up front vs. streamed through a bounded window
+    {"name": "sets_2000_upfront", "sets": 2000, "engine": "stages", "workers": 32, "rate_limit_calls": 4000, "rate_limit_period": 1,
+     "prefetch": True},
+    {"name": "sets_2000_stream",  "sets": 2000, "engine": "stages", "workers": 32, "rate_limit_calls": 4000, "rate_limit_period": 1,
+     "prefetch": True, "stream": True, "in_flight": 64},
+    {"name": "sets_2000_stream_async", "sets": 2000, "engine": "async", "workers": 32, "rate_limit_calls": 4000, "rate_limit_period": 1,
+     "prefetch": True, "stream": True, "in_flight": 64},
+]
+QUICK_SCENARIOS = {"single_set", "sets_10_serial", "sets_10_stages", "sets_10_async", "sets_100_w16", "sets_100_prefetch"}
+
+
+def iter_video_sets(count: int):
+    """Synthetic video sets with unique, valid-looking YouTube URLs, generated lazily."""
+    for index in range(count):
+        yield {
+            "subject": f"Bench Set {index:04d}",
+            "early_take": {"url": f"https://www.youtube.com/watch?v=E{index:010d}"},
+            "retrospective": {"url": f"https://www.youtube.com/watch?v=R{index:010d}"},
+        }
+
+def make_video_sets(count: int) -> list:
+    return list(iter_video_sets(count))
+
+
+def run_scenario(scenario: dict, prompt_templates: dict, transcript_chars: int) -> dict:
+    """Runs one scenario against the fakes and returns its measurements."""
+    stream = scenario.get('stream', False) # Read sets lazily through a bounded in-flight window
+    in_flight = scenario.get('in_flight')
+    reader = FakeTranscriptReader(transcript_chars=transcript_chars, latency=scenario.get('fetch_latency', 0.01))
+    llm = FakeGemini(**{**DEFAULT_FAKE_LLM, **scenario.get('llm', {})})
+    rate_limiter = TokenBucketRateLimiter(
+        scenario['rate_limit_calls'], scenario['rate_limit_period'], max_retries=5, base_backoff=0.2, max_backoff=2.0
+    )
+    run_metrics = metrics.enable_metrics()
+    workers = scenario['workers']
+    completed = 0
+
+    def count_result(*_args):
+        nonlocal completed
+        completed += 1
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    video_sets = iter_video_sets(scenario['sets']) if stream else make_video_sets(scenario['sets'])
+    prefetcher = None
+    if scenario.get('prefetch'):
+        prefetcher = TranscriptPrefetcher(reader, max_workers=workers, batch_size=4, retry_base_delay=0.1)
+        if stream:
+            video_sets = prefetcher.prefetch_ahead(video_sets, in_flight, video_set_urls)
+        else:
+            prefetcher.start([url for video_set in video_sets for url in video_set_urls(video_set)])
+    with tempfile.TemporaryDirectory(prefix="pundit_bench_") as output_folder:
+        if scenario['engine'] == "sets":
+            # Classic path: one worker thread runs a whole set's chain
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(process_video_set, video_set, reader, llm, prompt_templates, rate_limiter, output_folder,
+                                    prefetcher=prefetcher)
+                    for video_set in video_sets
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    count_result()
+        elif scenario['engine'] == "stages":
+            scheduler = StageScheduler({}, default_pool_size=workers)
+            final_tasks = {}
+
+            def feed():
+                for index, video_set in enumerate(video_sets):
+                    task_id = add_video_set_tasks(scheduler, video_set, reader, llm, prompt_templates, rate_limiter, output_folder,
+                                                  task_prefix=str(index), prefetcher=prefetcher)
+                    final_tasks[task_id] = video_set
+                    yield task_id
+
+            if stream:
+                results = scheduler.run(feed(), max_in_flight=in_flight)
+            else:
+                for _ in feed(): # Register every set's tasks up front
+                    pass
+                results = scheduler.run()
+            for task_id, _result, _exc in results:
+                if task_id in final_tasks:
+                    video_set = final_tasks.pop(task_id)
+                    if prefetcher is not None and stream:
+                        prefetcher.release(video_set_urls(video_set))
+                    count_result()
+        elif scenario['engine'] == "async":
+            run_async(video_sets, reader, llm, prompt_templates, rate_limiter, output_folder, count_result,
+                      max_concurrency=workers * 4, fetch_workers=workers, prefetcher=prefetcher,
+                      max_in_flight=in_flight if stream else scenario['sets'])
+        else:
+            raise ValueError(f"Unknown engine: {scenario['engine']}")
+        if prefetcher is not None:
+            prefetcher.close()
+    elapsed = time.perf_counter() - start
+    _current, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = run_metrics.summary()
+    return {
+        "name": scenario['name'],
+        "scenario": scenario,
+        "sets_completed": completed,
+        "elapsed_seconds": round(elapsed, 3),
+        "sets_per_minute": round(completed / elapsed * 60, 1) if elapsed else 0.0,
+        "llm_calls": llm.calls,
+        "llm_failures": llm.failures,
+        "transcript_fetches": reader.calls,
+        "peak_traced_mb": round(peak_bytes / 1024 / 1024, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": {stage: {k: stats[k] for k in ("count", "wall_p50", "wall_p95", "wait_p95")} for stage, stats in stages.items()},
+        "rate_limiter": rate_limiter.metrics(),
+    }
+
+
+def compare_to_baseline(results: list, baseline_path: str, tolerance: float) -> list:
+    """Returns scenarios whose throughput dropped more than tolerance (fraction) below the baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if not previous or not previous['sets_per_minute']:
+            continue
+        change = result['sets_per_minute'] / previous['sets_per_minute'] - 1
+        if change < -tolerance:
+            regressions.append((result['name'], previous['sets_per_minute'], result['sets_per_minute'], change))
+    return regressions
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of the pipeline using fake YouTube/Gemini stand-ins.")
+    parser.add_argument("--config", default="config.yaml", help="Config file providing the prompt file paths (default: config.yaml)")
+    parser.add_argument("--quick", action="store_true", help="Run only the small scenarios.")
+    parser.add_argument("--scenario", action="append", default=None, help="Run only the named scenario (can be repeated).")
+    parser.add_argument("--transcript-chars", type=int, default=50000, help="Size of each synthetic transcript (default: 50000).")
+    parser.add_argument("--results-dir", default="bench_results", help="Folder where result JSON files are saved (default: bench_results)")
+    parser.add_argument("--baseline", default=None, help="Previous results JSON to compare throughput against.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed throughput drop vs. the baseline before failing (default: 0.15).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+
+    config = load_config(args.config)
+    prompt_templates = {
+        'early': create_chat_prompt_template(load_prompt(config['early_take_prompt_file'])),
+        'retro': create_chat_prompt_template(load_prompt(config['retrospective_prompt_file'])),
+        'compare': create_chat_prompt_template(load_prompt(config['compare_prompt_file']))
+    }
+
+    selected = [
+        s for s in SCENARIOS
+        if (not args.scenario or s['name'] in args.scenario) and (not args.quick or s['name'] in QUICK_SCENARIOS)
+    ]
+    results = []
+    print(f"{'Scenario':<20} {'Sets':>5} {'Engine':>7} {'Workers':>7} {'Elapsed (s)':>11} {'Sets/min':>9} {'LLM p95 (s)':>11} {'Peak MB':>8}")
+    for scenario in selected:
+        result = run_scenario(scenario, prompt_templates, args.transcript_chars)
+        results.append(result)
+        llm_p95 = result['stages'].get('llm', {}).get('wall_p95', 0.0)
+        print(f"{result['name']:<20} {scenario['sets']:>5} {scenario['engine']:>7} {scenario['workers']:>7} "
+              f"{result['elapsed_seconds']:>11.2f} {result['sets_per_minute']:>9.1f} {llm_p95:>11.3f} {result['peak_traced_mb']:>8.1f}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, f"bench_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M')}.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump({"created": datetime.datetime.now().isoformat(timespec='seconds'),
+                   "python": sys.version.split()[0], "results": results}, f, indent=2)
+    print(f"\nResults saved to {results_path}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before:.1f} -> {after:.1f} sets/min ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No throughput regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
@@ -1,5 +1,5 @@
+import json
 import logging
-import concurrent.futures
 import time
 import argparse
 import os
@@ -18,9 +18,26 @@ try:
         create_chat_prompt_template,
         setup_rate_limiter
     )
-    from yt_pundit_analyzer.core import process_video_set
-    from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
-    from llama_index.llms.gemini import Gemini
+    from yt_pundit_analyzer.core import add_video_set_tasks
+    from yt_pundit_analyzer.scheduler import StageScheduler
+    from yt_pundit_analyzer.async_engine import run_async
+    from yt_pundit_analyzer.run_manifest import RunManifest
+    from yt_pundit_analyzer.chunking import setup_chunking
+    from yt_pundit_analyzer.preprocess import setup_preprocessing, preprocess_transcript
+    from yt_pundit_analyzer.metrics import enable_metrics
+    from yt_pundit_analyzer.cache import setup_transcript_cache, setup_response_cache
+    from yt_pundit_analyzer.prefetch import setup_transcript_prefetch
+    from yt_pundit_analyzer.streaming import setup_streaming
+    from yt_pundit_analyzer.routing import setup_model_router, stage_model
+    from yt_pundit_analyzer.jobqueue import open_job_queue
+    from yt_pundit_analyzer.distributed import Worker, enqueue_video_sets, job_signatures, wait_for_queue
+    from yt_pundit_analyzer.video_sets import setup_video_sets, video_set_urls, SetSummaryWriter
+    from yt_pundit_analyzer.artifacts import AnalysisArtifacts, set_analysis_keys
+    from yt_pundit_analyzer.rollup import setup_rollup, RollupCollector, run_rollups
+    from yt_pundit_analyzer.plan import validate_config, build_plan, format_plan, iter_planned_video_sets
+    from yt_pundit_analyzer.structured import setup_structured_output, results_index_path
+    from yt_pundit_analyzer.results_index import ResultsIndex, COUNT_COLUMNS
+    from yt_pundit_analyzer.quotes import setup_quote_check, extract_quotes, match_quotes, summarize_matches
 except ImportError as e:
     print(f"Error importing modules. Ensure main.py is in the correct directory and required packages are installed: {e}")
     sys.exit(1)
@@ -33,8 +50,81 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# --- Console Output ---
+def print_set_summary(result_data: dict, output_folder: str):
+    """Prints the status summary of one processed set (details are in files)."""
+    print("\n" + "="*50)
+    print(f"Summary for Set: '{result_data.get('subject', 'N/A')}'")
+    print("-"*50)
+    print(f"Early Take URL:      {result_data.get('early_take_url', 'N/A')}")
+    print(f"Early Take Status:   {result_data.get('early_take_status', 'N/A')}")
+    print(f"Retrospective URL:   {result_data.get('retrospective_url', 'N/A')}")
+    print(f"Retrospective Status:{result_data.get('retrospective_status', 'N/A')}")
+    print(f"Comparison Status:   {result_data.get('comparison_status', 'N/A')}")
+    comparisons = result_data.get('comparisons') or []
+    if len(comparisons) > 1:
+        ok = sum(1 for comparison in comparisons if comparison.get('comparison_status') == "OK")
+        print(f"Comparisons:         {ok}/{len(comparisons)} OK")
+    print(f"(Detailed results saved in folder: '{output_folder}')")
+    print("="*50 + "\n")
+
+# --- Pipeline Setup ---
+def load_prompt_templates(config: dict) -> dict:
+    """Loads the stage prompt templates. Raises KeyError/FileNotFoundError for bad prompt settings."""
+    return {
+        'early': create_chat_prompt_template(load_prompt(config['early_take_prompt_file'])),
+        'retro': create_chat_prompt_template(load_prompt(config['retrospective_prompt_file'])),
+        'compare': create_chat_prompt_template(load_prompt(config['compare_prompt_file']))
+    }
+
+def setup_components(config: dict, api_key: str, output_folder: str, refresh_transcripts: bool = False) -> dict:
+    """Builds the shared reader, LLM, rate limiter, caches and stage settings used to process sets."""
+    # The LLM stack takes seconds to import, so it is only loaded once sets are actually processed
+    from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
+    from llama_index.llms.gemini import Gemini
+    reader = YoutubeTranscriptReader()
+    llm = Gemini(api_key=api_key, model_name=config.get('llm_model_name', 'models/gemini-1.5-flash'))
+    rate_limiter = setup_rate_limiter(
+        config.get('rate_limit_calls', 5), # Use .get for safety
+        config.get('rate_limit_period', 60),
+        tokens_per_minute=config.get('rate_limit_tokens_per_minute'),
+        max_retries=config.get('rate_limit_max_retries', 3)
+    )
+
+    def make_llm(model_name: str):
+        return Gemini(api_key=api_key, model_name=model_name)
+
+    if refresh_transcripts:
+        logging.info("--refresh-transcripts given: cached transcripts will be re-fetched and overwritten.")
+    stream_settings = setup_streaming(config) # None unless streaming responses are enabled
+    transcript_cache = setup_transcript_cache(config) # None if disabled
+    return {
+        'reader': reader,
+        'llm': llm,
+        'rate_limiter': rate_limiter,
+        'model_router': setup_model_router(config, llm, rate_limiter, make_llm), # None unless stage_models is configured
+        'transcript_cache': transcript_cache,
+        'refresh_transcripts': refresh_transcripts,
+        'response_cache': setup_response_cache(config), # None if disabled
+        'chunk_settings': setup_chunking(config), # None unless chunked analysis is enabled
+        'preprocess_settings': setup_preprocessing(config), # None unless transcript compaction is enabled
+        'prompt_templates': load_prompt_templates(config),
+        'rollup_settings': setup_rollup(config), # None unless pundit rollups are enabled
+        'structured_settings': setup_structured_output(config, output_folder), # None unless JSON extraction is enabled
+        'quote_settings': setup_quote_check(config, transcript_cache), # None unless quote verification is enabled
+        'stream_settings': stream_settings,
+    }
+
+def resolve_output_folder(config: dict, cli_output_folder: str = None) -> str:
+    """Determines the output folder (CLI override takes precedence) and creates it."""
+    output_folder = cli_output_folder if cli_output_folder else config.get('output_folder', 'analysis_results')
+    os.makedirs(output_folder, exist_ok=True) # Ensure it exists
+    logging.info(f"Output will be saved to: {os.path.abspath(output_folder)}")
+    return output_folder
+
 # --- Main Execution ---
-def run_pundit_analyzer(config_path="config.yaml", cli_output_folder=None):
+def run_pundit_analyzer(config_path="config.yaml", cli_output_folder=None, refresh_transcripts=False, invalidate_prompts=None, use_async=False, resume=False,
+                        cli_video_sets_file=None):
     """Main function to run the YouTube video comparison."""
     start_time = time.time()
     logging.info("--- Starting YouTube Pundit Analyzer ---")
@@ -44,109 +134,194 @@ def run_pundit_analyzer(config_path="config.yaml", cli_output_folder=None):
         config = load_config(config_path)
         api_key = get_api_key(config) # Prioritizes .env
 
-        # Determine output folder (CLI override takes precedence)
-        output_folder = cli_output_folder if cli_output_folder else config.get('output_folder', 'analysis_results')
-        os.makedirs(output_folder, exist_ok=True) # Ensure it exists
-        logging.info(f"Output will be saved to: {os.path.abspath(output_folder)}")
+        output_folder = resolve_output_folder(config, cli_output_folder)
+
+        # Sets are read lazily (from config.yaml or a streamed sets file) and validated as they are pulled
+        video_sets, total_sets = setup_video_sets(config, cli_video_sets_file)
 
-        # Load and prepare all necessary prompt templates
+        # 2. Setup LlamaIndex Components, Prompt Templates & Rate Limiter
         try:
-            prompt_templates = {
-                'early': create_chat_prompt_template(load_prompt(config['early_take_prompt_file'])),
-                'retro': create_chat_prompt_template(load_prompt(config['retrospective_prompt_file'])),
-                'compare': create_chat_prompt_template(load_prompt(config['compare_prompt_file']))
-            }
+            components = setup_components(config, api_key, output_folder, refresh_transcripts)
         except KeyError as e:
              logging.error(f"Missing prompt file path key in config.yaml: {e}. Please ensure 'early_take_prompt_file', 'retrospective_prompt_file', and 'compare_prompt_file' are defined.")
              return # Exit if prompts can't be loaded
         except FileNotFoundError:
              logging.error(f"One or more prompt files specified in config.yaml were not found. Please check paths.")
              return # Exit if prompts can't be loaded
+        reader, llm = components['reader'], components['llm']
+        rate_limiter, prompt_templates = components['rate_limiter'], components['prompt_templates']
+        transcript_cache, response_cache = components['transcript_cache'], components['response_cache']
+        chunk_settings, preprocess_settings = components['chunk_settings'], components['preprocess_settings']
+        structured_settings, model_router = components['structured_settings'], components['model_router']
+        quote_settings, stream_settings = components['quote_settings'], components['stream_settings']
+        if invalidate_prompts:
+            if response_cache is None:
+                logging.warning("--invalidate-prompt given but the LLM response cache is disabled; nothing to invalidate.")
+            else:
+                for prompt_file in invalidate_prompts:
+                    response_cache.invalidate_prompt(prompt_file)
+        manifest = RunManifest(output_folder, resume=resume) # Journal of completed stages
+        if config.get('run_report', True):
+            # Streamed inputs can be arbitrarily long: write events to run_report.csv as they happen
+            run_metrics = enable_metrics(output_folder if total_sets is None else None)
+        else:
+            run_metrics = None
 
+        # 3. Parallel Processing
+        # Download transcripts ahead of processing; analyses start as soon as their transcripts arrive
+        prefetcher = setup_transcript_prefetch(config, reader, transcript_cache, refresh_transcripts) # None if disabled
+        if prefetcher is not None:
+            lookahead = (config.get('transcript_prefetch') or {}).get('lookahead_sets', 64)
+            video_sets = prefetcher.prefetch_ahead(video_sets, lookahead, video_set_urls)
 
-        video_sets = config.get('video_sets', []) # Get the list of sets
-        if not video_sets or not isinstance(video_sets, list):
-            logging.warning("No valid 'video_sets' list found in configuration. Ensure it's defined correctly in config.yaml. Exiting.")
-            return
+        summary_writer = SetSummaryWriter(output_folder) # Summaries stream to disk as sets finish
+        rollup_settings = components['rollup_settings']
+        rollup_collector = RollupCollector(output_folder) if rollup_settings is not None else None
+        processed_count = 0
+        progress_total = f"/{total_sets}" if total_sets is not None else ""
 
-        # 2. Setup LlamaIndex Components & Rate Limiter
-        reader = YoutubeTranscriptReader()
-        llm = Gemini(api_key=api_key, model_name=config.get('llm_model_name', 'models/gemini-1.5-flash'))
-        rate_limiter = setup_rate_limiter(
-            config.get('rate_limit_calls', 5), # Use .get for safety
-            config.get('rate_limit_period', 60)
-        )
+        def handle_result(subject_completed, result_data, exc):
+            """Records and prints the outcome of one finished set."""
+            nonlocal processed_count
+            processed_count += 1
+            logging.info(f"Processing complete for set {processed_count}{progress_total}: '{subject_completed}'")
+            if exc is None:
+                if rollup_collector is not None:
+                    rollup_collector.add_set(result_data) # Before the writer drops the comparison texts
+                summary_writer.write(result_data)
+                print_set_summary(result_data, output_folder)
+            else:
+                logging.error(f"Set '{subject_completed}' generated an exception during processing: {exc}", exc_info=exc)
+                # Store error information in the summary
+                summary_writer.write({
+                    "subject": subject_completed,
+                    "error": f"Processing failed: {exc}"
+                })
 
-        # 3. Parallel Processing
-        # Use max_workers from config, default to 4
         max_workers = config.get('max_workers', 4)
-        # Ensure at least 1 worker, and not more than number of sets (no benefit)
-        num_sets = len(video_sets)
-        actual_workers = max(1, min(num_sets, max_workers))
-
-        logging.info(f"Processing {num_sets} sets using up to {actual_workers} worker threads.")
-        results_summary = []
-        futures_map = {} # Dictionary to map futures back to set names
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=actual_workers, thread_name_prefix='Worker') as executor:
-            # Submit tasks
-            for video_set in video_sets:
-                # Basic validation of the set structure
-                subject = video_set.get('subject')
-                if not subject or \
-                   not isinstance(video_set.get('early_take'), dict) or \
-                   not isinstance(video_set.get('retrospective'), dict) or \
-                   not video_set['early_take'].get('url') or \
-                   not video_set['retrospective'].get('url'):
-                    logging.warning(f"Skipping invalid video set structure in config: Set name '{subject or 'MISSING'}'. Check URLs and structure.")
-                    continue
-
-                future = executor.submit(
-                    process_video_set, # Target function in core.py
-                    video_set,         # The dictionary for the current set
-                    reader,            # Shared reader instance
-                    llm,               # Shared LLM instance
-                    prompt_templates,  # Dict with prepared prompt templates
-                    rate_limiter,      # Shared rate limiter instance
-                    output_folder      # Output folder path
+        max_in_flight = config.get('max_sets_in_flight', 64) # Back-pressure on reading the input
+        try:
+            if use_async:
+                # Single event loop; concurrency bounded by a semaphore instead of threads
+                run_async(
+                    video_sets, reader, llm, prompt_templates,
+                    rate_limiter,
+                    output_folder, handle_result,
+                    max_concurrency=config.get('async_max_concurrency', 64),
+                    fetch_workers=(config.get('stage_workers') or {}).get('fetch', max_workers),
+                    transcript_cache=transcript_cache,
+                    refresh_transcripts=refresh_transcripts,
+                    response_cache=response_cache,
+                    manifest=manifest,
+                    chunk_settings=chunk_settings,
+                    prefetcher=prefetcher,
+                    preprocess_settings=preprocess_settings,
+                    max_in_flight=max_in_flight,
+                    structured_settings=structured_settings,
+                    model_router=model_router,
+                    quote_settings=quote_settings,
+                    stream_settings=stream_settings
                 )
-                futures_map[future] = subject # Map future to set name for context
-
-            if not futures_map:
-                logging.warning("No valid video sets were submitted for processing.")
-                return
-
-            # Process completed tasks as they finish
-            processed_count = 0
-            total_tasks = len(futures_map)
-            for future in concurrent.futures.as_completed(futures_map):
-                subject_completed = futures_map[future]
-                processed_count += 1
-                logging.info(f"Processing complete for set {processed_count}/{total_tasks}: '{subject_completed}'")
+            else:
+                # Stage task graph: each set is split into fetch/analyze/compare tasks that run on
+                # shared pools, one per stage type. Pool sizes come from 'stage_workers', defaulting to max_workers.
+                scheduler = StageScheduler(config.get('stage_workers') or {}, default_pool_size=max(1, max_workers))
+                final_tasks = {} # Maps each in-flight set's final task id back to its set
+                artifacts = AnalysisArtifacts() # Per-video analyses shared by the sets in flight
+
+                def feed():
+                    """Adds one set's tasks per step; the scheduler pulls sets only as earlier ones finish."""
+                    for index, video_set in enumerate(video_sets):
+                        final_task_id = add_video_set_tasks(
+                            scheduler,         # Shared stage scheduler
+                            video_set,         # The dictionary for the current set
+                            reader,            # Shared reader instance
+                            llm,               # Shared LLM instance
+                            prompt_templates,  # Dict with prepared prompt templates
+                            rate_limiter,      # Shared rate limiter instance
+                            output_folder,     # Output folder path
+                            transcript_cache,  # Shared transcript cache (or None)
+                            refresh_transcripts,
+                            response_cache,    # Shared LLM response cache (or None)
+                            manifest,          # Run manifest for --resume
+                            chunk_settings,    # Map-reduce settings for long transcripts (or None)
+                            task_prefix=f"{index}:{video_set['subject']}",
+                            prefetcher=prefetcher,
+                            preprocess_settings=preprocess_settings,
+                            artifacts=artifacts,
+                            structured_settings=structured_settings,
+                            model_router=model_router,
+                            quote_settings=quote_settings,
+                            stream_settings=stream_settings
+                        )
+                        final_tasks[final_task_id] = video_set # Map final task to its set for context
+                        yield final_task_id
+
+                logging.info(f"Processing sets as stage tasks (up to {max_in_flight} sets in flight).")
                 try:
-                    result_data = future.result() # Get summary dict from process_video_set
-                    results_summary.append(result_data)
-                    # Print summary status (details are in files)
-                    print("\n" + "="*50)
-                    print(f"Summary for Set: '{result_data.get('subject', 'N/A')}'")
-                    print("-"*50)
-                    print(f"Early Take URL:      {result_data.get('early_take_url', 'N/A')}")
-                    print(f"Early Take Status:   {result_data.get('early_take_status', 'N/A')}")
-                    print(f"Retrospective URL:   {result_data.get('retrospective_url', 'N/A')}")
-                    print(f"Retrospective Status:{result_data.get('retrospective_status', 'N/A')}")
-                    print(f"Comparison Status:   {result_data.get('comparison_status', 'N/A')}")
-                    print(f"(Detailed results saved in folder: '{output_folder}')")
-                    print("="*50 + "\n")
-                except Exception as exc:
-                    logging.error(f"Set '{subject_completed}' generated an exception during processing: {exc}", exc_info=True)
-                    # Store error information in the summary
-                    results_summary.append({
-                        "subject": subject_completed,
-                        "error": f"Processing failed: {exc}"
-                    })
+                    for task_id, result_data, exc in scheduler.run(feed(), max_in_flight=max_in_flight):
+                        if task_id in final_tasks: # Intermediate stage results only feed the next task
+                            video_set = final_tasks.pop(task_id)
+                            artifacts.release(set_analysis_keys(video_set))
+                            if prefetcher is not None:
+                                prefetcher.release(video_set_urls(video_set))
+                            handle_result(video_set['subject'], result_data, exc)
+                finally:
+                    artifacts.cancel_all() # Nothing may be left waiting on an analysis that will never run
+                logging.info(f"Per-video analyses: {artifacts.stats()}")
+
+            # 3b. Pundit rollups over all comparisons of the run
+            if rollup_collector is not None:
+                rollup_llm, rollup_limiter = stage_model(model_router, "rollup", llm, rate_limiter)
+                rollup_statuses = run_rollups(rollup_collector, rollup_llm, rollup_settings, rollup_limiter, output_folder, response_cache)
+                for pundit, status in rollup_statuses.items():
+                    logging.info(f"Rollup for pundit '{pundit}': {status}")
+        finally:
+            if rollup_collector is not None:
+                rollup_collector.close()
+            summary_writer.close()
+            if prefetcher is not None:
+                prefetcher.close()
+            if model_router is not None:
+                model_router.close()
+            if structured_settings is not None:
+                logging.info(f"Results index: {structured_settings['index'].stats()}")
+                structured_settings['index'].close()
+            if run_metrics is not None:
+                run_metrics.close() # The report below only needs the in-memory aggregates
 
         # 4. Final Summary
-        logging.info(f"--- Finished processing all submitted sets ({processed_count}/{total_tasks}) ---")
+        if processed_count == 0:
+            logging.warning("No valid video sets were submitted for processing.")
+        logging.info(f"--- Finished processing all submitted sets ({processed_count}{progress_total}) ---")
+        logging.info(f"Set summaries: {summary_writer.stats()}")
+        if transcript_cache is not None:
+            logging.info(f"Transcript cache: {transcript_cache.hits} hits, {transcript_cache.misses} misses.")
+        if prefetcher is not None:
+            logging.info(f"Transcript prefetch: {prefetcher.stats()}")
+        if response_cache is not None:
+            logging.info(f"LLM response cache: {response_cache.hits} hits, {response_cache.misses} misses.")
+        logging.info(f"Rate limiter: {rate_limiter.metrics()}")
+        if quote_settings is not None:
+            logging.info(f"Quote check: {quote_settings['store'].stats()}")
+        if model_router is not None:
+            for model_name, model_stats in model_router.stats().items():
+                logging.info(f"Model {model_name}: {model_stats}")
+        if resume:
+            logging.info(f"Resumed {manifest.resumed_stages} completed stages from {manifest.path}.")
+        if run_metrics is not None:
+            compaction = run_metrics.summary().get('preprocess')
+            if compaction:
+                logging.info(f"Transcript compaction saved ~{compaction['saved_tokens']} prompt tokens across {compaction['count']} transcripts.")
+            print("\nStage timings (details in run_report.json / run_report.csv):")
+            print(run_metrics.format_summary())
+            run_metrics.write_report(
+                output_folder,
+                extra={"rate_limiter": rate_limiter.metrics(), "set_summaries": summary_writer.stats(),
+                       **({"models": model_router.stats()} if model_router is not None else {}),
+                       **({"quotes": quote_settings['store'].stats()} if quote_settings is not None else {})},
+                prometheus=config.get('run_report_prometheus', False)
+            )
 
 
     except FileNotFoundError:
@@ -166,18 +341,371 @@ def run_pundit_analyzer(config_path="config.yaml", cli_output_folder=None):
         logging.info(f"Total execution time: {end_time - start_time:.2f} seconds.")
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Compare Early vs. Retrospective YouTube videos using Gemini.")
+# --- Distributed Mode ---
+def run_coordinator(config_path="config.yaml", queue_path=None, cli_output_folder=None, wait=False, cli_video_sets_file=None):
+    """Enqueues every set of the config into the shared job queue; optionally waits and prints the summaries."""
+    config = load_config(config_path)
+    distributed_config = config.get('distributed') or {}
+    queue = open_job_queue(queue_path or distributed_config.get('queue_path', '.cache/jobs.sqlite'),
+                           max_attempts=distributed_config.get('max_attempts', 3),
+                           shared_filesystem=distributed_config.get('shared_filesystem'))
+    try:
+        video_sets, _ = setup_video_sets(config, cli_video_sets_file)
+        enqueue_video_sets(queue, video_sets, signatures=job_signatures(config))
+        if not wait:
+            logging.info(f"Job counts: {queue.counts()}. Start workers with: python main.py worker --config {config_path}")
+            return
+        wait_for_queue(
+            queue, poll_interval=distributed_config.get('poll_interval', 10),
+            on_progress=lambda counts: logging.info(f"Job counts: {counts}")
+        )
+        output_folder = resolve_output_folder(config, cli_output_folder)
+        summary_writer = SetSummaryWriter(output_folder)
+        try:
+            for job in queue.finished_jobs("compare"):
+                if job['status'] == 'done':
+                    summary_writer.write(job['result'])
+                    print_set_summary(job['result'], output_folder)
+                else:
+                    logging.error(f"Set '{job['set_name']}' failed: {job['error']}")
+                    summary_writer.write({"subject": job['set_name'], "error": f"Processing failed: {job['error']}"})
+        finally:
+            summary_writer.close()
+        logging.info(f"Set summaries: {summary_writer.stats()}")
+    finally:
+        queue.close()
+
+def run_worker(config_path="config.yaml", queue_path=None, cli_output_folder=None, refresh_transcripts=False,
+               concurrency=None, keep_running=False):
+    """Processes jobs from the shared queue with this machine's API key until the queue is drained."""
+    start_time = time.time()
+    config = load_config(config_path)
+    distributed_config = config.get('distributed') or {}
+    api_key = get_api_key(config) # Each worker machine uses its own key and quota
+    output_folder = resolve_output_folder(config, cli_output_folder) # Shared storage for result files
+    components = setup_components(config, api_key, output_folder, refresh_transcripts)
+    run_metrics = enable_metrics() if config.get('run_report', True) else None
+    queue = open_job_queue(queue_path or distributed_config.get('queue_path', '.cache/jobs.sqlite'),
+                           max_attempts=distributed_config.get('max_attempts', 3),
+                           shared_filesystem=distributed_config.get('shared_filesystem'))
+    worker = Worker(
+        queue, components, output_folder,
+        concurrency=concurrency or distributed_config.get('worker_concurrency', config.get('max_workers', 4)),
+        lease_seconds=distributed_config.get('lease_seconds', 600),
+        poll_interval=distributed_config.get('poll_interval', 10),
+        exit_when_idle=not keep_running
+    )
+    try:
+        worker.run()
+    finally:
+        queue.close()
+        if components['model_router'] is not None:
+            components['model_router'].close()
+        if components['structured_settings'] is not None:
+            components['structured_settings']['index'].close()
+    logging.info(f"Rate limiter: {components['rate_limiter'].metrics()}")
+    if run_metrics is not None:
+        print(run_metrics.format_summary())
+        run_metrics.write_report(
+            os.path.join(output_folder, "worker_reports", worker.worker_id),
+            extra={"rate_limiter": components['rate_limiter'].metrics(), "worker": worker.worker_id,
+                   **({"models": components['model_router'].stats()} if components['model_router'] is not None else {}),
+                   **({"quotes": components['quote_settings']['store'].stats()} if components['quote_settings'] is not None else {})},
+            prometheus=config.get('run_report_prometheus', False)
+        )
+        run_metrics.close()
+    logging.info(f"Worker finished in {time.time() - start_time:.2f} seconds.")
+
+
+# --- Offline Plan ---
+def run_plan(config_path="config.yaml", cli_output_folder=None, refresh_transcripts=False, use_async=False, resume=False,
+             cli_video_sets_file=None) -> bool:
+    """
+    Validates the config, prompt files and video sets, then prints the stage DAG with token,
+    cost and time estimates. Never calls YouTube or the LLM (nor imports their clients).
+    Returns False if any problem was found.
+    """
+    config = load_config(config_path)
+    errors, warnings = validate_config(config)
+    for warning in warnings:
+        print(f"WARNING: {warning}")
+    if errors:
+        for error in errors:
+            print(f"ERROR: {error}")
+        print(f"\n{len(errors)} configuration errors; fix them to get a run estimate.")
+        return False
+
+    # Same folder as the run would use (not created here); its run manifest matters with --resume
+    output_folder = cli_output_folder or config.get('output_folder', 'analysis_results')
+    try:
+        video_sets = iter_planned_video_sets(config, cli_video_sets_file)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return False
+    plan = build_plan(config, video_sets, output_folder, resume=resume, refresh_transcripts=refresh_transcripts, use_async=use_async)
+    for problem in plan['set_problems']:
+        print(f"ERROR: {problem}")
+    if plan['invalid_sets'] > len(plan['set_problems']):
+        print(f"ERROR: ... and {plan['invalid_sets'] - len(plan['set_problems'])} more invalid sets")
+    print(format_plan(config, plan, use_async))
+    return plan['invalid_sets'] == 0
+
+
+# --- Results Query ---
+def print_query_results(rows: list):
+    """Prints matching takeaways/verdicts, one block per match."""
+    for row in rows:
+        grade = row['verdict'] or row['confidence'] or "-"
+        where = f" @ {row['timestamp']}" if row['timestamp'] else ""
+        print(f"[{grade}] {row['label']} ({row['kind']}{', ' + row['pundit'] if row['pundit'] else ''})")
+        print(f"  {row['topic']}{where}")
+        print(f"  {' '.join((row['snippet'] or '').split())}")
+        print(f"  {row['file']}")
+
+def run_query(config_path="config.yaml", cli_output_folder=None, index_path=None, text=None, pundit=None, subject=None,
+              verdict=None, kind=None, limit=20, count_by=None, as_json=False, reindex=False) -> bool:
+    """
+    Searches the results index built by structured output (see 'structured_output' in
+    config.yaml). With reindex, the index is first rebuilt from the JSON records in the
+    output folder. Returns False if the index is missing or the query is invalid.
+    """
+    config = load_config(config_path)
+    output_folder = cli_output_folder or config.get('output_folder', 'analysis_results')
+    index_path = index_path or results_index_path(config, output_folder)
+    if not reindex and not os.path.exists(index_path):
+        print(f"No results index at {index_path}. Enable 'structured_output' and run, or use --reindex.")
+        return False
+    index = ResultsIndex(index_path)
+    try:
+        if reindex:
+            index.ingest_folder(output_folder)
+        query_start = time.perf_counter()
+        filters = {"text": text, "pundit": pundit, "subject": subject, "verdict": verdict, "kind": kind}
+        try:
+            results = index.count(count_by, **filters) if count_by else index.search(limit=limit, **filters)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        elapsed_ms = (time.perf_counter() - query_start) * 1000
+        if as_json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        elif count_by:
+            for value, count in results.items():
+                print(f"{count:>7}  {value if value is not None else '(none)'}")
+            print(f"\n{sum(results.values())} matches in {elapsed_ms:.1f} ms ({index.stats()['documents']} indexed results).")
+        else:
+            print_query_results(results)
+            print(f"\n{len(results)} matches shown in {elapsed_ms:.1f} ms ({index.stats()['documents']} indexed results).")
+        return True
+    finally:
+        index.close()
+
+
+# --- Quote Verification ---
+def run_verify(config_path="config.yaml", cli_output_folder=None, as_json=False, show=20) -> bool:
+    """
+    Re-checks the quotes of every analysis completed in the output folder (per run_manifest.jsonl)
+    against its transcript from the transcript cache, compacted with the current preprocess
+    settings, without calling any API. Analyses whose transcript is not cached are skipped.
+    Returns False if a quote was not found in its transcript.
+    """
+    config = load_config(config_path)
+    output_folder = cli_output_folder or config.get('output_folder', 'analysis_results')
+    transcript_cache = setup_transcript_cache(config)
+    if transcript_cache is None:
+        print("Quote verification needs the transcripts: set 'transcript_cache_dir' in the config file.")
+        return False
+    quote_settings = setup_quote_check({**config, 'quote_check': {**(config.get('quote_check') or {}), 'enabled': True}}, transcript_cache)
+    preprocess_settings = setup_preprocessing(config)
+    manifest = RunManifest(output_folder, resume=True)
+    verify_start = time.perf_counter()
+    results, skipped = [], 0
+    for record in manifest.completed(("Early_take", "Retrospective")):
+        if not record['set'].startswith("video:"):
+            skipped += 1 # Analyses journaled per set (before per-video analyses) have no video id
+            continue
+        video_id = record['set'][len("video:"):]
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        transcript = transcript_cache.get(url)
+        try:
+            with open(record['output_file'], 'r', encoding='utf-8') as f:
+                analysis = f.read()
+        except (OSError, TypeError):
+            transcript = None
+        if transcript is None:
+            skipped += 1
+            continue
+        transcript = preprocess_transcript(transcript, preprocess_settings, url)
+        index = quote_settings['store'].index_for(video_id, transcript)
+        for result in match_quotes(index, extract_quotes(analysis), quote_settings):
+            results.append({"video_id": video_id, "stage": record['stage'], "file": record['output_file'], **result})
+    elapsed = time.perf_counter() - verify_start
+    summary = summarize_matches(results)
+    flagged = [result for result in results if result['status'] == "not_found" or result['timestamp_ok'] is False]
+    if as_json:
+        print(json.dumps({"summary": summary, "flagged": flagged}, ensure_ascii=False, indent=2))
+    else:
+        for result in flagged[:show]:
+            where = f"at {result['transcript_timestamp']}, not {result['timestamp']}" if result['status'] != "not_found" else "NOT FOUND"
+            print(f"[{where}] {result['stage']} {result['video_id']}: \"{result['quote'][:100]}\"")
+            print(f"  {result['file']}:{result['line']}")
+        if len(flagged) > show:
+            print(f"... and {len(flagged) - show} more flagged quotes")
+        print(f"\n{summary['quotes']} quotes checked in {elapsed:.2f} s: {summary['verified']} verified, {summary['fuzzy']} fuzzy, "
+              f"{summary['not_found']} not found, {summary['timestamp_mismatches']} timestamp mismatches "
+              f"({skipped} analyses skipped; indexes: {quote_settings['store'].stats()['indexes_built']} built, "
+              f"{quote_settings['store'].stats()['indexes_loaded']} loaded).")
+    return summary['not_found'] == 0
+
+
+# --- Command Line ---
+def add_common_arguments(parser, suppress_defaults=False):
+    """Options shared by all commands. Subcommands suppress defaults so top-level values are kept."""
+    default = (lambda value: argparse.SUPPRESS) if suppress_defaults else (lambda value: value)
     parser.add_argument(
         "--config",
-        default="config.yaml",
+        default=default("config.yaml"),
         help="Path to the configuration YAML file (default: config.yaml)"
     )
     parser.add_argument(
         "--output-folder",
-        default=None, # Default is None, indicating use value from config file
+        default=default(None), # Default is None, indicating use value from config file
         help="Path to the folder where analysis results (.md files) will be saved. Overrides 'output_folder' in the config file if provided."
     )
+    parser.add_argument(
+        "--refresh-transcripts",
+        action="store_true",
+        default=default(False),
+        help="Ignore cached transcripts and re-fetch them from YouTube (the cache is updated with the fresh copies)."
+    )
+
+def add_run_arguments(parser, suppress_defaults=False):
+    """Options of the default 'run' command."""
+    default = (lambda value: argparse.SUPPRESS) if suppress_defaults else (lambda value: value)
+    parser.add_argument(
+        "--invalidate-prompt",
+        action="append",
+        default=default(None),
+        metavar="PROMPT_FILE",
+        help="Drop cached LLM responses produced with any recorded version of the given prompt file before running (can be repeated)."
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        default=default(False),
+        help="Run all sets on a single asyncio event loop (async LLM calls, bounded by 'async_max_concurrency') instead of thread pools."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=default(False),
+        help="Resume a previous run in the same output folder: stages recorded as completed in run_manifest.jsonl (with unchanged inputs) are loaded from their saved files instead of calling the LLM again."
+    )
+
+def add_video_sets_argument(parser, suppress_defaults=False):
+    parser.add_argument(
+        "--video-sets-file",
+        default=argparse.SUPPRESS if suppress_defaults else None,
+        metavar="PATH",
+        help="Stream video sets from a JSONL, CSV or playlist-export file instead of 'video_sets' in the config file. Overrides 'video_sets_file' if provided."
+    )
+
+def add_queue_argument(parser):
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Path to the shared job queue database. Overrides 'distributed.queue_path' in the config file if provided."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Early vs. Retrospective YouTube videos using Gemini.")
+    add_common_arguments(parser)
+    add_run_arguments(parser)
+    add_video_sets_argument(parser)
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    run_parser = subparsers.add_parser("run", help="Process all video sets in this process (default).")
+    add_common_arguments(run_parser, suppress_defaults=True)
+    add_run_arguments(run_parser, suppress_defaults=True)
+    add_video_sets_argument(run_parser, suppress_defaults=True)
+
+    coordinate_parser = subparsers.add_parser("coordinate", help="Enqueue all video sets into the shared job queue for workers.")
+    add_common_arguments(coordinate_parser, suppress_defaults=True)
+    add_video_sets_argument(coordinate_parser, suppress_defaults=True)
+    add_queue_argument(coordinate_parser)
+    coordinate_parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Wait until workers have drained the queue, then print the per-set summaries."
+    )
+
+    plan_parser = subparsers.add_parser(
+        "plan",
+        help="Validate the config and prompt files and estimate tokens, cost and time of a run, without calling any API. "
+             "Accepts the options of 'run', so the planned command can be run as is."
+    )
+    add_common_arguments(plan_parser, suppress_defaults=True)
+    add_run_arguments(plan_parser, suppress_defaults=True)
+    add_video_sets_argument(plan_parser, suppress_defaults=True)
+
+    query_parser = subparsers.add_parser(
+        "query",
+        help="Search the takeaways and verdicts of all structured results (requires 'structured_output'). No API calls."
+    )
+    add_common_arguments(query_parser, suppress_defaults=True)
+    query_parser.add_argument(
+        "text",
+        nargs="?",
+        default=None,
+        help='Full-text query over topics, takes and quotes (SQLite FTS5 syntax: words, "exact phrases", OR, prefix*).'
+    )
+    query_parser.add_argument("--pundit", default=None, help="Only results of this pundit.")
+    query_parser.add_argument("--subject", default=None, help="Only results of this set subject.")
+    query_parser.add_argument("--verdict", default=None, help="Only comparison verdicts with this grade, e.g. 'Completely Wrong'.")
+    query_parser.add_argument("--kind", choices=("takeaways", "comparison"), default=None, help="Only analyses (takeaways) or comparisons (verdicts).")
+    query_parser.add_argument("--limit", type=int, default=20, help="Maximum number of matches shown (default: 20).")
+    query_parser.add_argument(
+        "--count-by",
+        choices=COUNT_COLUMNS,
+        default=None,
+        help="Print the number of matches per value of this field instead of the matches, e.g. --count-by verdict."
+    )
+    query_parser.add_argument("--json", dest="as_json", action="store_true", help="Print results as JSON.")
+    query_parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Rebuild the index from the .json records in the output folder first (e.g. after copying results from workers)."
+    )
+    query_parser.add_argument(
+        "--index",
+        default=None,
+        help="Path to the results index. Overrides 'structured_output.index_path' in the config file if provided."
+    )
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Check the quotes of all completed analyses against their cached transcripts and list the ones not found. No API calls."
+    )
+    add_common_arguments(verify_parser, suppress_defaults=True)
+    verify_parser.add_argument("--show", type=int, default=20, help="Maximum number of flagged quotes printed (default: 20).")
+    verify_parser.add_argument("--json", dest="as_json", action="store_true", help="Print the totals and flagged quotes as JSON.")
+
+    worker_parser = subparsers.add_parser("worker", help="Process jobs from the shared job queue with this machine's API key.")
+    add_common_arguments(worker_parser, suppress_defaults=True)
+    add_queue_argument(worker_parser)
+    worker_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Number of jobs processed at once. Overrides 'distributed.worker_concurrency' in the config file if provided."
+    )
+    worker_parser.add_argument(
+        "--keep-running",
+        action="store_true",
+        help="Keep polling for new jobs instead of exiting when the queue is drained."
+    )
     args = parser.parse_args()
 
     # Check if config file exists before proceeding
@@ -185,4 +713,64 @@ if __name__ == "__main__":
          print(f"Error: Configuration file not found at '{args.config}'")
          sys.exit(1)
 
-    run_pundit_analyzer(config_path=args.config, cli_output_folder=args.output_folder)
+    if args.command == "plan":
+        valid = run_plan(
+            config_path=args.config,
+            cli_output_folder=args.output_folder,
+            refresh_transcripts=args.refresh_transcripts,
+            use_async=args.use_async,
+            resume=args.resume,
+            cli_video_sets_file=args.video_sets_file
+        )
+        sys.exit(0 if valid else 1)
+    elif args.command == "query":
+        ok = run_query(
+            config_path=args.config,
+            cli_output_folder=args.output_folder,
+            index_path=args.index,
+            text=args.text,
+            pundit=args.pundit,
+            subject=args.subject,
+            verdict=args.verdict,
+            kind=args.kind,
+            limit=args.limit,
+            count_by=args.count_by,
+            as_json=args.as_json,
+            reindex=args.reindex
+        )
+        sys.exit(0 if ok else 1)
+    elif args.command == "verify":
+        ok = run_verify(
+            config_path=args.config,
+            cli_output_folder=args.output_folder,
+            as_json=args.as_json,
+            show=args.show
+        )
+        sys.exit(0 if ok else 1)
+    elif args.command == "coordinate":
+        run_coordinator(
+            config_path=args.config,
+            queue_path=args.queue,
+            cli_output_folder=args.output_folder,
+            wait=args.wait,
+            cli_video_sets_file=args.video_sets_file
+        )
+    elif args.command == "worker":
+        run_worker(
+            config_path=args.config,
+            queue_path=args.queue,
+            cli_output_folder=args.output_folder,
+            refresh_transcripts=args.refresh_transcripts,
+            concurrency=args.concurrency,
+            keep_running=args.keep_running
+        )
+    else:
+        run_pundit_analyzer(
+            config_path=args.config,
+            cli_output_folder=args.output_folder,
+            refresh_transcripts=args.refresh_transcripts,
+            invalidate_prompts=args.invalidate_prompt,
+            use_async=args.use_async,
+            resume=args.resume,
+            cli_video_sets_file=args.video_sets_file
+        )
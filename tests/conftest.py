@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# Run from a checkout without installing the package; llama_index is never imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_pundit_analyzer.fakes import FakeMessage
+
+
+class FakePromptTemplate:
+    """Stands in for llama_index's RichPromptTemplate: a system prompt plus the rendered transcript."""
+
+    def __init__(self, system_prompt: str = "You extract takeaways."):
+        self.system_prompt = system_prompt
+
+    def format_messages(self, **kwargs) -> list:
+        system, user = FakeMessage(self.system_prompt), FakeMessage(f"{kwargs.get('subject')}\n\n{kwargs.get('transcript')}")
+        system.role, user.role = "system", "user"
+        return [system, user]
+
+
+@pytest.fixture
+def prompt_template():
+    return FakePromptTemplate()
+
+
+@pytest.fixture
+def make_prompt_template():
+    """Replaces utils.create_chat_prompt_template in modules that render prompt files."""
+    return FakePromptTemplate
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from yt_pundit_analyzer.artifacts import AnalysisArtifacts, set_analyses, set_analysis_keys, set_comparisons
+
+
+def test_set_analyses_and_comparisons():
+    video_set = {"subject": "Set", "pundit": "LSV",
+                 "early_take": [{"url": "https://youtu.be/AAAAAAAAAAA"}, {"url": "https://youtu.be/BBBBBBBBBBB", "pundit": "Marshall"}],
+                 "retrospective": [{"url": "https://youtu.be/AAAAAAAAAAA"}, {"url": "https://youtu.be/AAAAAAAAAAA"}]}
+    assert [(a['key'], a['pundit']) for a in set_analyses(video_set)] == [
+        ("AAAAAAAAAAA:early", "LSV"), ("BBBBBBBBBBB:early", "Marshall"), ("AAAAAAAAAAA:retro", "LSV") # Same video, other prompt
+    ]
+    pairs = set_comparisons(video_set)
+    assert len(pairs) == 4 and pairs[2]['label'] == "Set (BBBBBBBBBBB vs AAAAAAAAAAA)" and pairs[2]['pundit'] == "Marshall"
+    single = {"subject": "Set", "early_take": {"url": "https://youtu.be/AAAAAAAAAAA"}, "retrospective": {"url": "https://youtu.be/CCCCCCCCCCC"}}
+    assert [pair['label'] for pair in set_comparisons(single)] == ["Set"]
+
+
+def test_concurrent_sets_share_one_analysis():
+    artifacts, calls = AnalysisArtifacts(), []
+    artifacts.retain(["v:early"] * 4)
+
+    def analyse():
+        calls.append(1)
+        time.sleep(0.05)
+        return "analysis"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(artifacts.compute("v:early", analyse))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["analysis"] * 4 and len(calls) == 1
+    assert artifacts.stats() == {"analyses_computed": 1, "analyses_reused": 3}
+
+
+def test_results_are_dropped_once_no_set_holds_them():
+    artifacts = AnalysisArtifacts()
+    artifacts.retain(["v:early", "v:early"])
+    artifacts.compute("v:early", lambda: "first")
+    artifacts.release(["v:early"])
+    assert artifacts.compute("v:early", lambda: "second") == "first" # Still held by the other set
+    artifacts.release(["v:early"])
+    assert artifacts.compute("v:early", lambda: "third") == "third"
+
+
+def test_owner_failures_and_cancellation_reach_the_waiters():
+    artifacts = AnalysisArtifacts()
+    with pytest.raises(ValueError):
+        artifacts.compute("a", lambda: (_ for _ in ()).throw(ValueError("bad transcript")))
+    with pytest.raises(ValueError):
+        artifacts.compute("a", lambda: "never run")
+    future, owner = artifacts.claim("b", task_id="analyze:b")
+    assert owner and artifacts.owner_task("b") == "analyze:b"
+    artifacts.cancel_all()
+    with pytest.raises(RuntimeError, match="stopped"):
+        artifacts.claim("b")[0].result()
+    assert set_analysis_keys({"subject": "S", "early_take": {"url": "u"}, "retrospective": {"url": "u"}}) == ["u:early", "u:retro"]
@@ -0,0 +1,40 @@
+import threading
+
+from yt_pundit_analyzer import core
+from yt_pundit_analyzer.async_engine import run_async
+from yt_pundit_analyzer.fakes import FakeGemini, FakeTranscriptReader
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+
+VIDEO_SET = {"subject": "S", "early_take": {"url": "https://youtu.be/EARLY000001"},
+             "retrospective": {"url": "https://youtu.be/RETRO000001"}}
+
+
+class ThreadRecordingGemini(FakeGemini):
+    """Records the thread each achat call runs on."""
+
+    def __init__(self, **kwargs):
+        super().__init__(latency_median=0.01, output_chars=200, **kwargs)
+        self.threads = set()
+
+    async def achat(self, messages, **kwargs):
+        self.threads.add(threading.current_thread().name)
+        return await super().achat(messages, **kwargs)
+
+
+def test_async_stages_run_on_the_event_loop_and_match_the_threaded_results(tmp_path, make_prompt_template):
+    prompts = {"early": make_prompt_template(), "retro": make_prompt_template(), "compare": make_prompt_template("Compare.")}
+    chunk_settings = {"max_chars": 1000, "overlap_chars": 100, "max_parallel": 2, "merge_template": make_prompt_template("Merge.")}
+    reader, llm = FakeTranscriptReader(transcript_chars=3000), ThreadRecordingGemini()
+    threads_before = set(threading.enumerate())
+    results = []
+    run_async([VIDEO_SET], reader, llm, prompts, TokenBucketRateLimiter(1000), str(tmp_path / "async"),
+              lambda subject, summary, exc: results.append((summary, exc)), max_concurrency=4, chunk_settings=chunk_settings)
+    [(summary, exc)] = results
+    assert exc is None and summary['comparison_status'] == "OK"
+    assert llm.calls > 3 # Chunk and merge calls included
+    assert llm.threads == {threading.current_thread().name} # No stage or chunk threads
+    assert not {thread for thread in threading.enumerate() if thread.name.startswith(("Stage", "Chunk"))} - threads_before
+
+    threaded = core.process_video_set(VIDEO_SET, reader, FakeGemini(latency_median=0, output_chars=200), prompts,
+                                      TokenBucketRateLimiter(1000), str(tmp_path / "threaded"), chunk_settings=chunk_settings)
+    assert summary == threaded
@@ -0,0 +1,132 @@
+import os
+import time
+
+from yt_pundit_analyzer import cache
+from yt_pundit_analyzer.cache import TranscriptCache, ResponseCache, configured_prompt_files
+from yt_pundit_analyzer.fakes import FakeGemini
+
+CONFIG = {
+    "early_take_prompt_file": "early.txt", "retrospective_prompt_file": "retro.txt", "compare_prompt_file": "compare.txt",
+    "chunking": {"merge_prompt_file": "merge.txt"}, "rollup": {"prompt_file": "rollup.txt"},
+    "structured_output": {"takeaways_prompt_file": "takeaways.txt", "comparison_prompt_file": "comparison.txt"},
+}
+
+
+# --- Response Cache ---
+def test_configured_prompt_files_include_every_section():
+    assert configured_prompt_files(CONFIG) == [
+        "early.txt", "retro.txt", "compare.txt", "merge.txt", "rollup.txt", "takeaways.txt", "comparison.txt"
+    ]
+    assert configured_prompt_files({"compare_prompt_file": "compare.txt", "rollup": None}) == ["compare.txt"]
+
+
+def test_get_put_and_lru_limit(tmp_path, make_prompt_template):
+    llm = FakeGemini()
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    requests = [make_prompt_template(f"prompt {i}").format_messages(subject="S", transcript="t") for i in range(3)]
+    assert response_cache.get(llm, requests[0]) is None
+    response_cache.put(llm, requests[0], "answer 0")
+    assert response_cache.get(llm, requests[0]) == "answer 0"
+    assert response_cache.get(FakeGemini(model="models/other"), requests[0]) is None # Keyed by model
+    response_cache.put(llm, requests[1], "answer 1")
+    response_cache.get(llm, requests[0]) # Most recently used again
+    response_cache.put(llm, requests[2], "answer 2")
+    assert [response_cache.get(llm, request) for request in requests] == ["answer 0", None, "answer 2"]
+    response_cache.close()
+
+
+def test_invalidating_an_extraction_prompt_drops_all_its_versions(tmp_path, monkeypatch, make_prompt_template):
+    monkeypatch.setattr(cache, "create_chat_prompt_template", make_prompt_template)
+    prompt_file = tmp_path / "takeaways.txt"
+    config = {"structured_output": {"takeaways_prompt_file": str(prompt_file)}}
+    llm = FakeGemini()
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+
+    def answer(version: str) -> list:
+        prompt_file.write_text(version, encoding='utf-8')
+        response_cache.register_prompts(configured_prompt_files(config)) # As setup_response_cache does at startup
+        messages = make_prompt_template(version).format_messages(subject="S", transcript="analysis")
+        response_cache.put(llm, messages, f"json for {version}")
+        return messages
+
+    old, current = answer("Extract takeaways as JSON."), answer("Extract takeaways as strict JSON.")
+    other = make_prompt_template("Compare the takes.").format_messages(subject="S", transcript="analysis")
+    response_cache.put(llm, other, "comparison")
+
+    assert response_cache.invalidate_prompt(str(prompt_file)) == 2
+    assert response_cache.get(llm, old) is None and response_cache.get(llm, current) is None
+    assert response_cache.get(llm, other) == "comparison"
+    response_cache.close()
+
+
+# --- Transcript Cache ---
+def _url(i: int) -> str:
+    return f"https://youtu.be/VIDEO{i:06d}"
+
+
+def _age(transcript_cache, url: str, seconds_ago: float):
+    path = transcript_cache._path(url.rsplit('/', 1)[1])
+    stamp = time.time() - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+def test_round_trip_and_misses(tmp_path):
+    transcript_cache = TranscriptCache(str(tmp_path))
+    assert transcript_cache.get(_url(1)) is None
+    transcript_cache.put(_url(1), "caption text ✓")
+    assert transcript_cache.get(_url(1)) == "caption text ✓"
+    assert transcript_cache.stored_size(_url(1)) == len("caption text ✓".encode('utf-8'))
+    assert transcript_cache.get("not a youtube url") is None
+    assert (transcript_cache.hits, transcript_cache.misses) == (1, 1)
+
+
+def test_corrupt_and_partial_entries_are_misses(tmp_path):
+    transcript_cache = TranscriptCache(str(tmp_path))
+    for i in range(3):
+        transcript_cache.put(_url(i), "caption text " * 200)
+    paths = [transcript_cache._path(_url(i).rsplit('/', 1)[1]) for i in range(3)]
+    with open(paths[0], 'r+b') as f: # Truncated mid-stream
+        f.truncate(os.path.getsize(paths[0]) // 2)
+    with open(paths[1], 'wb') as f: # Not gzip at all
+        f.write(b"garbage")
+    with open(paths[2], 'r+b') as f: # Damaged deflate data (a reserved block type)
+        f.seek(10)
+        f.write(b"\xff")
+    assert [transcript_cache.get(_url(i)) for i in range(3)] == [None, None, None]
+    assert transcript_cache.misses == 3
+
+
+def test_eviction_removes_least_recently_used_first(tmp_path):
+    transcript_cache = TranscriptCache(str(tmp_path))
+    for i in range(4):
+        transcript_cache.put(_url(i), os.urandom(3000).hex()) # Incompressible
+        _age(transcript_cache, _url(i), 100 - i) # 0 is the oldest
+    transcript_cache.get(_url(0)) # Read: becomes the most recently used
+    entry_size = os.path.getsize(transcript_cache._path(_url(1).rsplit('/', 1)[1]))
+    transcript_cache.max_bytes = 2 * entry_size + entry_size // 2
+    assert transcript_cache.evict() == 2
+    assert [transcript_cache.get(_url(i)) is not None for i in range(4)] == [True, False, False, True]
+
+
+def test_age_limit(tmp_path):
+    transcript_cache = TranscriptCache(str(tmp_path), max_age_seconds=50)
+    transcript_cache.put(_url(1), "old")
+    transcript_cache.put(_url(2), "new")
+    _age(transcript_cache, _url(1), 100)
+    assert transcript_cache.get(_url(1)) is None # Expired entries are misses before eviction runs
+    assert transcript_cache.evict() == 1
+    assert transcript_cache.get(_url(2)) == "new"
+
+
+def test_writes_keep_the_cache_under_its_size_cap(tmp_path):
+    transcript_cache = TranscriptCache(str(tmp_path), max_bytes=20000)
+    transcript_cache.evict()
+
+    def on_disk():
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _dirs, files in os.walk(tmp_path) for name in files)
+
+    for i in range(40):
+        transcript_cache.put(_url(i), os.urandom(1000).hex())
+        assert on_disk() <= 20000 + 2500 # At most one entry over before it is trimmed
+    assert transcript_cache.get(_url(39)) is not None # The newest entries survive
+    assert transcript_cache.get(_url(0)) is None
@@ -0,0 +1,42 @@
+from yt_pundit_analyzer.chunking import split_transcript, group_for_merge
+from yt_pundit_analyzer.fakes import FakeTranscriptReader
+
+
+def _transcript(chars: int) -> str:
+    return FakeTranscriptReader(transcript_chars=chars).load_data(["https://youtu.be/CHUNKTEST01"])[0].text
+
+
+def test_short_transcript_is_one_chunk():
+    transcript = _transcript(500)
+    assert split_transcript(transcript, 10000, 200) == [transcript]
+
+
+def test_chunks_fit_and_keep_lines_whole_and_in_order():
+    transcript = _transcript(20000)
+    chunks = split_transcript(transcript, 2000)
+    assert len(chunks) > 5
+    assert all(len(chunk) <= 2000 for chunk in chunks)
+    assert [line for chunk in chunks for line in chunk.splitlines()] == transcript.splitlines()
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    chunks = split_transcript(_transcript(20000), 2000, overlap_chars=300)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        first_line = chunk.splitlines()[0]
+        assert first_line in previous.splitlines()[-10:]
+        assert len(chunk) <= 2000
+
+
+def test_long_lines_are_split_on_sentences_then_hard_cut():
+    line = "First sentence here. " + "x" * 250
+    chunks = split_transcript(line, 100)
+    assert chunks[0] == "First sentence here."
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks[1:]) == "x" * 250
+
+
+def test_group_for_merge():
+    partials = ["a" * 40, "b" * 40, "c" * 40, "d" * 100, "e" * 10]
+    assert group_for_merge(partials, 100) == [["a" * 40, "b" * 40], ["c" * 40], ["d" * 100], ["e" * 10]]
+    assert group_for_merge([], 100) == []
+    assert sum(group_for_merge(partials, 10), []) == partials # Oversized partials still get a group each
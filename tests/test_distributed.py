@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from yt_pundit_analyzer import distributed
+from yt_pundit_analyzer.distributed import Worker, _is_transient_error_result
+from yt_pundit_analyzer.jobqueue import open_job_queue
+
+
+@pytest.mark.parametrize("result, transient", [
+    ("Error analyzing Early_take: 429 RESOURCE_EXHAUSTED", True),
+    ("Error analyzing Retrospective: 503 Service Unavailable", True),
+    ("Error fetching transcript: Read timed out.", True),
+    ("Error comparing analyses: Connection reset by peer", True),
+    ("Error: Cannot compare due to error in one or both preceding analyses.", False),
+    ("Error: Transcript unavailable.", False),
+    ("Error fetching transcript: No documents found.", False),
+    ("Error: Empty response from LLM.", False),
+    ("A fine analysis mentioning a 503 timeout", False),
+])
+def test_transient_error_results(result, transient):
+    assert _is_transient_error_result(result) is transient
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = open_job_queue(str(tmp_path / "jobs.sqlite"), max_attempts=3)
+    yield queue
+    queue.close()
+
+
+def _work(queue, monkeypatch, results):
+    calls = []
+    monkeypatch.setattr(distributed, "run_job", lambda job, deps, components, folder: calls.append(job['job_id']) or results.pop(0))
+    queue.enqueue([{"job_id": "analyze:a", "set_name": "S", "stage": "analyze", "payload": {}, "priority": 0, "deps": []}])
+    worker = Worker(queue, {}, "unused", worker_id="w1")
+    while (job := queue.claim("w1", 60)) is not None:
+        worker._run_one(job)
+    return calls
+
+
+def test_deterministic_errors_are_not_retried(queue, monkeypatch):
+    calls = _work(queue, monkeypatch, ["Error: Transcript unavailable."])
+    assert calls == ["analyze:a"]
+    assert queue.results(["analyze:a"]) == {"analyze:a": "Error: Transcript unavailable."}
+
+
+def test_transient_errors_are_retried(queue, monkeypatch):
+    calls = _work(queue, monkeypatch, ["Error analyzing Early_take: 429 Too Many Requests", "Analysis"])
+    assert calls == ["analyze:a", "analyze:a"]
+    assert queue.results(["analyze:a"]) == {"analyze:a": "Analysis"}
+
+
+def test_heartbeat_survives_queue_errors(queue):
+    beats = []
+
+    class FlakyQueue:
+        def heartbeat(self, job_ids, worker_id, lease_seconds):
+            beats.append(job_ids)
+            if len(beats) == 1:
+                raise RuntimeError("database is locked")
+            return job_ids
+
+    worker = Worker(FlakyQueue(), {}, "unused", worker_id="w1", lease_seconds=0.03)
+    worker._active.add("analyze:a")
+    thread = threading.Thread(target=worker._heartbeat)
+    thread.start()
+    while len(beats) < 3:
+        thread.join(0.01)
+    worker._stop.set()
+    thread.join()
+    assert beats[:3] == [["analyze:a"]] * 3
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from yt_pundit_analyzer.jobqueue import JobQueue, open_job_queue
+
+
+def _job(job_id, deps=(), priority=0):
+    return {"job_id": job_id, "set_name": "S", "stage": job_id.split(':')[0], "payload": {"id": job_id},
+            "priority": priority, "deps": list(deps)}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = open_job_queue(str(tmp_path / "jobs.sqlite"), max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_enqueue_ignores_existing_ids(queue):
+    assert queue.enqueue([_job("analyze:a"), _job("analyze:b")]) == 2
+    assert queue.enqueue([_job("analyze:a"), _job("analyze:c")]) == 1
+    assert queue.counts()['queued'] == 3
+
+
+def test_jobs_wait_for_their_dependencies(queue):
+    queue.enqueue([_job("compare:x", deps=["analyze:a", "analyze:b"]), _job("analyze:a"), _job("analyze:b", priority=1)])
+    first = queue.claim("w1", 60)
+    second = queue.claim("w1", 60)
+    assert [first['job_id'], second['job_id']] == ["analyze:a", "analyze:b"]
+    assert queue.claim("w1", 60) is None # compare:x still waits on both
+    assert queue.complete("analyze:a", "w1", "A")
+    assert queue.claim("w2", 60) is None
+    assert queue.complete("analyze:b", "w1", "B")
+    compare = queue.claim("w2", 60)
+    assert compare['job_id'] == "compare:x" and compare['deps'] == ["analyze:a", "analyze:b"]
+    assert queue.results(compare['deps']) == {"analyze:a": "A", "analyze:b": "B"}
+
+
+def test_only_the_lease_owner_can_finish_a_job(queue):
+    queue.enqueue([_job("analyze:a")])
+    job = queue.claim("w1", 0.05)
+    time.sleep(0.1)
+    taken_over = queue.claim("w2", 60) # The lease of w1 expired
+    assert taken_over['job_id'] == job['job_id'] and taken_over['attempt'] == 2
+    assert not queue.complete("analyze:a", "w1", "late result")
+    assert queue.heartbeat(["analyze:a"], "w1", 60) == []
+    assert queue.heartbeat(["analyze:a"], "w2", 60) == ["analyze:a"]
+    assert queue.complete("analyze:a", "w2", "result")
+    assert queue.results(["analyze:a"]) == {"analyze:a": "result"}
+
+
+def test_failures_are_retried_then_cascade_to_dependents(queue):
+    queue.enqueue([_job("analyze:a"), _job("compare:x", deps=["analyze:a"]), _job("summary:y", deps=["compare:x"])])
+    assert queue.claim("w1", 60)['attempt'] == 1
+    assert queue.fail("analyze:a", "w1", "first error")
+    assert queue.counts()['queued'] == 3
+    assert queue.claim("w1", 60)['attempt'] == 2
+    assert queue.fail("analyze:a", "w1", "final error")
+    assert queue.counts() == {"queued": 0, "leased": 0, "done": 0, "failed": 3}
+    errors = {job['job_id']: job['error'] for stage in ("analyze", "compare", "summary") for job in queue.finished_jobs(stage)}
+    assert errors["analyze:a"] == "final error"
+    assert "analyze:a" in errors["compare:x"] and "compare:x" in errors["summary:y"]
+
+
+def test_expired_final_leases_are_failed_without_recursion(queue):
+    queue.enqueue([_job(f"analyze:{i:04d}") for i in range(1500)] + [_job("analyze:last", priority=1)])
+    for _ in range(2): # Use up every job's attempts with leases that expire at once
+        for _ in range(1500):
+            queue.claim("w1", 0)
+    time.sleep(0.01)
+    assert queue.claim("w2", 60)['job_id'] == "analyze:last"
+    assert queue.counts()['failed'] == 1500
+
+
+def test_finished_jobs_pages_through_results(queue):
+    queue.enqueue([_job(f"analyze:{i:03d}") for i in range(7)])
+    for _ in range(7):
+        job = queue.claim("w1", 60)
+        queue.complete(job['job_id'], "w1", job['payload']['id'])
+    finished = list(queue.finished_jobs("analyze", page_size=3))
+    assert [job['result'] for job in finished] == [f"analyze:{i:03d}" for i in range(7)]
+
+
+def test_job_queue_is_abstract():
+    with pytest.raises(TypeError):
+        JobQueue()
+
+
+@pytest.mark.parametrize("shared_filesystem, journal_mode", [(False, "wal"), (True, "delete")])
+def test_shared_filesystems_use_the_rollback_journal(tmp_path, shared_filesystem, journal_mode):
+    queue = open_job_queue(str(tmp_path / "jobs.sqlite"), shared_filesystem=shared_filesystem)
+    try:
+        assert queue._conn.execute("PRAGMA journal_mode").fetchone()[0] == journal_mode
+    finally:
+        queue.close()
@@ -0,0 +1,52 @@
+import csv
+import json
+
+from yt_pundit_analyzer import metrics
+from yt_pundit_analyzer.metrics import RunMetrics, RESERVOIR_SIZE
+
+
+def test_in_memory_summary_is_exact():
+    run_metrics = RunMetrics()
+    for wall in range(1, 101):
+        run_metrics.record("llm", float(wall), set="S", wait_seconds=wall / 10, input_tokens=10, cache_hit=wall % 2 == 0)
+    stats = run_metrics.summary()["llm"]
+    assert (stats['count'], stats['wall_p50'], stats['wall_p95'], stats['wall_max'], stats['wall_total']) == (100, 50, 95, 100, 5050)
+    assert (stats['wait_p95'], stats['input_tokens'], stats['cache_hits']) == (9.5, 1000, 50)
+    assert len(run_metrics.events()) == 100
+
+
+def test_streamed_events_keep_bounded_aggregates(tmp_path):
+    run_metrics = RunMetrics(str(tmp_path / "run_report.csv"))
+    events = 3 * RESERVOIR_SIZE
+    for i in range(events):
+        run_metrics.record("analyze", (i % 1000) / 100, set="S", wait_seconds=0.5)
+    assert run_metrics.events() == []
+    aggregates = run_metrics._aggregates["analyze"]
+    assert len(aggregates['walls'].samples) == RESERVOIR_SIZE and len(aggregates['waits'].samples) == RESERVOIR_SIZE
+    stats = run_metrics.summary()["analyze"]
+    assert stats['count'] == events and stats['wall_max'] == 9.99
+    assert abs(stats['wall_p50'] - 5.0) < 0.5 and abs(stats['wall_p95'] - 9.5) < 0.3 # Sampled percentiles
+    assert stats['wait_p50'] == 0.5
+
+
+def test_report_after_close(tmp_path):
+    run_metrics = RunMetrics(str(tmp_path / "run_report.csv"))
+    run_metrics.record("fetch", 0.25, set="S", transcript_chars=100)
+    run_metrics.close()
+    run_metrics.record("fetch", 0.75, set="S") # After close: aggregated, not written
+    report = json.loads(open(run_metrics.write_report(str(tmp_path), extra={"rate_limiter": {"acquired": 2}}, prometheus=True)).read())
+    assert report['stages']['fetch']['count'] == 2 and report['events_file'] == run_metrics.events_path
+    with open(tmp_path / "run_report.csv", newline='', encoding='utf-8') as f:
+        assert [row['wall_seconds'] for row in csv.DictReader(f)] == ["0.25"]
+    assert "pundit_rate_limiter_acquired 2" in (tmp_path / "run_report.prom").read_text(encoding='utf-8')
+
+
+def test_events_are_attributed_to_the_current_set():
+    recorder = metrics.enable_metrics()
+    try:
+        metrics.bind_set("Set A", lambda: metrics.record("compare", 1.0))()
+        with metrics.timed("save"):
+            pass
+        assert [(event['set'], event['stage']) for event in recorder.events()] == [("Set A", "compare"), (None, "save")]
+    finally:
+        metrics._recorder = None
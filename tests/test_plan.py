@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from yt_pundit_analyzer.cache import TranscriptCache
+from yt_pundit_analyzer.plan import build_plan, validate_config
+from yt_pundit_analyzer.ratelimit import estimate_tokens
+from yt_pundit_analyzer.run_manifest import MANIFEST_FILENAME
+
+A, B, C = "https://youtu.be/AAAAAAAAAAA", "https://youtu.be/BBBBBBBBBBB", "https://youtu.be/CCCCCCCCCCC"
+PROMPT = "x" * 400 + ' about "{{ subject }}"'
+
+
+@pytest.fixture
+def config(tmp_path):
+    prompts = {}
+    for name in ("early", "retro", "compare"):
+        path = tmp_path / f"{name}.txt"
+        path.write_text(PROMPT, encoding='utf-8')
+        prompts[name] = str(path)
+    return {"early_take_prompt_file": prompts['early'], "retrospective_prompt_file": prompts['retro'],
+            "compare_prompt_file": prompts['compare'], "rate_limit_calls": 10, "rate_limit_period": 60,
+            "video_sets": [{"subject": "S", "early_take": {"url": A}, "retrospective": {"url": B}}],
+            "plan": {"transcript_chars": 40000, "output_tokens_per_call": 1000, "seconds_per_call": 1,
+                     "input_price_per_million_tokens": 1.0, "output_price_per_million_tokens": 10.0}}
+
+
+def test_valid_config_has_no_errors(config):
+    assert validate_config(config) == ([], [])
+
+
+def test_config_problems_are_reported(config, tmp_path):
+    (tmp_path / "early.txt").write_text("Hello {{ pundit }}", encoding='utf-8')
+    config.update({"rate_limit_calls": 0, "max_workers": "4", "stage_models": {"compare": "ultra"}, "colour": "red",
+                   "chunking": {"enabled": True, "max_chars": 1000, "overlap_chars": 1000}})
+    errors, warnings = validate_config(config)
+    assert any(e.startswith("rate_limit_calls: must be at least 1") for e in errors)
+    assert any(e.startswith("max_workers: must be an integer") for e in errors)
+    assert any("unknown template variables: pundit" in e for e in errors)
+    assert "stage_models.compare: model 'ultra' is not configured under 'models'" in errors
+    assert "chunking.overlap_chars: must be smaller than chunking.max_chars" in errors
+    assert any(w.startswith("colour: unknown setting") for w in warnings)
+
+
+def test_plan_counts_shared_videos_once_and_prices_the_calls(config, tmp_path):
+    sets = config['video_sets'] + [{"subject": "T", "early_take": {"url": A}, "retrospective": [{"url": C}, {"url": B}]},
+                                   {"subject": "bad", "early_take": {"url": "not a url"}, "retrospective": {"url": B}}]
+    plan = build_plan(config, sets, str(tmp_path))
+    assert (plan['sets'], plan['invalid_sets'], plan['videos'], plan['analyses'], plan['comparisons']) == (2, 1, 3, 3, 3)
+    assert plan['calls'] == {"analyze": 3, "compare": 3, "extract": 0, "rollup": 0}
+    per_analysis = estimate_tokens(PROMPT) + 40000 // 4
+    per_comparison = estimate_tokens(PROMPT) + 2 * 1000
+    assert plan['input_tokens'] == 3 * per_analysis + 3 * per_comparison
+    assert plan['cost'] == round(plan['input_tokens'] / 1e6 + 6 * 1000 / 1e6 * 10, 2)
+    assert plan['bottleneck'] == "requests per period" and plan['seconds'] == 6 * 60 / 10
+
+
+def test_plan_uses_cached_sizes_chunking_and_the_resume_manifest(config, tmp_path):
+    cache_dir = tmp_path / "cache"
+    TranscriptCache(str(cache_dir)).put(A, "y" * 250000)
+    (tmp_path / MANIFEST_FILENAME).write_text(
+        json.dumps({"set": "S", "stage": "Analysis", "status": "done"}) + "\n", encoding='utf-8'
+    )
+    config.update({"transcript_cache_dir": str(cache_dir),
+                   "chunking": {"enabled": True, "max_chars": 100000, "overlap_chars": 0}})
+    plan = build_plan(config, config['video_sets'], str(tmp_path), resume=True)
+    assert plan['cached_transcripts'] == 1 and plan['downloads'] == 1
+    assert plan['chunked_analyses'] == 1 and plan['resumed_stages'] == 1
+    assert plan['calls']['analyze'] == 3 + 1 + 1 # Three chunks and their merge, plus the uncached retrospective
+    assert plan['calls']['compare'] == 0
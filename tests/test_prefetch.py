@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from yt_pundit_analyzer.cache import TranscriptCache
+from yt_pundit_analyzer.fakes import FakeDocument
+from yt_pundit_analyzer.prefetch import TranscriptPrefetcher
+
+
+class NoTranscriptFound(Exception):
+    """Named like the youtube_transcript_api error that is not worth retrying."""
+
+
+class RecordingReader:
+    """Returns 'transcript of <id>' per link and records each load_data call; failing ids raise."""
+
+    def __init__(self, failing=(), permanent=False):
+        self.batches = []
+        self.failing = set(failing)
+        self.permanent = permanent
+        self._lock = threading.Lock()
+
+    def load_data(self, ytlinks, **kwargs):
+        with self._lock:
+            self.batches.append(list(ytlinks))
+        if any(url[-11:] in self.failing for url in ytlinks):
+            raise (NoTranscriptFound if self.permanent else RuntimeError)(f"cannot fetch {ytlinks}")
+        return [FakeDocument(f"transcript of {url[-11:]}", url[-11:]) for url in ytlinks]
+
+
+def _url(i) -> str:
+    return f"https://youtu.be/VIDEO{i:06d}"
+
+
+def _prefetcher(reader, **kwargs) -> TranscriptPrefetcher:
+    return TranscriptPrefetcher(reader, max_workers=1, retry_base_delay=0.0, retry_max_delay=0.0, **kwargs)
+
+
+def test_videos_are_fetched_once_in_batches():
+    reader = RecordingReader()
+    prefetcher = _prefetcher(reader, batch_size=2)
+    try:
+        assert prefetcher.start([_url(1), _url(2), _url(1), _url(3)]) == 3
+        assert [prefetcher.get(_url(i)) for i in (1, 2, 3)] == [f"transcript of VIDEO00000{i}" for i in (1, 2, 3)]
+        assert prefetcher.get(_url(4)) == "transcript of VIDEO000004" # Not prefetched: queued on demand
+    finally:
+        prefetcher.close()
+    assert reader.batches == [[_url(1), _url(2)], [_url(3)], [_url(4)]]
+    assert prefetcher.stats() == {"requested": 5, "unique": 4, "cached": 0, "fetched": 4, "failed": 0}
+
+
+def test_a_failing_batch_is_retried_then_fetched_link_by_link():
+    reader = RecordingReader(failing={"VIDEO000002"})
+    prefetcher = _prefetcher(reader, batch_size=3, max_attempts=2)
+    try:
+        prefetcher.start([_url(1), _url(2), _url(3)])
+        results = [prefetcher.get(_url(i)) for i in (1, 2, 3)]
+    finally:
+        prefetcher.close()
+    assert results[0] == "transcript of VIDEO000001" and results[2] == "transcript of VIDEO000003"
+    assert results[1].startswith("Error fetching transcript: cannot fetch")
+    assert reader.batches.count([_url(1), _url(2), _url(3)]) == 2 # One retry of the whole batch
+    assert reader.batches.count([_url(2)]) == 2 and prefetcher.stats()['failed'] == 1
+
+
+def test_permanent_errors_are_not_retried():
+    reader = RecordingReader(failing={"VIDEO000001"}, permanent=True)
+    prefetcher = _prefetcher(reader, batch_size=1, max_attempts=3)
+    try:
+        assert prefetcher.get(_url(1)).startswith("Error fetching transcript")
+    finally:
+        prefetcher.close()
+    assert reader.batches == [[_url(1)]]
+
+
+def test_cached_transcripts_are_not_downloaded(tmp_path):
+    cache = TranscriptCache(str(tmp_path))
+    cache.put(_url(1), "cached transcript")
+    reader = RecordingReader()
+    prefetcher = _prefetcher(reader, transcript_cache=cache)
+    try:
+        prefetcher.start([_url(1), _url(2)])
+        assert prefetcher.get(_url(1)) == "cached transcript"
+        assert prefetcher.get(_url(2)) == "transcript of VIDEO000002"
+    finally:
+        prefetcher.close()
+    assert reader.batches == [[_url(2)]] and cache.get(_url(2)) == "transcript of VIDEO000002"
+
+
+@pytest.mark.parametrize("lookahead", [0, 2])
+def test_prefetch_ahead_stays_within_the_lookahead(lookahead):
+    reader = RecordingReader()
+    prefetcher = _prefetcher(reader, batch_size=1)
+    video_sets = [[_url(2 * i), _url(2 * i + 1)] for i in range(6)]
+    try:
+        for index, video_set in enumerate(prefetcher.prefetch_ahead(iter(video_sets), lookahead, lambda urls: urls)):
+            assert video_set == video_sets[index]
+            with prefetcher._lock:
+                queued = set(prefetcher._futures)
+            assert {url[-11:] for url in video_set} <= queued # The set handed out is always queued
+            assert len(queued) <= 2 * (lookahead + 1)
+            assert all(prefetcher.get(url).startswith("transcript of") for url in video_set)
+            prefetcher.release(video_set)
+    finally:
+        prefetcher.close()
+    assert prefetcher.stats()['unique'] == 12
+
+
+def test_release_keeps_transcripts_still_used_by_another_set():
+    prefetcher = _prefetcher(RecordingReader())
+    try:
+        prefetcher.start([_url(1), _url(2)])
+        prefetcher.start([_url(1)])
+        prefetcher.release([_url(1), _url(2)])
+        with prefetcher._lock:
+            assert set(prefetcher._futures) == {"VIDEO000001"}
+        prefetcher.release([_url(1)])
+        with prefetcher._lock:
+            assert not prefetcher._futures
+    finally:
+        prefetcher.close()
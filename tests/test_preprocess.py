@@ -0,0 +1,76 @@
+import pytest
+
+from yt_pundit_analyzer.preprocess import (compact_transcript, dedupe_lines, merge_lines, parse_lines, preprocess_transcript,
+                                           remove_fillers, setup_preprocessing)
+
+
+def _settings(**preprocess) -> dict:
+    return setup_preprocessing({"preprocess": {"enabled": True, **preprocess}})
+
+
+def test_parse_lines_reads_timestamps():
+    assert parse_lines("[01:02] hello  there\n1:00:05 later\n(0:07.5) bracketed\nno stamp") == [
+        [62, "hello there"], [3605, "later"], [7, "bracketed"], [None, "no stamp"]
+    ]
+
+
+def test_annotations_and_rolling_caption_overlap_are_removed():
+    transcript = (
+        "[00:01] [Music]\n"
+        "[00:02] >> welcome back to the show today\n"
+        "[00:03] back to the show today we talk about green\n"
+        "[00:04] back to the show today we talk about green\n"
+    )
+    assert compact_transcript(transcript, _settings(steps=["annotations", "dedupe"])) == (
+        "welcome back to the show today\nwe talk about green"
+    )
+
+
+def test_dedupe_only_strips_overlaps_of_min_overlap_words():
+    lines = [[0, "I like the red deck"], [1, "red deck is good"], [2, "deck is good and fast"]]
+    assert dedupe_lines(lines, {"min_overlap_words": 3}) == [[0, "I like the red deck"], [1, "red deck is good"],
+                                                             [2, "and fast"]]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Um, so the format is fast.", "so the format is fast."),
+    ("so, uh, the removal is premium", "so, the removal is premium"),
+    ("right, um.", "right."),
+    ("uh", None),
+    ("the drum sounds great", "the drum sounds great"), # Not a standalone filler
+])
+def test_fillers_are_removed_only_where_they_stand_alone(text, expected):
+    result = remove_fillers([[None, text]], {"filler_words": ["um", "uh"]})
+    assert result == ([[None, expected]] if expected is not None else [])
+
+
+def test_drop_segments_up_to_the_end_pattern_or_max_lines():
+    settings = _settings(drop_segments=[{"start": "brought to you by", "end": "back to the draft"},
+                                        {"start": "like and subscribe"}])
+    transcript = "intro\nthis video is brought to you by X\nuse code Y\nback to the draft\nred is good\nlike and subscribe\noutro"
+    assert compact_transcript(transcript, {**settings, "steps": ["drop_segments"]}) == "intro\nred is good\noutro"
+
+
+def test_merge_builds_paragraphs_on_sentence_ends_with_timestamps():
+    lines = [[0, "first part of a thought"], [5, "that ends here."], [10, "a new thought"], [70, "after a minute."]]
+    assert merge_lines(lines, {"paragraph_chars": 30, "timestamp_interval_seconds": 60}) == [
+        [0, "[00:00] first part of a thought that ends here."],
+        [10, "a new thought"],
+        [70, "[01:10] after a minute."],
+    ]
+
+
+def test_preprocess_passes_errors_through_and_falls_back_to_the_raw_transcript():
+    settings = _settings()
+    assert preprocess_transcript("Error fetching transcript: No documents found.", settings) == (
+        "Error fetching transcript: No documents found."
+    )
+    assert preprocess_transcript("[Music]\n[Applause]", settings) == "[Music]\n[Applause]" # Nothing left
+    assert preprocess_transcript("raw", None) == "raw"
+
+
+def test_setup_rejects_unknown_steps_and_ignores_phrases():
+    assert setup_preprocessing({}) is None
+    with pytest.raises(ValueError, match="Unknown preprocess steps"):
+        _settings(steps=["annotations", "translate"])
+    assert _settings(filler_words=["um", "you know"])['filler_words'] == ["um"]
@@ -0,0 +1,68 @@
+import pytest
+
+from yt_pundit_analyzer.quotes import QuoteIndex, QuoteIndexStore, extract_quotes, match_quotes, summarize_matches
+
+TRANSCRIPT = """[00:00:05] welcome back everyone to the draft podcast
+[00:01:10] honestly I think this card is a bomb in every deck
+[00:02:30] green looks deep but blue feels really weak this time
+[00:04:00] the common removal spell is underrated and you want two of them
+"""
+SETTINGS = {"min_similarity": 0.7, "verified_similarity": 0.95, "timestamp_tolerance_seconds": 60}
+
+
+def test_exact_fuzzy_and_missing_quotes():
+    index = QuoteIndex.build(TRANSCRIPT)
+    results = match_quotes(index, [
+        {"quote": "this card is a bomb in every deck", "timestamp": "01:15"},
+        {"quote": "green looks deep and blue feels really weak this time", "timestamp": None},
+        {"quote": "this mechanic will define the whole format", "timestamp": None},
+        {"quote": "a bomb", "timestamp": None},
+    ], SETTINGS)
+    assert [result['status'] for result in results] == ["verified", "fuzzy", "not_found", "too_short"]
+    assert TRANSCRIPT[results[0]['offset']:].startswith("this card is a bomb")
+    assert results[0]['transcript_timestamp'] == "00:01:10" and results[0]['timestamp_ok'] is True
+    assert results[1]['timestamp_ok'] is None # The analysis gave no timestamp
+
+
+def test_timestamp_mismatch_and_summary():
+    index = QuoteIndex.build(TRANSCRIPT)
+    results = match_quotes(index, [{"quote": "the common removal spell is underrated", "timestamp": "00:10:00"}], SETTINGS)
+    assert results[0]['status'] == "verified" and results[0]['timestamp_ok'] is False
+    assert summarize_matches(results) == {"quotes": 1, "verified": 1, "fuzzy": 0, "not_found": 0, "too_short": 0,
+                                          "timestamp_mismatches": 1}
+
+
+def test_saved_index_matches_like_the_built_one(tmp_path):
+    built = QuoteIndex.build(TRANSCRIPT)
+    path = str(tmp_path / "ab" / "abcdefghijk.qidx")
+    built.save(path)
+    loaded = QuoteIndex.load(path)
+    quotes = [{"quote": "welcome back everyone to the draft podcast", "timestamp": "00:00:05"}]
+    assert match_quotes(loaded, quotes, SETTINGS) == match_quotes(built, quotes, SETTINGS)
+    with open(path, 'r+b') as f:
+        f.truncate(40)
+    with pytest.raises(ValueError):
+        QuoteIndex.load(path)
+
+
+def test_store_builds_once_per_transcript(tmp_path):
+    store = QuoteIndexStore(str(tmp_path))
+    store.index_for("abcdefghijk", TRANSCRIPT)
+    store.index_for("abcdefghijk", TRANSCRIPT)
+    store.index_for("abcdefghijk", TRANSCRIPT + "[00:05:00] one more line here\n") # A new text gets its own index
+    assert store.stats() == {"indexes_built": 2, "indexes_loaded": 1}
+
+
+def test_extract_quotes_carries_the_take_timestamp():
+    document = (
+        "## Green\n"
+        "- **Timestamp:** [00:02:30]\n"
+        '- Quote: "green looks deep but blue feels weak"\n'
+        "---\n"
+        'Overall: "no timestamp for this one here"\n'
+    )
+    quotes = extract_quotes(document)
+    assert [(quote['quote'], quote['timestamp']) for quote in quotes] == [
+        ("green looks deep but blue feels weak", "00:02:30"),
+        ("no timestamp for this one here", None),
+    ]
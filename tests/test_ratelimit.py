@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter, estimate_tokens, is_rate_limit_error
+from yt_pundit_analyzer.fakes import ResourceExhausted
+
+
+def test_burst_up_to_capacity_then_refill_rate():
+    limiter = TokenBucketRateLimiter(5, period=0.5) # One request per 0.1s once the burst is spent
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    waited = limiter.acquire()
+    assert 0.05 < waited < 0.3
+    assert limiter.metrics()['acquired'] == 6
+
+
+def test_token_bucket_holds_back_large_prompts():
+    limiter = TokenBucketRateLimiter(1000, tokens_per_minute=6000) # 100 tokens per second
+    limiter.acquire(6000)
+    assert limiter.expected_wait(50) > 0.4
+    waited = limiter.acquire(50)
+    assert 0.4 < waited < 0.8
+    assert limiter.metrics()['estimated_tokens_admitted'] == 6050
+
+
+def test_report_throttled_pauses_and_slows_refill():
+    limiter = TokenBucketRateLimiter(100, period=1, base_backoff=0.2)
+    limiter.report_throttled()
+    assert limiter.metrics()['rate_scale'] == 0.5
+    assert limiter.expected_wait() > 0.15
+    assert limiter.acquire() >= 0.15
+    limiter.report_success()
+    assert limiter.metrics()['rate_scale'] == 0.6
+
+
+def test_threads_and_coroutines_share_one_fifo_queue():
+    limiter = TokenBucketRateLimiter(1, period=0.05)
+    limiter.acquire() # Empty the bucket so every caller below queues
+    order = []
+
+    def in_thread(name):
+        limiter.acquire()
+        order.append(name)
+
+    async def in_coroutine(name):
+        await limiter.acquire_async()
+        order.append(name)
+
+    async def main():
+        threads, tasks = [], []
+        for i in range(6):
+            if i % 2:
+                tasks.append(asyncio.create_task(in_coroutine(i)))
+            else:
+                threads.append(threading.Thread(target=in_thread, args=(i,)))
+                threads[-1].start()
+            await asyncio.sleep(0.01) # Take tickets in order
+        await asyncio.gather(*tasks)
+        for thread in threads:
+            await asyncio.to_thread(thread.join)
+
+    asyncio.run(main())
+    assert order == list(range(6))
+
+
+def test_cancelled_waiter_does_not_block_the_queue():
+    limiter = TokenBucketRateLimiter(1, period=0.2)
+    limiter.acquire()
+
+    async def main():
+        waiting = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.02)
+        waiting.cancel()
+        return await asyncio.wait_for(limiter.acquire_async(), timeout=2)
+
+    assert asyncio.run(main()) < 1
+
+
+def test_helpers():
+    assert estimate_tokens("a" * 400) == 101
+    assert is_rate_limit_error(ResourceExhausted("quota"))
+    assert is_rate_limit_error(RuntimeError("429 Too Many Requests"))
+    assert not is_rate_limit_error(ValueError("bad request"))
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from yt_pundit_analyzer.results_index import ResultsIndex
+
+
+def _takeaways(doc_id, pundit, subject, takes):
+    return {"doc_id": doc_id, "kind": "takeaways", "stage": "Early_take", "subject": subject, "label": subject,
+            "pundit": pundit, "video_id": None, "file": f"{doc_id}.md",
+            "data": {"overview": "", "takeaways": [{"topic": topic, "take": take, "quotes": [], "confidence": "High"}
+                                                   for topic, take in takes]}}
+
+
+def _comparison(doc_id, pundit, verdicts):
+    return {"doc_id": doc_id, "kind": "comparison", "stage": "Comparison", "subject": "Set", "label": "Set",
+            "pundit": pundit, "video_id": None, "file": f"{doc_id}.md",
+            "data": {"overview": "", "verdicts": [{"topic": topic, "initial_take": take, "verdict": verdict}
+                                                  for topic, take, verdict in verdicts]}}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ResultsIndex(str(tmp_path / "results.sqlite"))
+    index.ingest(_takeaways("early:1", "LSV", "Set A", [("Lightning Strike", "premium removal"), ("Green", "the deepest color")]))
+    index.ingest(_comparison("compare:1", "LSV", [("Green", "deepest color", "Highly Accurate"), ("Blue", "weak", "Completely Wrong")]))
+    index.ingest(_comparison("compare:2", "Marshall", [("Aggro", "the best deck", "Partially Accurate")]))
+    yield index
+    index.close()
+
+
+def test_full_text_search_with_filters(index):
+    assert {row['file'] for row in index.search("green")} == {"early:1.md", "compare:1.md"}
+    assert [row['topic'] for row in index.search("green", kind="comparison")] == ["Green"]
+    assert [row['topic'] for row in index.search("removal")] == ["Lightning Strike"]
+    assert [row['pundit'] for row in index.search(verdict="partially accurate")] == ["Marshall"]
+    assert index.search("deep*", pundit="Marshall") == []
+
+
+def test_counts(index):
+    assert index.count("verdict", kind="comparison") == {"Highly Accurate": 1, "Completely Wrong": 1, "Partially Accurate": 1}
+    assert index.count("pundit") == {"LSV": 4, "Marshall": 1}
+    with pytest.raises(ValueError):
+        index.count("file")
+
+
+def test_reingesting_a_document_replaces_its_items(index):
+    index.ingest(_comparison("compare:2", "Marshall", [("Control", "too slow", "Mostly Inaccurate")]))
+    assert index.stats() == {"documents": 3, "items": 5, "ingested": 4}
+    assert index.search("aggro") == []
+    assert [row['topic'] for row in index.search("slow")] == ["Control"]
+
+
+def test_invalid_queries_raise_value_error(index):
+    with pytest.raises(ValueError):
+        index.search('"unbalanced')
+
+
+def test_ingest_folder_reads_saved_records(tmp_path):
+    folder = tmp_path / "out"
+    folder.mkdir()
+    (folder / "a.json").write_text(json.dumps(_takeaways("early:9", "LSV", "Set B", [("Red", "aggressive")])), encoding='utf-8')
+    (folder / "broken.json").write_text("{", encoding='utf-8')
+    (folder / "other.json").write_text(json.dumps({"not": "a record"}), encoding='utf-8')
+    index = ResultsIndex(str(tmp_path / "results.sqlite"))
+    try:
+        assert index.ingest_folder(str(folder)) == 1
+        assert [row['subject'] for row in index.search("aggressive")] == ["Set B"]
+    finally:
+        index.close()
@@ -0,0 +1,63 @@
+import os
+import re
+
+from yt_pundit_analyzer.fakes import FakeChatResponse
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+from yt_pundit_analyzer.rollup import RollupCollector, rollup_pundit, run_rollups
+
+
+class CountingLLM:
+    """Answers each rollup call with the number of sections it was given, and records the calls."""
+    model = "models/counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def chat(self, messages, **kwargs):
+        sections = re.findall(r"^## (.+)$", messages[-1].content, re.MULTILINE)
+        self.calls.append(sections)
+        return FakeChatResponse(f"summary of {len(sections)}", 10, 10)
+
+
+def _collector(tmp_path, comparisons) -> RollupCollector:
+    collector = RollupCollector(str(tmp_path))
+    for subject, pundit, status in comparisons:
+        collector.add_set({"subject": subject, "comparisons": [
+            {"pundit": pundit, "comparison_status": status, "comparison": f"{subject} verdicts " + "x" * 80}
+        ]})
+    return collector
+
+
+def test_collector_spools_successful_comparisons_by_pundit(tmp_path):
+    collector = _collector(tmp_path, [("A", "LSV", "OK"), ("B", "Marshall", "OK"), ("C", "LSV", "Error: failed"),
+                                      ("D", None, "OK"), ("E", "LSV", "OK")])
+    try:
+        assert collector.pundits() == {"LSV": 2, "Marshall": 1}
+        assert [record['subject'] for record in collector.read("LSV")] == ["A", "E"]
+    finally:
+        collector.close()
+
+
+def test_rollup_reduces_level_by_level(tmp_path, prompt_template):
+    collector = _collector(tmp_path, [(f"Set {i}", "LSV", "OK") for i in range(5)])
+    llm = CountingLLM()
+    settings = {"template": prompt_template, "max_chars": 250, "workers": 2}
+    try:
+        result = rollup_pundit("LSV", collector.read("LSV"), llm, settings, TokenBucketRateLimiter(1000), str(tmp_path))
+    finally:
+        collector.close()
+    assert [len(sections) for sections in llm.calls] == [2, 2, 1, 3] # Three groups, then their partial rollups
+    assert llm.calls[3] == ["Partial rollup 1 of 3", "Partial rollup 2 of 3", "Partial rollup 3 of 3"]
+    assert result == "summary of 3"
+    assert any(name.endswith("_Rollup.md") for name in os.listdir(tmp_path))
+
+
+def test_groups_that_never_fit_are_combined_in_one_call(tmp_path, prompt_template):
+    collector = _collector(tmp_path, [(f"Set {i}", "LSV", "OK") for i in range(3)])
+    llm = CountingLLM()
+    try:
+        statuses = run_rollups(collector, llm, {"template": prompt_template, "max_chars": 10, "workers": 1},
+                               TokenBucketRateLimiter(1000), str(tmp_path))
+    finally:
+        collector.close()
+    assert statuses == {"LSV": "OK"} and [len(sections) for sections in llm.calls] == [3]
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from yt_pundit_analyzer import core
+from yt_pundit_analyzer.async_engine import achat_with_cache
+from yt_pundit_analyzer.cache import ResponseCache
+from yt_pundit_analyzer.fakes import FakeGemini
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+from yt_pundit_analyzer.routing import ModelRoute, select_route, setup_model_router, stage_model
+
+
+def _route(name, fallback=None, **llm_kwargs):
+    llm = FakeGemini(model=name, latency_median=0, **llm_kwargs)
+    return ModelRoute(name, llm, TokenBucketRateLimiter(1000, max_retries=0), fallback, spill_after_seconds=1.0)
+
+
+@pytest.fixture
+def messages(prompt_template):
+    return prompt_template.format_messages(subject="S", transcript="some transcript")
+
+
+def test_router_assigns_stage_models_and_fallbacks():
+    config = {"llm_model_name": "pro", "rate_limit_calls": 10, "rate_limit_period": 60,
+              "models": {"pro": {"fallback": "flash"}, "flash": {"rate_limit_calls": 100}},
+              "stage_models": {"compare": "flash"}}
+    default_llm, default_limiter = FakeGemini(model="pro"), TokenBucketRateLimiter(10)
+    router = setup_model_router(config, default_llm, default_limiter, lambda name: FakeGemini(model=name))
+    analyze, compare = router.route_for("analyze"), router.route_for("compare")
+    assert [route.name for route in analyze.chain()] == ["pro", "flash"]
+    assert analyze.llm is default_llm and analyze.rate_limiter is default_limiter and not analyze.owns_llm
+    assert compare is analyze.fallback and compare.owns_llm and compare.fallback is None
+    assert stage_model(router, "rollup", default_llm, default_limiter) == (analyze, default_limiter)
+    assert stage_model(None, "rollup", default_llm, default_limiter) == (default_llm, default_limiter)
+    assert setup_model_router({}, default_llm, default_limiter, None) is None
+
+
+@pytest.mark.parametrize("config, message", [
+    ({"stage_models": {"summarize": "pro"}}, "Unknown stage"),
+    ({"stage_models": {"analyze": "ultra"}}, "not configured"),
+    ({"models": {"a": {"fallback": "b"}, "b": {"fallback": "a"}}, "stage_models": {"analyze": "a"}}, "cycle"),
+])
+def test_router_rejects_bad_configs(config, message):
+    with pytest.raises(ValueError, match=message):
+        setup_model_router({"llm_model_name": "pro", **config}, FakeGemini(), TokenBucketRateLimiter(10), FakeGemini)
+
+
+def test_saturated_models_are_skipped():
+    flash = _route("flash")
+    pro = _route("pro", flash)
+    pro.rate_limiter = TokenBucketRateLimiter(1, period=60)
+    assert select_route(pro, 100) is pro
+    pro.rate_limiter.acquire(100) # Its next request would wait a minute
+    assert select_route(pro, 100) is flash and pro.spilled['quota'] == 1
+    assert select_route(pro, 100, skipped={"flash"}) is pro # The last model is always used
+    assert select_route(FakeGemini(), 100) is None
+
+
+def test_rate_limited_requests_spill_over_and_cache_under_the_answering_model(tmp_path, messages):
+    flash = _route("flash")
+    pro = _route("pro", flash, rate_limit_rate=1.0) # Every call is a 429
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    answer = core.chat_with_cache(pro, messages, pro.rate_limiter, "test", response_cache)
+    assert answer.startswith("# Fake takeaways")
+    assert (pro.llm.calls, flash.llm.calls) == (1, 1)
+    assert pro.stats()['spilled_quota'] == 1 and flash.stats()['calls'] == 1
+    assert response_cache.get(flash, messages) == answer and response_cache.get(pro, messages) is None
+    assert core.chat_with_cache(pro, messages, pro.rate_limiter, "test", response_cache) == answer # Served by the fallback's entry
+    assert flash.llm.calls == 1
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_slow_models_spill_over_after_their_latency_budget(messages, use_async):
+    flash = _route("flash")
+    pro = ModelRoute("pro", FakeGemini(model="pro", latency_median=2.0), TokenBucketRateLimiter(1000), flash,
+                     max_latency_seconds=0.1)
+    if use_async:
+        answer = asyncio.run(achat_with_cache(pro, messages, pro.rate_limiter, asyncio.Semaphore(1), "test"))
+    else:
+        answer = core.chat_with_cache(pro, messages, pro.rate_limiter, "test")
+    pro.close()
+    assert answer.startswith("# Fake takeaways")
+    assert pro.stats()['spilled_latency'] == 1 and flash.llm.calls == 1
+
+
+def test_errors_without_a_fallback_are_raised(messages):
+    only = _route("only", rate_limit_rate=1.0)
+    with pytest.raises(Exception, match="429"):
+        core.chat_with_cache(only, messages, only.rate_limiter, "test")
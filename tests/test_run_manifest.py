@@ -0,0 +1,55 @@
+import os
+
+from yt_pundit_analyzer import core
+from yt_pundit_analyzer.fakes import FakeGemini, FakeTranscriptReader
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+from yt_pundit_analyzer.run_manifest import RunManifest, MANIFEST_FILENAME
+
+
+def test_resume_serves_completed_stages_with_matching_inputs(tmp_path):
+    output = tmp_path / "out.md"
+    output.write_text("saved analysis", encoding='utf-8')
+    RunManifest(str(tmp_path)).record("S", "Early_take", "done", input_hash="h1", output_file=str(output))
+
+    assert RunManifest(str(tmp_path)).load_completed("S", "Early_take", "h1") is None # Not resuming
+    manifest = RunManifest(str(tmp_path), resume=True)
+    assert manifest.load_completed("S", "Early_take", "h1") == "saved analysis"
+    assert manifest.load_completed("S", "Early_take", "other inputs") is None
+    assert manifest.load_completed("S", "Retrospective", "h1") is None
+    assert manifest.resumed_stages == 1
+
+
+def test_latest_record_wins_and_truncated_lines_are_skipped(tmp_path):
+    output = tmp_path / "out.md"
+    output.write_text("saved", encoding='utf-8')
+    manifest = RunManifest(str(tmp_path))
+    manifest.record("S", "Comparison", "done", input_hash="h1", output_file=str(output))
+    manifest.record("S", "Comparison", "failed", input_hash="h1")
+    with open(tmp_path / MANIFEST_FILENAME, 'a', encoding='utf-8') as f:
+        f.write('{"set": "S", "stage": "Compa') # Crash mid-write
+
+    resumed = RunManifest(str(tmp_path), resume=True)
+    assert resumed.load_completed("S", "Comparison", "h1") is None
+    assert resumed.completed(("Comparison",)) == []
+
+
+def test_missing_output_file_reruns_the_stage(tmp_path):
+    RunManifest(str(tmp_path)).record("S", "Early_take", "done", input_hash="h1", output_file=str(tmp_path / "gone.md"))
+    assert RunManifest(str(tmp_path), resume=True).load_completed("S", "Early_take", "h1") is None
+
+
+def test_resumed_analysis_skips_the_llm(tmp_path, prompt_template):
+    llm = FakeGemini(latency_median=0)
+    limiter = TokenBucketRateLimiter(1000)
+    transcript = FakeTranscriptReader(transcript_chars=2000).load_data(["https://youtu.be/RESUMETEST1"])[0].text
+
+    def analyze(text, resume):
+        return core.analyze_video("Early_take", "S", text, llm, prompt_template, limiter, str(tmp_path),
+                                  manifest=RunManifest(str(tmp_path), resume=resume), artifact_id="RESUMETEST1")
+
+    first = analyze(transcript, resume=False)
+    assert analyze(transcript, resume=True) == first
+    assert llm.calls == 1
+    analyze(transcript + "\nnew caption line", resume=True) # Changed input: analysed again
+    assert llm.calls == 2
+    assert os.path.exists(tmp_path / MANIFEST_FILENAME)
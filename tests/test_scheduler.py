@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from yt_pundit_analyzer import core
+from yt_pundit_analyzer.artifacts import AnalysisArtifacts, set_analysis_keys
+from yt_pundit_analyzer.scheduler import StageScheduler, UpstreamTaskError
+
+
+def _run(scheduler, feed=None, max_in_flight=None) -> dict:
+    return {task_id: (result, error) for task_id, result, error in scheduler.run(feed, max_in_flight)}
+
+
+def test_dependencies_run_first_and_pass_results_in_order():
+    scheduler = StageScheduler({}, default_pool_size=4)
+    started = []
+
+    def step(name, delay=0.0):
+        def run(*deps):
+            time.sleep(delay)
+            started.append(name)
+            return f"{name}({','.join(deps)})"
+        return run
+
+    scheduler.add_task("fetch:a", "fetch", step("a", 0.05))
+    scheduler.add_task("fetch:b", "fetch", step("b"))
+    scheduler.add_task("analyze:a", "analyze", step("A"), deps=["fetch:a"])
+    scheduler.add_task("compare", "compare", step("C"), deps=["analyze:a", "fetch:b"])
+    results = _run(scheduler)
+    assert results["compare"] == ("C(A(a()),b())", None)
+    assert started.index("C") == 3 and started.index("A") > started.index("a")
+    assert len(scheduler) == 0 # Finished tasks are dropped
+
+
+def test_failed_dependencies_skip_all_dependents():
+    scheduler = StageScheduler({}, default_pool_size=2)
+    ran = []
+
+    def fail():
+        raise RuntimeError("transcript unavailable")
+
+    scheduler.add_task("fetch", "fetch", fail)
+    scheduler.add_task("other", "fetch", lambda: "ok")
+    scheduler.add_task("analyze", "analyze", lambda transcript: ran.append("analyze"), deps=["fetch"])
+    scheduler.add_task("compare", "compare", lambda *results: ran.append("compare"), deps=["analyze", "other"])
+    results = _run(scheduler)
+    assert isinstance(results["fetch"][1], RuntimeError)
+    assert isinstance(results["analyze"][1], UpstreamTaskError) and "fetch" in str(results["analyze"][1])
+    assert isinstance(results["compare"][1], UpstreamTaskError) and "analyze" in str(results["compare"][1])
+    assert results["other"] == ("ok", None)
+    assert ran == []
+
+
+def test_stages_run_on_their_own_pools():
+    scheduler = StageScheduler({"fetch": 1, "analyze": 3})
+    threads = {}
+
+    def record(stage):
+        def run(*_):
+            threads.setdefault(stage, set()).add(threading.current_thread().name)
+            time.sleep(0.02)
+        return run
+
+    for i in range(6):
+        scheduler.add_task(f"fetch:{i}", "fetch", record("fetch"))
+        scheduler.add_task(f"analyze:{i}", "analyze", record("analyze"), deps=[f"fetch:{i}"])
+    _run(scheduler)
+    assert len(threads["fetch"]) == 1 and all(name.startswith("Fetch") for name in threads["fetch"])
+    assert 1 < len(threads["analyze"]) <= 3
+
+
+def test_feed_keeps_a_bounded_window_of_groups():
+    scheduler = StageScheduler({}, default_pool_size=4)
+    registered, most_open = [], 0
+
+    def feed():
+        nonlocal most_open
+        for i in range(10):
+            scheduler.add_task(f"{i}:work", "work", lambda: time.sleep(0.01))
+            registered.append(i)
+            most_open = max(most_open, len(scheduler))
+            yield scheduler.add_task(f"{i}:done", "done", lambda _: i, deps=[f"{i}:work"])
+
+    results = _run(scheduler, feed(), max_in_flight=3)
+    assert registered == list(range(10))
+    assert sum(1 for task_id in results if task_id.endswith(":done")) == 10
+    assert most_open <= 3 * 2
+
+
+def test_registration_errors():
+    scheduler = StageScheduler({})
+    scheduler.add_task("a", "fetch", lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.add_task("a", "fetch", lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.add_task("b", "fetch", lambda _: None, deps=["missing"])
+    assert scheduler.pending("a") and not scheduler.pending("b")
+
+
+def test_sets_sharing_a_video_depend_on_one_analysis(monkeypatch):
+    analysed = []
+    monkeypatch.setattr(core, "fetch_transcript", lambda url, *args: url[-11:])
+    monkeypatch.setattr(core, "analyze_video", lambda video_type, subject, transcript, *args, **kwargs: analysed.append(transcript) or f"A:{transcript}")
+    monkeypatch.setattr(core, "compare_analyses", lambda subject, early, retro, *args, **kwargs: f"{early}|{retro}")
+    video_sets = [{"subject": f"S{i}", "early_take": {"url": "https://youtu.be/EARLYSHARED"},
+                   "retrospective": {"url": f"https://youtu.be/RETRO00000{i}"}} for i in range(4)]
+
+    for window in (1, 4): # Owner finished before the next set is added / still pending
+        analysed.clear()
+        scheduler, artifacts, final_tasks = StageScheduler({}, default_pool_size=1), AnalysisArtifacts(), {}
+        prompts = {"early": None, "retro": None, "compare": None}
+
+        def feed():
+            for index, video_set in enumerate(video_sets):
+                task_id = core.add_video_set_tasks(scheduler, video_set, None, None, prompts, None, "unused",
+                                                   task_prefix=str(index), artifacts=artifacts)
+                final_tasks[task_id] = video_set
+                yield task_id
+
+        summaries = []
+        try:
+            for task_id, result, error in scheduler.run(feed(), max_in_flight=window):
+                if task_id in final_tasks:
+                    artifacts.release(set_analysis_keys(final_tasks.pop(task_id)))
+                    assert error is None
+                    summaries.append(result)
+        finally:
+            artifacts.cancel_all()
+        assert sorted(analysed) == ["EARLYSHARED"] + [f"RETRO00000{i}" for i in range(4)]
+        assert [summary['comparisons'][0]['comparison'] for summary in sorted(summaries, key=lambda s: s['subject'])] == [
+            f"A:EARLYSHARED|A:RETRO00000{i}" for i in range(4)
+        ]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import pytest
+
+from yt_pundit_analyzer import core
+from yt_pundit_analyzer.fakes import FakeGemini
+from yt_pundit_analyzer.ratelimit import TokenBucketRateLimiter
+from yt_pundit_analyzer.streaming import StreamFile, StreamStalled, astream_chat, stream_chat
+
+SETTINGS = {"first_token_timeout_seconds": 0.5, "stall_timeout_seconds": 0.1, "max_stall_retries": 1}
+
+
+class EmptyStreamClient:
+    """Streams no chunks at all, like a response blocked before its first token."""
+    model = "models/empty"
+
+    def stream_chat(self, messages, **kwargs):
+        return iter(())
+
+    async def astream_chat(self, messages, **kwargs):
+        async def stream():
+            return
+            yield
+        return stream()
+
+
+def _stream(use_async, client, stream_file):
+    if use_async:
+        return asyncio.run(astream_chat(client, [], SETTINGS, "test call", stream_file))
+    return stream_chat(client, [], SETTINGS, "test call", stream_file)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_finished_stream_is_committed(tmp_path, use_async):
+    stream_file = StreamFile(str(tmp_path), "out.md")
+    response = _stream(use_async, FakeGemini(latency_median=0), stream_file)
+    with open(stream_file.path, encoding='utf-8') as f:
+        assert f.read() == response.message.content
+    assert not os.path.exists(stream_file.partial_path)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_empty_stream_is_discarded(tmp_path, use_async):
+    stream_file = StreamFile(str(tmp_path), "out.md")
+    assert _stream(use_async, EmptyStreamClient(), stream_file) is None
+    assert not stream_file.committed and os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_stalled_stream_raises_and_keeps_the_partial_file(tmp_path, use_async):
+    stream_file = StreamFile(str(tmp_path), "out.md")
+    client = FakeGemini(latency_median=0, stall_rate=1.0, stall_seconds=1.0)
+    with pytest.raises(StreamStalled, match="stalled"):
+        _stream(use_async, client, stream_file)
+    assert not os.path.exists(stream_file.path)
+    with open(stream_file.partial_path, encoding='utf-8') as f:
+        assert f.read().startswith("# Fake takeaways") # The first chunk arrived
+
+
+def test_empty_stream_gives_the_empty_response_error(tmp_path, prompt_template):
+    result = core.analyze_video("Early_take", "S", "some transcript text", EmptyStreamClient(), prompt_template,
+                                TokenBucketRateLimiter(1000), str(tmp_path), stream_settings=SETTINGS)
+    assert result == "Error: Empty response from LLM."
+    [saved] = os.listdir(tmp_path)
+    with open(tmp_path / saved, encoding='utf-8') as f:
+        assert f.read() == result
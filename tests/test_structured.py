@@ -0,0 +1,41 @@
+import json
+
+from yt_pundit_analyzer.structured import validate_json, parse_structured_output, TAKEAWAYS_SCHEMA, COMPARISON_SCHEMA
+
+TAKEAWAYS = {
+    "overview": "Aggro is the best strategy.",
+    "takeaways": [
+        {"topic": "Lightning Strike", "take": "Premium removal", "timestamp": "00:01:10", "quotes": ["this card is a bomb"], "confidence": "High"},
+        {"topic": "Green", "take": "Looks deep", "category": None, "confidence": None},
+    ],
+}
+
+
+def test_valid_records_have_no_problems():
+    assert validate_json(TAKEAWAYS, TAKEAWAYS_SCHEMA) == []
+    comparison = {"overview": "Mixed.", "verdicts": [{"topic": "Green", "initial_take": "Deep", "verdict": "Highly Accurate"}]}
+    assert validate_json(comparison, COMPARISON_SCHEMA) == []
+
+
+def test_problems_name_the_offending_path():
+    record = {"takeaways": [{"topic": "Green", "take": 3, "quotes": ["ok", 5], "confidence": "Certain"}]}
+    problems = validate_json(record, TAKEAWAYS_SCHEMA)
+    assert "$: missing required key 'overview'" in problems
+    assert "$.takeaways[0].take: must be string, got int" in problems
+    assert "$.takeaways[0].quotes[1]: must be string, got int" in problems
+    assert any(problem.startswith("$.takeaways[0].confidence: must be one of") for problem in problems)
+
+
+def test_booleans_are_not_numbers():
+    assert validate_json(True, {"type": "integer"}) == ["$: must be integer, got bool"]
+    assert validate_json(True, {"type": ["boolean", "null"]}) == []
+    assert validate_json(2, {"type": "number"}) == []
+
+
+def test_parse_structured_output_accepts_fenced_or_bare_json():
+    fenced = f"Here you go:\n```json\n{json.dumps(TAKEAWAYS)}\n```"
+    assert parse_structured_output(fenced, TAKEAWAYS_SCHEMA) == (TAKEAWAYS, [])
+    assert parse_structured_output(f"Sure. {json.dumps(TAKEAWAYS)} Done.", TAKEAWAYS_SCHEMA) == (TAKEAWAYS, [])
+    data, problems = parse_structured_output("not json at all", TAKEAWAYS_SCHEMA)
+    assert data is None and problems[0].startswith("the response is not valid JSON")
+    assert parse_structured_output("", TAKEAWAYS_SCHEMA) == (None, ["the response is empty"])
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from yt_pundit_analyzer.video_sets import (SetSummaryWriter, iter_video_sets_file, set_videos, setup_video_sets,
+                                           video_set_urls)
+
+
+def test_jsonl_sets_stream_lazily_and_skip_bad_lines(tmp_path):
+    path = tmp_path / "sets.jsonl"
+    path.write_text(
+        json.dumps({"subject": "A", "early_url": "https://youtu.be/AAAAAAAAAAA", "retrospective_url": "https://youtu.be/BBBBBBBBBBB"})
+        + "\n\n{not json\n"
+        + json.dumps({"subject": "B", "early_take": {"url": "https://youtu.be/CCCCCCCCCCC"}, "retrospective": []}) + "\n"
+        + json.dumps({"subject": "C", "pundit": "LSV", "early_url": "https://youtu.be/DDDDDDDDDDD; https://youtu.be/EEEEEEEEEEE",
+                      "retrospective_url": "https://youtu.be/FFFFFFFFFFF"}) + "\n",
+        encoding='utf-8'
+    )
+    sets, count = setup_video_sets({"video_sets_file": str(path)})
+    assert count is None and iter(sets) is sets # Streamed, never counted up front
+    first = next(sets)
+    assert first == {"subject": "A", "early_take": {"url": "https://youtu.be/AAAAAAAAAAA"},
+                     "retrospective": {"url": "https://youtu.be/BBBBBBBBBBB"}}
+    rest = list(sets) # B has no retrospective and is skipped
+    assert [video_set['subject'] for video_set in rest] == ["C"]
+    assert set_videos(rest[0], "early_take") == [{"url": "https://youtu.be/DDDDDDDDDDD", "pundit": "LSV"},
+                                                 {"url": "https://youtu.be/EEEEEEEEEEE", "pundit": "LSV"}]
+
+
+def test_csv_sets(tmp_path):
+    path = tmp_path / "sets.csv"
+    path.write_text("subject,early_url,retrospective_url,pundit\n"
+                    "A,https://youtu.be/AAAAAAAAAAA,https://youtu.be/BBBBBBBBBBB,\n", encoding='utf-8')
+    assert list(iter_video_sets_file(str(path))) == [{"subject": "A", "early_take": {"url": "https://youtu.be/AAAAAAAAAAA"},
+                                                      "retrospective": {"url": "https://youtu.be/BBBBBBBBBBB"}}]
+
+
+def test_playlist_pairs_consecutive_videos(tmp_path):
+    path = tmp_path / "playlist.txt"
+    path.write_text(
+        "# exported playlist\n"
+        + json.dumps({"id": "AAAAAAAAAAA", "title": "Set A first impressions"}) + "\n"
+        + "https://youtu.be/BBBBBBBBBBB\n"
+        + "https://youtu.be/CCCCCCCCCCC\n"
+        + json.dumps({"webpage_url": "https://youtu.be/DDDDDDDDDDD"}) + "\n"
+        + "https://youtu.be/EEEEEEEEEEE\n", # Odd one out
+        encoding='utf-8'
+    )
+    assert list(iter_video_sets_file(str(path))) == [
+        {"subject": "Set A first impressions", "early_take": {"url": "https://www.youtube.com/watch?v=AAAAAAAAAAA"},
+         "retrospective": {"url": "https://youtu.be/BBBBBBBBBBB"}},
+        {"subject": "CCCCCCCCCCC", "early_take": {"url": "https://youtu.be/CCCCCCCCCCC"},
+         "retrospective": {"url": "https://youtu.be/DDDDDDDDDDD"}},
+    ]
+
+
+def test_file_errors(tmp_path):
+    with pytest.raises(ValueError, match="not found"):
+        iter_video_sets_file(str(tmp_path / "missing.jsonl"))
+    with pytest.raises(ValueError, match="Unknown video sets format"):
+        iter_video_sets_file(str(tmp_path / "sets.xml"), "xml")
+    with pytest.raises(ValueError, match="No valid 'video_sets'"):
+        setup_video_sets({})
+
+
+def test_config_sets_are_counted_and_urls_deduplicated():
+    video_set = {"subject": "A", "early_take": [{"url": "u1"}, {"url": "u2"}], "retrospective": {"url": "u1"}}
+    sets, count = setup_video_sets({"video_sets": [video_set, {"subject": "broken"}]})
+    assert count == 2 and list(sets) == [video_set]
+    assert video_set_urls(video_set) == ["u1", "u2"]
+
+
+def test_summary_writer_appends_slim_summaries(tmp_path):
+    writer = SetSummaryWriter(str(tmp_path))
+    writer.write({"subject": "A", "comparisons": [{"early": "u1", "comparison": "long text", "status": "OK"}]})
+    writer.write({"subject": "B", "early_status": "Error: Transcript unavailable."})
+    writer.close()
+    with open(writer.path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]['comparisons'] == [{"early": "u1", "status": "OK"}]
+    assert writer.stats()['sets'] == 2 and writer.stats()['failed'] == 1
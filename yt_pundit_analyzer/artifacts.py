@@ -0,0 +1,153 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+# Import functions from the same package
+from .utils import extract_video_id
+from .video_sets import ROLES, set_videos
+
+# Prompt key and output file type of each role's analysis
+ROLE_ANALYSES = {
+    "early_take": ("early", "Early_take"),
+    "retrospective": ("retro", "Retrospective"),
+}
+
+# --- Per-Set Analyses and Comparisons ---
+def video_key(url: str) -> str:
+    """The video id of a URL, or the URL itself if it has none."""
+    try:
+        return extract_video_id(url)
+    except ValueError:
+        return url
+
+def set_analyses(video_set: dict) -> list:
+    """
+    The unique per-video analyses a set needs, as dicts with key ('<video_id>:<prompt>'),
+    url, video_id, prompt ('early' / 'retro'), video_type and pundit.
+    """
+    analyses, seen = [], set()
+    for role in ROLES:
+        prompt, video_type = ROLE_ANALYSES[role]
+        for video in set_videos(video_set, role):
+            video_id = video_key(video['url'])
+            key = f"{video_id}:{prompt}"
+            if key not in seen:
+                seen.add(key)
+                analyses.append({"key": key, "url": video['url'], "video_id": video_id, "prompt": prompt, "video_type": video_type,
+                                 "pundit": video['pundit']})
+    return analyses
+
+def set_analysis_keys(video_set: dict) -> list:
+    return [analysis['key'] for analysis in set_analyses(video_set)]
+
+def set_comparisons(video_set: dict) -> list:
+    """
+    Every (early take, retrospective) pair of a set, with the keys of both analyses, the
+    early take's pundit and a label that names the output files. A set with a single pair
+    is labelled with its subject, as before multi-video sets existed.
+    """
+    subject = video_set['subject']
+    early_videos = set_videos(video_set, 'early_take')
+    retro_videos = set_videos(video_set, 'retrospective')
+    single = len(early_videos) * len(retro_videos) == 1
+    pairs = []
+    for early in early_videos:
+        for retro in retro_videos:
+            early_id, retro_id = video_key(early['url']), video_key(retro['url'])
+            pairs.append({
+                "early_key": f"{early_id}:early", "retro_key": f"{retro_id}:retro",
+                "early_url": early['url'], "retro_url": retro['url'],
+                "pundit": early['pundit'], # The pundit whose predictions are graded
+                "label": subject if single else f"{subject} ({early_id} vs {retro_id})",
+            })
+    return pairs
+
+
+# --- Shared Analysis Registry ---
+class AnalysisArtifacts:
+    """
+    Per-run registry of per-video analyses keyed by video and prompt, so a video that
+    appears in several sets (or several pairs of one set) is fetched and analysed once.
+
+    The first set to claim a key owns it and fulfils its future; later claimers wait on
+    the same future. Sets retain() their keys while in flight and release() them when
+    done; a result is dropped once no in-flight set needs it, so memory stays bounded
+    by the sets in flight. A later set that needs the video again gets it from the
+    response cache and run manifest.
+    """
+
+    def __init__(self):
+        self.computed = 0
+        self.reused = 0
+        self._futures = {}
+        self._owner_tasks = {} # Key -> scheduler task id of the owner's analysis, if it runs as a task
+        self._refs = collections.Counter()
+        self._lock = threading.Lock()
+
+    def retain(self, keys: list):
+        with self._lock:
+            self._refs.update(keys)
+
+    def release(self, keys: list):
+        with self._lock:
+            for key in keys:
+                self._refs[key] -= 1
+                if self._refs[key] <= 0:
+                    del self._refs[key]
+                    self._futures.pop(key, None)
+                    self._owner_tasks.pop(key, None)
+
+    def claim(self, key: str, task_id: str = None) -> tuple:
+        """
+        Returns (future, owner). The owner must fulfil the future; others only wait on it.
+        task_id names the scheduler task that will produce the owner's analysis (see owner_task).
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.reused += 1
+                return future, False
+            future = self._futures[key] = concurrent.futures.Future()
+            if task_id is not None:
+                self._owner_tasks[key] = task_id
+            self.computed += 1
+            return future, True
+
+    def owner_task(self, key: str):
+        """The task id given by the owner of a claimed key, or None."""
+        with self._lock:
+            return self._owner_tasks.get(key)
+
+    @staticmethod
+    def fulfil(future: concurrent.futures.Future, fn):
+        """Runs fn and stores its result (or exception) in future, unless cancel_all() failed it first; returns the result."""
+        try:
+            result = fn()
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        if not future.done():
+            future.set_result(result)
+        return result
+
+    def cancel_all(self, reason: str = "The run stopped before this analysis finished."):
+        """Fails every unresolved analysis, so nothing waits forever for an owner that will not run."""
+        with self._lock:
+            pending = [future for future in self._futures.values() if not future.done()]
+        for future in pending:
+            try:
+                future.set_exception(RuntimeError(reason))
+            except concurrent.futures.InvalidStateError:
+                pass # Resolved by its owner in the meantime
+
+    def compute(self, key: str, fn):
+        """Returns the analysis for key, running fn unless another set already has (waiting for it if needed)."""
+        future, owner = self.claim(key)
+        if owner:
+            return self.fulfil(future, fn)
+        logging.debug(f"Reusing analysis {key}")
+        return future.result()
+
+    def stats(self) -> dict:
+        return {"analyses_computed": self.computed, "analyses_reused": self.reused}
@@ -0,0 +1,234 @@
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import logging
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
+    from llama_index.llms.gemini import Gemini
+# Import functions from the same package
+from . import metrics
+from .cache import TranscriptCache, ResponseCache
+from .run_manifest import RunManifest
+from .core import LLMRequest, get_transcript, analyze_video_steps, compare_analyses_steps, summarize_pair, summarize_set
+from .artifacts import AnalysisArtifacts, set_analyses, set_comparisons
+from .preprocess import preprocess_transcript
+from .video_sets import video_set_urls
+from .ratelimit import TokenBucketRateLimiter
+from .routing import ModelRouter
+from .streaming import StreamFile, astream_chat
+
+# --- Async LLM Interactions ---
+async def achat_with_cache(llm: Gemini, messages: list, rate_limiter: TokenBucketRateLimiter, semaphore: asyncio.Semaphore, description: str, response_cache: ResponseCache = None,
+                           stream_settings: dict = None, stream_file: StreamFile = None) -> str:
+    """
+    Async counterpart of core.chat_with_cache, using llm.achat under a semaphore and the shared
+    rate limiter (or, for a routing.ModelRoute, the limiter of the model that takes the request).
+    A streamed call that stalls is cancelled, so it no longer holds its semaphore slot.
+    """
+    request = LLMRequest(llm, messages, rate_limiter, description, response_cache, stream_settings)
+    cached = request.cached()
+    if cached is not None:
+        return cached
+    async with semaphore: # Bounds the number of requests in flight
+        while True:
+            client, limiter, budget = request.next_call()
+            if client is None:
+                return request.content
+            request.waited += await limiter.acquire_async(request.prompt_tokens)
+            logging.info(f"Making LLM call for {description}...")
+            call_start = time.perf_counter()
+            try:
+                if request.streams(client, use_async=True):
+                    response = await astream_chat(client, messages, stream_settings, description, stream_file, budget)
+                else:
+                    response = await (request.route.achat_within(messages, budget) if budget else client.achat(messages))
+            except Exception as e:
+                if request.retry(e):
+                    continue
+                raise
+            return request.answered(response, call_start)
+
+async def _achat_all(request: dict, semaphore: asyncio.Semaphore) -> list:
+    parallel = asyncio.Semaphore(request['max_parallel'])
+
+    async def call(arguments):
+        async with parallel:
+            return await achat_with_cache(semaphore=semaphore, **arguments)
+    return list(await asyncio.gather(*(call(arguments) for arguments in request['calls'])))
+
+async def arun_stage(steps, semaphore: asyncio.Semaphore):
+    """
+    Async counterpart of core.run_stage: runs a stage generator on the event loop, awaiting
+    its LLM calls with achat_with_cache. Returns its result.
+    """
+    reply, error = None, None
+    try:
+        while True:
+            request = steps.throw(error) if error is not None else steps.send(reply)
+            reply, error = None, None
+            try:
+                if 'calls' in request:
+                    reply = await _achat_all(request, semaphore)
+                else:
+                    reply = await achat_with_cache(semaphore=semaphore, **request)
+            except Exception as e:
+                error = e
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close() # A cancelled stage unwinds here, in its own task's context
+
+# --- Async Set Processing ---
+async def aprocess_video_set(
+    video_set: dict,
+    reader: YoutubeTranscriptReader,
+    llm: Gemini,
+    prompt_templates: dict,
+    rate_limiter: TokenBucketRateLimiter,
+    semaphore: asyncio.Semaphore,
+    output_folder: str,
+    transcript_cache: TranscriptCache = None,
+    refresh_transcripts: bool = False,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    chunk_settings: dict = None,
+    prefetcher=None,
+    preprocess_settings: dict = None,
+    artifacts: AnalysisArtifacts = None,
+    structured_settings: dict = None,
+    model_router: ModelRouter = None,
+    quote_settings: dict = None,
+    stream_settings: dict = None
+) -> dict:
+    """
+    Processes one set, fetching and analysing its videos concurrently, then comparing all
+    of its pairs concurrently. Analyses claimed by another set in flight are awaited, not redone.
+    The analyses and comparisons are core's stage generators, run as coroutines on the loop
+    (see arun_stage); semaphore bounds the LLM requests in flight across all sets.
+    """
+    subject = video_set['subject']
+    analyses = set_analyses(video_set)
+    keys = [analysis['key'] for analysis in analyses]
+    artifacts = artifacts if artifacts is not None else AnalysisArtifacts()
+    logging.info(f"Processing set: '{subject}' ({len(analyses)} videos: {', '.join(keys)})")
+
+    async def analysis_result(analysis):
+        future, owner = artifacts.claim(analysis['key'])
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            if prefetcher is not None:
+                # The transcript is already downloading on the prefetch pool; just await it
+                transcript = await asyncio.wrap_future(prefetcher.future(analysis['url']))
+            else:
+                # The transcript reader is synchronous, so fetches run in the loop's thread pool
+                transcript = await asyncio.to_thread(get_transcript, analysis['url'], reader, transcript_cache, refresh_transcripts)
+            if preprocess_settings is not None:
+                transcript = await asyncio.to_thread(preprocess_transcript, transcript, preprocess_settings, analysis['url'])
+            result = await arun_stage(analyze_video_steps(
+                analysis['video_type'], subject, transcript, llm, prompt_templates[analysis['prompt']],
+                rate_limiter, output_folder, response_cache, manifest, chunk_settings, analysis['video_id'],
+                structured_settings, analysis['pundit'], model_router, quote_settings, stream_settings
+            ), semaphore)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    async def compare(pair):
+        early_result, retro_result = results[pair['early_key']], results[pair['retro_key']]
+        comparison_result = await arun_stage(compare_analyses_steps(
+            subject, early_result, retro_result, llm, prompt_templates['compare'],
+            rate_limiter, output_folder, response_cache, manifest, pair['label'], structured_settings, pair['pundit'],
+            model_router, stream_settings
+        ), semaphore)
+        return summarize_pair(pair, early_result, retro_result, comparison_result)
+
+    artifacts.retain(keys)
+    try:
+        results = dict(zip(keys, await asyncio.gather(*(analysis_result(analysis) for analysis in analyses))))
+        pairs = await asyncio.gather(*(compare(pair) for pair in set_comparisons(video_set)))
+    finally:
+        artifacts.release(keys)
+    logging.info(f"Finished processing set: '{subject}'")
+    return summarize_set(subject, list(pairs))
+
+async def _run_all(video_sets, reader, llm, prompt_templates, rate_limiter, max_concurrency, fetch_workers,
+                   output_folder, transcript_cache, refresh_transcripts, response_cache, manifest, chunk_settings, on_result,
+                   prefetcher=None, preprocess_settings=None, max_in_flight=None, structured_settings=None, model_router=None,
+                   quote_settings=None, stream_settings=None):
+    loop = asyncio.get_running_loop()
+    # asyncio.to_thread uses the default executor; size it for transcript downloads
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='Fetch'))
+    semaphore = asyncio.Semaphore(max_concurrency)
+    artifacts = AnalysisArtifacts() # Per-video analyses shared by the sets in flight
+
+    async def run_one(video_set):
+        metrics.current_set.set(video_set['subject']) # Each task runs in its own context copy
+        try:
+            return video_set['subject'], await aprocess_video_set(
+                video_set, reader, llm, prompt_templates, rate_limiter, semaphore, output_folder,
+                transcript_cache, refresh_transcripts, response_cache, manifest, chunk_settings, prefetcher,
+                preprocess_settings, artifacts, structured_settings, model_router, quote_settings, stream_settings
+            ), None
+        except Exception as e:
+            return video_set['subject'], None, e
+        finally:
+            if prefetcher is not None:
+                prefetcher.release(video_set_urls(video_set))
+
+    # Sets are pulled from the (possibly streamed) input only as earlier ones finish
+    video_sets = iter(video_sets)
+    window = max(1, max_in_flight or max_concurrency)
+    running = set()
+    while True:
+        for video_set in video_sets:
+            running.add(asyncio.create_task(run_one(video_set)))
+            if len(running) >= window:
+                break
+        if not running:
+            logging.info(f"Per-video analyses: {artifacts.stats()}")
+            return
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for finished in done:
+            subject, result_data, exc = finished.result()
+            on_result(subject, result_data, exc)
+
+def run_async(
+    video_sets,
+    reader: YoutubeTranscriptReader,
+    llm: Gemini,
+    prompt_templates: dict,
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    on_result,
+    max_concurrency: int = 64,
+    fetch_workers: int = 8,
+    transcript_cache: TranscriptCache = None,
+    refresh_transcripts: bool = False,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    chunk_settings: dict = None,
+    prefetcher=None,
+    preprocess_settings: dict = None,
+    max_in_flight: int = None,
+    structured_settings: dict = None,
+    model_router: ModelRouter = None,
+    quote_settings: dict = None,
+    stream_settings: dict = None
+):
+    """
+    Processes sets on a single asyncio event loop. on_result(subject, summary, exc)
+    is called as each set finishes, mirroring the threaded path in main.py.
+    video_sets may be any iterable; at most max_in_flight sets (default: max_concurrency)
+    are in progress at once, and the next one is read only when a slot frees up.
+    """
+    logging.info(f"Processing sets with asyncio (up to {max_concurrency} LLM requests in flight).")
+    asyncio.run(_run_all(
+        video_sets, reader, llm, prompt_templates, rate_limiter, max_concurrency, fetch_workers,
+        output_folder, transcript_cache, refresh_transcripts, response_cache, manifest, chunk_settings, on_result,
+        prefetcher, preprocess_settings, max_in_flight, structured_settings, model_router, quote_settings, stream_settings
+    ))
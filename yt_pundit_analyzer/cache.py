@@ -0,0 +1,369 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+# Import utility functions from the same package
+from .utils import extract_video_id, load_prompt, create_chat_prompt_template
+
+# --- Transcript Cache ---
+EVICT_TO_FRACTION = 0.9 # Share of max_bytes kept when an eviction is triggered by writes
+
+class TranscriptCache:
+    """
+    Persistent on-disk transcript cache keyed by YouTube video ID.
+
+    Entries are stored gzip-compressed as <cache_dir>/<id[:2]>/<id>.txt.gz and written
+    atomically (temp file + os.replace), so concurrent workers never see partial files.
+    Eviction removes entries older than max_age_seconds, then least recently used entries
+    until the cache fits in max_bytes. It runs at startup and again whenever the bytes
+    written since (transcripts, and quote indexes reported through added()) take the cache
+    over max_bytes; it then trims to EVICT_TO_FRACTION of the limit so it isn't re-run on every write.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = None, max_age_seconds: float = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # Guards counters and eviction
+        self._size = None # Bytes on disk as of the last eviction plus writes since; None until measured
+        self._evicting = False
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.cache_dir, video_id[:2], f"{video_id}.txt.gz")
+
+    def _is_expired(self, mtime: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+
+    def get(self, url: str):
+        """Returns the cached transcript for a URL, or None on a miss."""
+        try:
+            path = self._path(extract_video_id(url))
+        except ValueError:
+            return None # Unparseable URLs are never cached
+        try:
+            if self._is_expired(os.path.getmtime(path), time.time()):
+                raise FileNotFoundError(path)
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                transcript = f.read()
+            os.utime(path) # Refresh mtime so LRU eviction keeps hot entries
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError): # Missing, partial or corrupt entries are misses
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        logging.info(f"Transcript cache hit for {url} (length: {len(transcript)}).")
+        return transcript
+
+    def stored_size(self, url: str):
+        """
+        Uncompressed size in bytes of a cached transcript, read from the gzip trailer without
+        decompressing, or None if it is not cached. Not counted as a hit and does not refresh
+        the entry, so planning a run leaves the cache untouched.
+        """
+        try:
+            path = self._path(extract_video_id(url))
+            if self._is_expired(os.path.getmtime(path), time.time()):
+                return None
+            with open(path, 'rb') as f:
+                f.seek(-4, os.SEEK_END)
+                return int.from_bytes(f.read(4), 'little') # ISIZE: size modulo 2^32
+        except (ValueError, OSError):
+            return None
+
+    def put(self, url: str, transcript: str):
+        """Stores a transcript atomically. Errors are logged, never raised."""
+        try:
+            path = self._path(extract_video_id(url))
+        except ValueError as e:
+            logging.warning(f"Not caching transcript: {e}")
+            return
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(transcript.encode('utf-8'))
+            os.replace(tmp_path, path)
+            logging.info(f"Transcript cached for {url} at {path}")
+        except OSError as e:
+            logging.error(f"Failed to write transcript cache entry for {url}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.added(os.path.getsize(path))
+
+    def added(self, nbytes: int):
+        """Counts bytes written under cache_dir, evicting once the cache has grown past max_bytes."""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += nbytes
+                if self._size <= self.max_bytes:
+                    return
+            if self._evicting: # Another writer is already trimming the cache
+                return
+            self._evicting = True
+        try:
+            self.evict(int(self.max_bytes * EVICT_TO_FRACTION))
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def evict(self, target_bytes: int = None) -> int:
+        """Applies age and size limits (trimming to target_bytes, default max_bytes). Returns the number of entries removed."""
+        target_bytes = self.max_bytes if target_bytes is None else target_bytes
+        with self._lock:
+            now = time.time()
+            entries = []
+            for root, _dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if name.endswith('.tmp'):
+                        # Leftover from an interrupted write; remove once clearly stale
+                        if now - stat.st_mtime > 3600:
+                            entries.append((0, stat.st_size, path))
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            removed = 0
+            total_size = sum(size for _, size, _ in entries)
+            for mtime, size, path in sorted(entries): # Oldest first
+                too_old = mtime == 0 or self._is_expired(mtime, now)
+                too_big = target_bytes is not None and total_size > target_bytes
+                if not (too_old or too_big):
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                    total_size -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total_size
+            if removed:
+                logging.info(f"Evicted {removed} transcript cache entries from {self.cache_dir}")
+            return removed
+
+
+def setup_transcript_cache(config: dict):
+    """Creates a TranscriptCache from config, or returns None if caching is disabled."""
+    cache_dir = config.get('transcript_cache_dir')
+    if not cache_dir:
+        logging.info("Transcript cache disabled (no 'transcript_cache_dir' in config).")
+        return None
+    max_mb = config.get('transcript_cache_max_mb')
+    max_age_days = config.get('transcript_cache_max_age_days')
+    cache = TranscriptCache(
+        cache_dir,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+        max_age_seconds=max_age_days * 86400 if max_age_days else None
+    )
+    cache.evict()
+    logging.info(f"Transcript cache enabled at {os.path.abspath(cache_dir)}")
+    return cache
+
+
+# --- LLM Response Cache ---
+def _llm_identity(llm) -> tuple:
+    """Returns (model_name, generation_params) used to key cached responses."""
+    model_name = getattr(llm, 'model', None) or getattr(llm, 'model_name', None) or type(llm).__name__
+    params = {name: getattr(llm, name, None) for name in ('temperature', 'max_tokens', 'generation_config')}
+    return str(model_name), params
+
+def _serialize_messages(messages) -> list:
+    """Converts chat messages into a JSON-serializable [role, content] list."""
+    return [[str(getattr(m.role, 'value', m.role)), m.content or ""] for m in messages]
+
+def hash_llm_request(llm, messages, extra: dict = None) -> str:
+    """
+    Hashes everything that determines an LLM response: model, rendered messages and generation
+    params, plus any extra settings that change how the request is executed.
+    """
+    model_name, params = _llm_identity(llm)
+    payload = json.dumps(
+        {"model": model_name, "messages": _serialize_messages(messages), "params": params, **({"extra": extra} if extra else {})},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _prompt_file_hash(prompt_file: str) -> str:
+    return _system_prompt_hash(create_chat_prompt_template(load_prompt(prompt_file)).format_messages())
+
+def _system_prompt_hash(messages) -> str:
+    """Hashes the rendered system message, used to invalidate entries per prompt file."""
+    system_text = "\n".join(content for role, content in _serialize_messages(messages) if role == "system")
+    return hashlib.sha256(system_text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of LLM responses keyed by model name, a hash of the fully
+    rendered chat messages and the generation parameters.
+
+    Entries older than ttl_seconds are ignored and purged; when more than max_entries
+    are stored, the least recently used ones are evicted. The system prompt hash of every
+    version of a prompt file seen at startup is recorded under the file's path, so
+    invalidate_prompt() also drops responses to versions that have since been edited.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float = None, max_entries: int = None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # One connection shared by all worker threads
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, system_hash TEXT NOT NULL,"
+                " response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_system ON responses(system_hash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_versions ("
+                " prompt_file TEXT NOT NULL, system_hash TEXT NOT NULL, first_seen REAL NOT NULL,"
+                " PRIMARY KEY (prompt_file, system_hash))"
+            )
+
+    @staticmethod
+    def make_key(llm, messages) -> str:
+        return hash_llm_request(llm, messages)
+
+    def get(self, llm, messages):
+        """Returns the cached response text, or None on a miss."""
+        key = self.make_key(llm, messages)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def put(self, llm, messages, response: str):
+        """Stores a response and applies the LRU size limit."""
+        key = self.make_key(llm, messages)
+        model_name, _ = _llm_identity(llm)
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, system_hash, response, created_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_name, _system_prompt_hash(messages), response, now, now)
+                )
+                if self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        " SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store LLM response in cache {self.db_path}: {e}")
+
+    def purge_expired(self) -> int:
+        """Deletes entries older than the TTL. Returns the number removed."""
+        if self.ttl_seconds is None:
+            return 0
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        return cursor.rowcount
+
+    def register_prompts(self, prompt_files):
+        """Records the system prompt hash of the current contents of each prompt file."""
+        now = time.time()
+        rows = []
+        for prompt_file in prompt_files:
+            if not os.path.exists(prompt_file):
+                continue
+            try:
+                rows.append((os.path.abspath(prompt_file), _prompt_file_hash(prompt_file), now))
+            except Exception as e:
+                logging.debug(f"Not registering prompt file {prompt_file} with the response cache: {e}")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO prompt_versions (prompt_file, system_hash, first_seen) VALUES (?, ?, ?)", rows
+            )
+
+    def invalidate_prompt(self, prompt_file: str) -> int:
+        """Deletes all cached responses produced with any recorded version of a prompt file, including the current one."""
+        path = os.path.abspath(prompt_file)
+        with self._lock, self._conn:
+            hashes = {row[0] for row in self._conn.execute(
+                "SELECT system_hash FROM prompt_versions WHERE prompt_file = ?", (path,)
+            )}
+            if os.path.exists(prompt_file):
+                hashes.add(_prompt_file_hash(prompt_file))
+            removed = 0
+            for system_hash in hashes:
+                removed += self._conn.execute("DELETE FROM responses WHERE system_hash = ?", (system_hash,)).rowcount
+            # Versions other than the current one can never be used again
+            self._conn.execute("DELETE FROM prompt_versions WHERE prompt_file = ?", (path,))
+        logging.info(f"Invalidated {removed} cached LLM responses for prompt file {prompt_file} ({len(hashes)} versions)")
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Config locations of every prompt file, as key paths
+PROMPT_FILE_SETTINGS = (
+    ('early_take_prompt_file',), ('retrospective_prompt_file',), ('compare_prompt_file',),
+    ('chunking', 'merge_prompt_file'), ('rollup', 'prompt_file'),
+    ('structured_output', 'takeaways_prompt_file'), ('structured_output', 'comparison_prompt_file'),
+)
+
+def configured_prompt_files(config: dict) -> list:
+    """The prompt file paths set in config."""
+    files = []
+    for setting in PROMPT_FILE_SETTINGS:
+        value = config
+        for key in setting:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value:
+            files.append(value)
+    return files
+
+def setup_response_cache(config: dict):
+    """Creates a ResponseCache from config, or returns None if caching is disabled."""
+    db_path = config.get('response_cache_path')
+    if not db_path:
+        logging.info("LLM response cache disabled (no 'response_cache_path' in config).")
+        return None
+    ttl_days = config.get('response_cache_ttl_days')
+    cache = ResponseCache(
+        db_path,
+        ttl_seconds=ttl_days * 86400 if ttl_days else None,
+        max_entries=config.get('response_cache_max_entries')
+    )
+    cache.register_prompts(configured_prompt_files(config))
+    purged = cache.purge_expired()
+    logging.info(f"LLM response cache enabled at {os.path.abspath(db_path)} ({purged} expired entries purged)")
+    return cache
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import logging
+import re
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.core.prompts import RichPromptTemplate
+# Import functions from the same package
+from .utils import load_prompt, create_chat_prompt_template
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+# --- Transcript Splitting ---
+def _split_units(transcript: str, max_chars: int) -> list:
+    """
+    Splits a transcript into units that are never cut internally: caption lines, or
+    sentences for lines longer than max_chars (hard cuts only as a last resort).
+    Keeping lines whole keeps any timestamp markers attached to their text.
+    """
+    units = []
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+        if len(line) <= max_chars:
+            units.append(line)
+            continue
+        for sentence in _SENTENCE_BOUNDARY.split(line):
+            while len(sentence) > max_chars:
+                units.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                units.append(sentence)
+    return units
+
+def split_transcript(transcript: str, max_chars: int, overlap_chars: int = 0) -> list:
+    """
+    Splits a transcript into chunks of at most ~max_chars characters on line/sentence
+    boundaries. Each chunk repeats the last ~overlap_chars characters of the previous
+    one, so takes that straddle a boundary appear whole in at least one chunk.
+    """
+    chunks = []
+    current, current_len = [], 0
+    for unit in _split_units(transcript, max_chars):
+        if current and current_len + len(unit) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            # Carry trailing units over as overlap
+            overlap, overlap_len = [], 0
+            for previous in reversed(current):
+                if overlap_len + len(previous) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_len += len(previous) + 1
+            current, current_len = overlap, overlap_len
+        current.append(unit)
+        current_len += len(unit) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# --- Map/Reduce Prompt Construction ---
+def format_chunk_messages(prompt_template: RichPromptTemplate, subject: str, chunk: str, index: int, total: int) -> list:
+    """Renders the stage prompt for one transcript chunk (the map step)."""
+    header = (f"[Transcript part {index} of {total}. This is an excerpt of a longer video; "
+              f"extract takeaways from this part only and keep timestamps and quotes exactly as written.]")
+    return prompt_template.format_messages(transcript=f"{header}\n\n{chunk}", subject=subject)
+
+def format_merge_messages(merge_template: RichPromptTemplate, subject: str, video_type: str, partials: list) -> list:
+    """Renders the merge prompt combining partial takeaways (the reduce step)."""
+    sections = [f"## Partial takeaways {i} of {len(partials)}\n\n{partial}" for i, partial in enumerate(partials, 1)]
+    body = f"# {video_type} takeaways for '{subject}', extracted from consecutive transcript parts\n\n" + "\n\n".join(sections)
+    return merge_template.format_messages(transcript=body, subject=subject)
+
+def group_for_merge(partials: list, max_chars: int) -> list:
+    """Groups partial results into batches whose combined size fits in one merge call."""
+    groups, current, current_len = [], [], 0
+    for partial in partials:
+        if current and current_len + len(partial) > max_chars:
+            groups.append(current)
+            current, current_len = [], 0
+        current.append(partial)
+        current_len += len(partial)
+    if current:
+        groups.append(current)
+    return groups
+
+
+# --- Chunked Analysis Settings ---
+def setup_chunking(config: dict):
+    """Builds the chunking settings dict from config, or returns None if chunked analysis is disabled."""
+    chunk_config = config.get('chunking') or {}
+    if not chunk_config.get('enabled'):
+        return None
+    max_chars = int(chunk_config.get('max_chars', 120000))
+    settings = {
+        'max_chars': max_chars,
+        'overlap_chars': int(chunk_config.get('overlap_chars', 2000)),
+        'max_parallel': int(chunk_config.get('max_parallel', 4)),
+        'merge_template': create_chat_prompt_template(load_prompt(chunk_config['merge_prompt_file'])),
+    }
+    if settings['overlap_chars'] >= max_chars:
+        raise ValueError("chunking.overlap_chars must be smaller than chunking.max_chars in config.yaml.")
+    logging.info(f"Chunked analysis enabled for transcripts over {max_chars} characters (overlap: {settings['overlap_chars']}).")
+    return settings
+
+def needs_chunking(transcript: str, chunk_settings: dict) -> bool:
+    return chunk_settings is not None and len(transcript) > chunk_settings['max_chars']
+
+def chunking_signature(chunk_settings: dict) -> dict:
+    """The chunking parameters that affect results, for input hashing."""
+    return {key: chunk_settings[key] for key in ('max_chars', 'overlap_chars')}
@@ -1,67 +1,494 @@
+from __future__ import annotations # Signatures name llama_index classes without importing them at runtime
+import concurrent.futures
+import json
 import logging
 import os
-from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
-from llama_index.llms.gemini import Gemini
-from llama_index.core.prompts import RichPromptTemplate
-from ratelimiter import RateLimiter
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: # llama_index is slow to import; main.py only loads it when sets are processed
+    from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
+    from llama_index.llms.gemini import Gemini
+    from llama_index.core.prompts import RichPromptTemplate
 # Import utility functions from the same package
 from .utils import generate_output_filename
+from . import metrics
+from .cache import TranscriptCache, ResponseCache, hash_llm_request
+from .run_manifest import RunManifest
+from .chunking import split_transcript, format_chunk_messages, format_merge_messages, group_for_merge, needs_chunking, chunking_signature
+from .scheduler import StageScheduler
+from .preprocess import preprocess_transcript
+from .artifacts import AnalysisArtifacts, set_analyses, set_comparisons
+from .structured import STRUCTURED_SCHEMAS, structured_target, structured_stage, format_extraction_messages, parse_structured_output, build_record
+from .ratelimit import TokenBucketRateLimiter, estimate_message_tokens, is_rate_limit_error
+from .routing import ModelRoute, ModelRouter, select_route, spill_reason, stage_model
+from .quotes import extract_quotes, match_quotes, summarize_matches
+from .streaming import StreamFile, StreamStalled, can_stream, stream_chat
 
 # --- Transcript Fetching ---
-def get_transcript(url: str, reader: YoutubeTranscriptReader) -> str:
-    """Fetches transcript for a given YouTube URL."""
-    logging.info(f"Fetching transcript for: {url}")
-    try:
-        # Note: load_data expects a list of URLs
-        documents = reader.load_data(ytlinks=[url])
-        if not documents:
-            logging.warning(f"No transcript documents found for {url}. Transcripts might be disabled or the video unavailable.")
-            return "Error fetching transcript: No documents found."
-        # Concatenate text from all document parts (sometimes transcripts are split)
-        transcript = "\n".join([doc.get_content() for doc in documents])
-        if not transcript.strip():
-             logging.warning(f"Fetched transcript for {url} is empty.")
-             return "Error fetching transcript: Transcript is empty."
-        logging.info(f"Transcript fetched successfully for {url} (length: {len(transcript)}).")
-        return transcript
-    except Exception as e:
-        # Catch potential errors from youtube_transcript_api or LlamaIndex reader
-        logging.error(f"Failed to fetch transcript for {url}: {e}")
-        return f"Error fetching transcript: {e}" # Return error message
+def transcript_from_documents(url: str, documents: list) -> str:
+    """Joins the documents returned by the reader for one URL, or returns an error string."""
+    if not documents:
+        logging.warning(f"No transcript documents found for {url}. Transcripts might be disabled or the video unavailable.")
+        return "Error fetching transcript: No documents found."
+    # Concatenate text from all document parts (sometimes transcripts are split)
+    transcript = "\n".join([doc.get_content() for doc in documents])
+    if not transcript.strip():
+         logging.warning(f"Fetched transcript for {url} is empty.")
+         return "Error fetching transcript: Transcript is empty."
+    logging.info(f"Transcript fetched successfully for {url} (length: {len(transcript)}).")
+    return transcript
+
+def get_transcript(url: str, reader: YoutubeTranscriptReader, cache: TranscriptCache = None, refresh: bool = False) -> str:
+    """Fetches transcript for a given YouTube URL, using the on-disk cache if provided."""
+    with metrics.timed("fetch", label=url) as event:
+        if cache is not None and not refresh:
+            cached = cache.get(url)
+            if cached is not None:
+                event.update(cache_hit=True, transcript_chars=len(cached))
+                return cached
+        logging.info(f"Fetching transcript for: {url}")
+        try:
+            # Note: load_data expects a list of URLs
+            documents = reader.load_data(ytlinks=[url])
+            transcript = transcript_from_documents(url, documents)
+            if transcript.startswith("Error fetching transcript"):
+                return transcript
+            event['transcript_chars'] = len(transcript)
+            if cache is not None:
+                cache.put(url, transcript) # Only successful fetches are cached
+            return transcript
+        except Exception as e:
+            # Catch potential errors from youtube_transcript_api or LlamaIndex reader
+            logging.error(f"Failed to fetch transcript for {url}: {e}")
+            return f"Error fetching transcript: {e}" # Return error message
+
+def fetch_transcript(url: str, reader: YoutubeTranscriptReader, cache: TranscriptCache = None, refresh: bool = False, prefetcher=None) -> str:
+    """Takes the transcript from the prefetch stage if one is running, otherwise fetches it directly."""
+    if prefetcher is not None:
+        return prefetcher.get(url)
+    return get_transcript(url, reader, cache, refresh)
 
 # --- Function to save output ---
 def save_output(output_folder: str, filename: str, content: str):
-    """Saves content to a file in the specified folder."""
+    """Saves content to a file in the specified folder. Returns the file path, or None on failure."""
+    filepath = os.path.join(output_folder, filename)
     try:
         # Create the directory if it doesn't exist
         os.makedirs(output_folder, exist_ok=True)
-        filepath = os.path.join(output_folder, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+        with metrics.timed("save", label=filename):
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(content)
         logging.info(f"Output successfully saved to: {filepath}")
+        return filepath
     except OSError as e:
         logging.error(f"Failed to create directory or save file {filepath}: {e}")
     except Exception as e:
         logging.error(f"An unexpected error occurred while saving output to {filepath}: {e}")
+    return None
 
 # --- LLM Interactions ---
-def analyze_video(
+class LLMRequest:
+    """
+    State of one chat_with_cache request: its response cache lookups, model routing, retry
+    and spill-over decisions and the bookkeeping of its answer. chat_with_cache and
+    async_engine.achat_with_cache share it and differ only in how they wait for the rate
+    limiter and call the LLM.
+    """
+
+    def __init__(self, llm: Gemini, messages: list, rate_limiter: TokenBucketRateLimiter, description: str,
+                 response_cache: ResponseCache = None, stream_settings: dict = None):
+        self.llm = llm
+        self.messages = messages
+        self.rate_limiter = rate_limiter
+        self.description = description
+        self.response_cache = response_cache
+        self.stream_settings = stream_settings
+        self.prompt_tokens = estimate_message_tokens(messages)
+        self.attempt = 0
+        self.stalls = 0
+        self.waited = 0.0
+        self.skipped = set() # Models this request has spilled over from
+        self.route = None
+        self.limiter = rate_limiter
+        self.content = None # A fallback's cached answer (see next_call)
+
+    def cached(self, route=None):
+        """The cached answer of the requested model (or of route, a fallback about to take the request), or None."""
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.get(route if route is not None else self.llm, self.messages)
+        if cached is not None:
+            model_name = route.name if route is not None else None
+            logging.info(f"LLM response cache hit for {self.description}{f' on {model_name}' if model_name else ''}; skipping API call.")
+            if model_name:
+                metrics.note_model(model_name)
+            metrics.record("llm", 0.0, label=self.description, cache_hit=True, model=model_name)
+        return cached
+
+    def next_call(self) -> tuple:
+        """
+        Routes the next attempt (see routing.select_route). Returns (client, limiter, latency
+        budget in seconds or None), or (None, None, None) if the fallback model taking the
+        request has answered it before; its answer is then in self.content.
+        """
+        self.route = route = select_route(self.llm, self.prompt_tokens, self.skipped)
+        if route is None:
+            return self.llm, self.rate_limiter, None
+        if route is not self.llm:
+            self.content = self.cached(route)
+            if self.content is not None:
+                return None, None, None
+        self.limiter = route.rate_limiter
+        return route.llm, route.rate_limiter, route.latency_budget(self.skipped)
+
+    def streams(self, client, use_async: bool = False) -> bool:
+        return self.stream_settings is not None and can_stream(client, use_async)
+
+    def retry(self, error: Exception) -> bool:
+        """
+        Whether to try again after a failed call: on the route's fallback model after a 429 or
+        a missed latency budget, on the same model after a 429 (up to the limiter's
+        max_retries) or a stalled stream (up to max_stall_retries).
+        """
+        route, limiter, description = self.route, self.limiter, self.description
+        reason = spill_reason(route, error, self.skipped)
+        if reason is not None:
+            if reason == "quota":
+                limiter.report_throttled()
+            route.count(reason)
+            self.skipped.add(route.name)
+            logging.warning(f"LLM call for {description} on {route.name} failed ({error}); spilling over to a fallback model.")
+            return True
+        if is_rate_limit_error(error) and self.attempt < limiter.max_retries:
+            self.attempt += 1
+            limiter.report_throttled()
+            logging.warning(f"LLM call for {description} was rate limited; retrying ({self.attempt}/{limiter.max_retries}).")
+            return True
+        if isinstance(error, StreamStalled) and self.stalls < self.stream_settings['max_stall_retries']:
+            self.stalls += 1
+            logging.warning(f"{error}; retrying ({self.stalls}/{self.stream_settings['max_stall_retries']}).")
+            return True
+        return False
+
+    def answered(self, response, call_start: float) -> str:
+        """Records a successful call, caches its answer and returns the response text."""
+        route = self.route
+        self.limiter.report_success()
+        logging.info(f"LLM call successful for {self.description}.")
+        if route is not None:
+            route.count()
+        model_name = route.name if route is not None else getattr(self.llm, 'model', None) or getattr(self.llm, 'model_name', None)
+        metrics.note_model(model_name)
+        content = response.message.content if response is not None and response.message else None # An empty stream has no response
+        input_tokens, output_tokens = metrics.response_token_usage(response, self.prompt_tokens, content)
+        metrics.record(
+            "llm", time.perf_counter() - call_start, label=self.description, model=model_name, wait_seconds=round(self.waited, 4),
+            input_tokens=input_tokens, output_tokens=output_tokens, retries=self.attempt + self.stalls
+        )
+        if content and self.response_cache is not None:
+            # Keyed on the model that answered, so a spilled-over answer is never served as the primary's
+            self.response_cache.put(route if route is not None else self.llm, self.messages, content) # Never cache empty responses
+        return content
+
+def chat_with_cache(llm: Gemini, messages: list, rate_limiter: TokenBucketRateLimiter, description: str, response_cache: ResponseCache = None,
+                    stream_settings: dict = None, stream_file: StreamFile = None) -> str:
+    """
+    Sends chat messages to the LLM (rate limited), serving identical requests from the response cache.
+    llm may be a routing.ModelRoute: each request then goes to the first model of its fallback
+    chain with quota to spare, under that model's own limiter, and spills over to the next
+    model on a 429 or when the model exceeds its latency budget.
+    With stream_settings, the response is streamed (into stream_file, if given) and calls that
+    stall are abandoned and retried up to max_stall_retries times (see streaming.stream_chat).
+    """
+    request = LLMRequest(llm, messages, rate_limiter, description, response_cache, stream_settings)
+    cached = request.cached()
+    if cached is not None:
+        return cached
+    while True:
+        client, limiter, budget = request.next_call()
+        if client is None:
+            return request.content
+        request.waited += limiter.acquire(request.prompt_tokens) # Apply rate limiting before the API call
+        logging.info(f"Making LLM call for {description}...")
+        call_start = time.perf_counter()
+        try:
+            if request.streams(client):
+                response = stream_chat(client, messages, stream_settings, description, stream_file, budget)
+            else:
+                response = request.route.chat_within(messages, budget) if budget else client.chat(messages)
+        except Exception as e:
+            if request.retry(e):
+                continue
+            raise
+        return request.answered(response, call_start)
+
+def answered_hash(llm: Gemini, messages: list, models: set, extra: dict = None):
+    """
+    The input hash to journal a result under: that of the model that actually answered
+    (models, from metrics.collect_models). A result that spilled over to a fallback of a
+    ModelRoute is thus not resumed as the primary model's answer. Returns None, which
+    never matches on resume, if several models of the chain contributed to it.
+    """
+    if not isinstance(llm, ModelRoute) or not models or models == {llm.name}:
+        return hash_llm_request(llm, messages, extra)
+    routes = {route.name: route for route in llm.chain()}
+    if len(models) == 1 and next(iter(models)) in routes:
+        return hash_llm_request(routes[next(iter(models))], messages, extra)
+    return None
+
+# --- Stage Steps ---
+# The stages below are generators, shared by the thread and async engines: they yield the
+# LLM calls they need (llm_call, or parallel_calls for several at once) and are sent back
+# the content, or have the call's exception thrown in. run_stage answers them on the
+# calling thread; async_engine.arun_stage awaits them on the event loop.
+def llm_call(llm: Gemini, messages: list, rate_limiter: TokenBucketRateLimiter, description: str, response_cache: ResponseCache = None,
+             stream_settings: dict = None, stream_file: StreamFile = None) -> dict:
+    """An LLM call yielded by a stage: the arguments of chat_with_cache."""
+    return {"llm": llm, "messages": messages, "rate_limiter": rate_limiter, "description": description, "response_cache": response_cache,
+            "stream_settings": stream_settings, "stream_file": stream_file}
+
+def parallel_calls(calls: list, max_parallel: int) -> dict:
+    """LLM calls yielded together, to be made at most max_parallel at a time; answered with the list of contents."""
+    return {"calls": calls, "max_parallel": max_parallel}
+
+def _chat_all(request: dict) -> list:
+    workers = max(1, min(request['max_parallel'], len(request['calls'])))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Chunk') as executor:
+        # Chunk threads don't inherit the caller's context; re-bind the set for metrics
+        return list(executor.map(metrics.bind_set(metrics.current_set.get(), lambda call: chat_with_cache(**call)), request['calls']))
+
+def run_stage(steps):
+    """Runs a stage generator to completion on this thread, making its LLM calls with chat_with_cache. Returns its result."""
+    reply, error = None, None
+    try:
+        while True:
+            request = steps.throw(error) if error is not None else steps.send(reply)
+            reply, error = None, None
+            try:
+                reply = _chat_all(request) if 'calls' in request else chat_with_cache(**request)
+            except Exception as e:
+                error = e
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close()
+
+def analyze_transcript_chunked_steps(
+    video_type: str,
+    subject: str,
+    transcript: str,
+    llm: Gemini,
+    prompt_template: RichPromptTemplate,
+    rate_limiter: TokenBucketRateLimiter,
+    chunk_settings: dict,
+    response_cache: ResponseCache = None,
+    stream_settings: dict = None
+):
+    """
+    Map-reduce analysis of a long transcript: chunks are analysed concurrently under the
+    shared rate limiter, then the partial takeaways are merged (hierarchically if needed).
+    Returns the merged content, or None if the LLM returned nothing. A stage generator (see run_stage).
+    """
+    chunks = split_transcript(transcript, chunk_settings['max_chars'], chunk_settings['overlap_chars'])
+    logging.info(f"Analyzing {video_type} for '{subject}' in {len(chunks)} chunks (transcript length: {len(transcript)}).")
+
+    calls = [llm_call(llm, format_chunk_messages(prompt_template, subject, chunk, index, len(chunks)), rate_limiter,
+                      f"{video_type} analysis of '{subject}' (part {index}/{len(chunks)})", response_cache, stream_settings)
+             for index, chunk in enumerate(chunks, 1)]
+    partials = yield parallel_calls(calls, chunk_settings['max_parallel'])
+    if not all(partials):
+        return None
+
+    level = 1
+    while len(partials) > 1:
+        groups = group_for_merge(partials, chunk_settings['max_chars'])
+        if len(groups) == len(partials):
+            groups = [partials] # Nothing fits together; merge everything in one call
+        merged = []
+        for number, group in enumerate(groups, 1):
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            messages = format_merge_messages(chunk_settings['merge_template'], subject, video_type, group)
+            description = f"merge of {video_type} takeaways for '{subject}' (level {level}, group {number}/{len(groups)})"
+            merged.append((yield llm_call(llm, messages, rate_limiter, description, response_cache, stream_settings)))
+        if not all(merged):
+            return None
+        partials = merged
+        level += 1
+    return partials[0]
+
+def analysis_names(subject: str, artifact_id: str = None) -> tuple:
+    """(manifest set name, output file subject) of an analysis; see analyze_video."""
+    if artifact_id is None:
+        return subject, subject
+    return f"video:{artifact_id}", f"{subject}_{artifact_id}"
+
+# --- Structured Output ---
+def load_structured_record(target: dict, input_hash: str, structured_settings: dict, manifest: RunManifest = None):
+    """Returns the record journaled by a previous run for identical inputs (re-indexed), or None."""
+    if manifest is None:
+        return None
+    saved = manifest.load_completed(target['name'], structured_stage(target), input_hash)
+    if saved is None:
+        return None
+    record = json.loads(saved)
+    structured_settings['index'].ingest(record)
+    return record
+
+def store_structured_record(target: dict, data: dict, problems: list, input_hash: str, output_folder: str,
+                            structured_settings: dict, manifest: RunManifest = None, model: str = None):
+    """
+    Saves, indexes and journals a validated record; journals a failure otherwise. Returns the record or None.
+    model names the model(s) that produced it, for the journal.
+    """
+    if problems:
+        logging.warning(f"Giving up on structured {target['kind']} for '{target['name']}': {'; '.join(problems[:3])}")
+        if manifest is not None:
+            manifest.record(target['name'], structured_stage(target), "failed", input_hash, error="; ".join(problems[:20]), model=model)
+        return None
+    filename = generate_output_filename(target['file_subject'], target['stage'], extension="json")
+    record = build_record(target, data, filename)
+    filepath = save_output(output_folder, filename, json.dumps(record, ensure_ascii=False, indent=2))
+    structured_settings['index'].ingest(record)
+    if manifest is not None:
+        manifest.record(target['name'], structured_stage(target), "done" if filepath else "failed", input_hash, filepath, model=model)
+    return record
+
+def extract_structured_steps(
+    target: dict, # From structured_target
+    document: str,
+    llm: Gemini,
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    structured_settings: dict,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    model_router: ModelRouter = None
+):
+    """
+    Extracts a JSON record from a Markdown result with the extraction prompt of its kind and
+    checks it against the kind's schema; invalid answers are sent back with their problems,
+    up to max_attempts calls. Valid records are saved next to the Markdown file, added to
+    the results index and journaled, so a resumed run re-indexes them without a call.
+    Returns the record, or None. Never raises: the result it came from stands either way.
+    A stage generator (see run_stage).
+    """
+    if structured_settings is None:
+        return None
+    llm, rate_limiter = stage_model(model_router, "extract", llm, rate_limiter)
+    stage_start = time.perf_counter()
+    template, schema = structured_settings['templates'][target['kind']], STRUCTURED_SCHEMAS[target['kind']]
+    description = f"{target['kind']} extraction for '{target['name']}'"
+    attempts, record, models = 0, None, set()
+    try:
+        first_messages = messages = format_extraction_messages(template, target['kind'], target['subject'], document)
+        input_hash = hash_llm_request(llm, messages)
+        record = load_structured_record(target, input_hash, structured_settings, manifest)
+        if record is not None:
+            return record
+        with metrics.collect_models() as models:
+            while True:
+                attempts += 1
+                content = yield llm_call(llm, messages, rate_limiter, f"{description} (attempt {attempts})", response_cache)
+                data, problems = parse_structured_output(content, schema)
+                if not problems or attempts >= structured_settings['max_attempts']:
+                    break
+                logging.warning(f"Structured {target['kind']} for '{target['name']}' failed validation; asking for a fix: {problems[0]}")
+                messages = format_extraction_messages(template, target['kind'], target['subject'], document, content, problems)
+        record = store_structured_record(target, data, problems, answered_hash(llm, first_messages, models), output_folder,
+                                         structured_settings, manifest, metrics.models_label(models))
+    except Exception as e:
+        logging.error(f"Error during {description}: {e}", exc_info=True)
+        if manifest is not None:
+            manifest.record(target['name'], structured_stage(target), "failed", error=str(e))
+    metrics.record("extract", time.perf_counter() - stage_start, label=target['stage'], attempts=attempts, valid=record is not None,
+                   model=metrics.models_label(models))
+    return record
+
+# --- Quote Verification ---
+def verify_quotes(
+    video_type: str,
+    subject: str,
+    transcript: str,
+    analysis: str,
+    output_folder: str,
+    quote_settings: dict,
+    artifact_id: str = None
+):
+    """
+    Checks the quotes of an analysis against the transcript it was written from (see
+    quotes.match_quotes) and saves the per-quote results next to it as
+    '<file subject>_<type>_Quotes.json'. Quotes not found in the transcript are logged as
+    likely hallucinations. Returns the counts from summarize_matches, or None. Never raises.
+    """
+    if quote_settings is None or not analysis or analysis.startswith("Error"):
+        return None
+    _record_name, file_subject = analysis_names(subject, artifact_id)
+    stage_start = time.perf_counter()
+    try:
+        index = quote_settings['store'].index_for(artifact_id or file_subject, transcript)
+        results = match_quotes(index, extract_quotes(analysis), quote_settings)
+        summary = summarize_matches(results)
+        report = {"subject": subject, "video_id": artifact_id, "video_type": video_type, "summary": summary, "quotes": results}
+        save_output(output_folder, generate_output_filename(file_subject, f"{video_type}_Quotes", extension="json"),
+                    json.dumps(report, ensure_ascii=False, indent=2))
+    except Exception as e:
+        logging.error(f"Error verifying quotes of {video_type} for '{subject}': {e}", exc_info=True)
+        return None
+    quote_settings['store'].add_checked(summary)
+    for result in results:
+        if result['status'] == "not_found":
+            logging.warning(f"Quote in {video_type} for '{subject}' not found in the transcript: \"{result['quote'][:80]}\"")
+        elif result['timestamp_ok'] is False:
+            logging.warning(f"Quote in {video_type} for '{subject}' is at {result['transcript_timestamp']}, "
+                            f"not {result['timestamp']}: \"{result['quote'][:80]}\"")
+    logging.info(f"Verified quotes of {video_type} for '{subject}': {summary}")
+    metrics.record("verify", time.perf_counter() - stage_start, label=video_type, **summary)
+    return summary
+
+def analyze_video_steps(
     video_type: str, # "Early_take" or "Retrospective"
     subject: str,
     transcript: str,
     llm: Gemini,
     prompt_template: RichPromptTemplate, # The specific template for this type
-    rate_limiter: RateLimiter,
-    output_folder: str
-) -> str:
-    """Analyzes a single video's transcript using the LLM and saves the output."""
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    chunk_settings: dict = None,
+    artifact_id: str = None,
+    structured_settings: dict = None,
+    pundit: str = None,
+    model_router: ModelRouter = None,
+    quote_settings: dict = None,
+    stream_settings: dict = None
+):
+    """
+    Analyzes a single video's transcript using the LLM and saves the output.
+    Transcripts longer than chunk_settings['max_chars'] are analysed with map-reduce chunking.
+    With an artifact_id (the video id), the analysis is journaled per video rather than per
+    set, and its file is named '<subject>_<video id>', since several sets may share it.
+    With structured_settings, takeaways are also extracted as JSON (see extract_structured).
+    With a model_router, the analysis runs on the 'analyze' stage model and the extraction
+    on the 'extract' one; the journal records which model produced each result.
+    With quote_settings, the analysis's quotes are checked against the transcript (see verify_quotes).
+    With stream_settings, the response is streamed into its output file as it arrives.
+    Returns the content, or an error message. A stage generator (see run_stage).
+    """
     if not transcript or transcript.startswith("Error fetching transcript"):
         error_msg = transcript if transcript else "Error: Transcript unavailable."
         logging.warning(f"Skipping {video_type} analysis for '{subject}' due to: {error_msg}")
         return error_msg
 
     logging.info(f"Analyzing {video_type} for '{subject}'...")
+    record_name, file_subject = analysis_names(subject, artifact_id)
+    target = structured_target("takeaways", video_type, record_name, subject, file_subject, pundit=pundit, video_id=artifact_id)
     analysis_result = f"Error analyzing {video_type}: Unknown LLM error."
+    stage_llm, stage_limiter = stage_model(model_router, "analyze", llm, rate_limiter)
+    models = set()
+    stage_start = time.perf_counter()
     try:
         # Format prompt using the chat template structure from utils
         # Pass necessary variables expected by the Jinja template
@@ -70,40 +497,87 @@ def analyze_video(
             subject=subject
             # Ensure system_prompt_template_str was correctly embedded when creating the template
         )
+        chunked = needs_chunking(transcript, chunk_settings)
+        input_hash = hash_llm_request(stage_llm, messages, chunking_signature(chunk_settings) if chunked else None)
+        if manifest is not None:
+            saved = manifest.load_completed(record_name, video_type, input_hash)
+            if saved is not None:
+                yield from extract_structured_steps(target, saved, llm, rate_limiter, output_folder, structured_settings, response_cache,
+                                                    manifest, model_router)
+                verify_quotes(video_type, subject, transcript, saved, output_folder, quote_settings, artifact_id)
+                return saved # Completed in a previous run with identical inputs
 
-        with rate_limiter: # Apply rate limiting before the API call
-            logging.info(f"Making LLM call for {video_type} analysis of '{subject}'...")
-            response = llm.chat(messages)
-            logging.info(f"{video_type} analysis LLM call successful for '{subject}'.")
-        analysis_result = response.message.content if response.message else "Error: Empty response from LLM."
+        filename = generate_output_filename(file_subject, video_type) # e.g., 20250410_MySet_dQw4w9WgXcQ_Early_take.md
+        stream_file = StreamFile(output_folder, filename) if stream_settings is not None and not chunked else None
+        with metrics.collect_models() as models:
+            if chunked:
+                content = yield from analyze_transcript_chunked_steps(
+                    video_type, subject, transcript, stage_llm, prompt_template, stage_limiter, chunk_settings, response_cache,
+                    stream_settings
+                )
+            else:
+                content = yield llm_call(stage_llm, messages, stage_limiter, f"{video_type} analysis of '{subject}'", response_cache,
+                                         stream_settings, stream_file)
+        analysis_result = content if content else "Error: Empty response from LLM."
 
-        # Save the successful result
-        filename = generate_output_filename(subject, video_type) # e.g., 20250410_MySet_Early_take.md
-        save_output(output_folder, filename, analysis_result)
+        # Save the successful result (a streamed one is already in place)
+        filepath = (stream_file and stream_file.saved_path(content)) or save_output(output_folder, filename, analysis_result)
+        if manifest is not None:
+            status = "done" if content and filepath else "failed"
+            journal_hash = answered_hash(stage_llm, messages, models, chunking_signature(chunk_settings) if chunked else None)
+            manifest.record(record_name, video_type, status, journal_hash, filepath, model=metrics.models_label(models))
+        if content:
+            yield from extract_structured_steps(target, content, llm, rate_limiter, output_folder, structured_settings, response_cache,
+                                                manifest, model_router)
+            verify_quotes(video_type, subject, transcript, content, output_folder, quote_settings, artifact_id)
 
     except Exception as e:
         logging.error(f"Error during {video_type} analysis LLM call for '{subject}': {e}", exc_info=True)
         analysis_result = f"Error analyzing {video_type}: {e}"
+        if manifest is not None:
+            manifest.record(record_name, video_type, "failed", error=str(e))
 
+    metrics.record("analyze", time.perf_counter() - stage_start, label=video_type, transcript_chars=len(transcript),
+                   model=metrics.models_label(models))
     return analysis_result # Return the content (or error message)
 
-def compare_analyses(
+def compare_analyses_steps(
     subject: str,
     takeaways_early: str,
     takeaways_retro: str,
     llm: Gemini,
     compare_prompt_template: RichPromptTemplate,
-    rate_limiter: RateLimiter,
-    output_folder: str
-) -> str:
-    """Compares two sets of takeaways using the LLM and saves the output."""
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    label: str = None,
+    structured_settings: dict = None,
+    pundit: str = None,
+    model_router: ModelRouter = None,
+    stream_settings: dict = None
+):
+    """
+    Compares two sets of takeaways using the LLM and saves the output.
+    label (default: subject) names the output file and journal entry, so the several
+    pairs of a multi-video set do not overwrite each other.
+    With structured_settings, verdicts are also extracted as JSON (see extract_structured).
+    With a model_router, the comparison runs on the 'compare' stage model.
+    With stream_settings, the response is streamed into its output file as it arrives.
+    Returns the content, or an error message. A stage generator (see run_stage).
+    """
+    label = label or subject
+    target = structured_target("comparison", "Analysis", label, subject, label, pundit=pundit)
     if takeaways_early.startswith("Error:") or takeaways_retro.startswith("Error:"):
         error_msg = "Error: Cannot compare due to error in one or both preceding analyses."
-        logging.warning(f"Skipping comparison for '{subject}' due to previous errors.")
+        logging.warning(f"Skipping comparison for '{label}' due to previous errors.")
         return error_msg
 
-    logging.info(f"Comparing analyses for '{subject}'...")
+    logging.info(f"Comparing analyses for '{label}'...")
     comparison_result = "Error comparing analyses: Unknown LLM error."
+    stage_llm, stage_limiter = stage_model(model_router, "compare", llm, rate_limiter)
+    models = set()
+    stage_start = time.perf_counter()
     try:
         # Format the comparison prompt
         messages = compare_prompt_template.format_messages(
@@ -112,90 +586,266 @@ def compare_analyses(
             subject=subject
              # Ensure system_prompt_template_str was correctly embedded
         )
-        with rate_limiter: # Apply rate limiting
-            logging.info(f"Making LLM call for comparison of '{subject}'...")
-            response = llm.chat(messages)
-            logging.info(f"Comparison LLM call successful for '{subject}'.")
-        comparison_result = response.message.content if response.message else "Error: Empty response from LLM."
+        input_hash = hash_llm_request(stage_llm, messages)
+        if manifest is not None:
+            saved = manifest.load_completed(label, "Analysis", input_hash)
+            if saved is not None:
+                yield from extract_structured_steps(target, saved, llm, rate_limiter, output_folder, structured_settings, response_cache,
+                                                    manifest, model_router)
+                return saved # Completed in a previous run with identical inputs
 
-        # Save the successful comparison
-        filename = generate_output_filename(subject, "Analysis") # e.g., 20250410_MySet_Analysis.md
-        save_output(output_folder, filename, comparison_result)
+        filename = generate_output_filename(label, "Analysis") # e.g., 20250410_MySet_Analysis.md
+        stream_file = StreamFile(output_folder, filename) if stream_settings is not None else None
+        with metrics.collect_models() as models:
+            content = yield llm_call(stage_llm, messages, stage_limiter, f"comparison of '{label}'", response_cache,
+                                     stream_settings, stream_file)
+        comparison_result = content if content else "Error: Empty response from LLM."
+
+        # Save the successful comparison (a streamed one is already in place)
+        filepath = (stream_file and stream_file.saved_path(content)) or save_output(output_folder, filename, comparison_result)
+        if manifest is not None:
+            status = "done" if content and filepath else "failed"
+            manifest.record(label, "Analysis", status, answered_hash(stage_llm, messages, models), filepath,
+                            model=metrics.models_label(models))
+        if content:
+            yield from extract_structured_steps(target, content, llm, rate_limiter, output_folder, structured_settings, response_cache,
+                                                manifest, model_router)
 
     except Exception as e:
-        logging.error(f"Error during comparison LLM call for '{subject}': {e}", exc_info=True)
+        logging.error(f"Error during comparison LLM call for '{label}': {e}", exc_info=True)
         comparison_result = f"Error comparing analyses: {e}"
+        if manifest is not None:
+            manifest.record(label, "Analysis", "failed", error=str(e))
 
+    metrics.record("compare", time.perf_counter() - stage_start, label="Analysis", model=metrics.models_label(models))
     return comparison_result # Return the content (or error message)
 
+def analyze_video(*args, **kwargs) -> str:
+    """Analyzes a single video on this thread (see analyze_video_steps)."""
+    return run_stage(analyze_video_steps(*args, **kwargs))
+
+def compare_analyses(*args, **kwargs) -> str:
+    """Compares two analyses on this thread (see compare_analyses_steps)."""
+    return run_stage(compare_analyses_steps(*args, **kwargs))
+
 # --- Set Processing Orchestration ---
 def process_video_set(
-    video_set: dict, # Contains subject, early_take obj, retrospective obj
+    video_set: dict, # Contains subject, early_take and retrospective video(s)
     reader: YoutubeTranscriptReader,
     llm: Gemini,
     prompt_templates: dict, # Dict containing 'early', 'retro', 'compare' RichPromptTemplate objects
-    rate_limiter: RateLimiter,
-    output_folder: str
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    transcript_cache: TranscriptCache = None,
+    refresh_transcripts: bool = False,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    chunk_settings: dict = None,
+    prefetcher=None,
+    preprocess_settings: dict = None,
+    artifacts: AnalysisArtifacts = None,
+    structured_settings: dict = None,
+    model_router: ModelRouter = None,
+    quote_settings: dict = None,
+    stream_settings: dict = None
 ) -> dict:
-    """Processes a single set of early take and retrospective videos."""
+    """
+    Processes a single set: analyses each of its videos once, then compares every early
+    take with every retrospective. Analyses already produced by another set in flight
+    are taken from the shared artifacts registry.
+    """
     subject = video_set['subject']
-    early_config = video_set['early_take']
-    retro_config = video_set['retrospective']
-    early_url = early_config['url']
-    retro_url = retro_config['url']
-
-    logging.info(f"Processing set: '{subject}' (Early: {early_url} | Retro: {retro_url})")
-
-    # Determine which prompts to use (potentially overridden in config)
-    # For simplicity now, we assume global prompts are used. Add logic here if needed.
-    early_prompt = prompt_templates['early']
-    retro_prompt = prompt_templates['retro']
-    compare_prompt = prompt_templates['compare']
-
-    # 1. Fetch Transcripts
-    transcript_early = get_transcript(early_url, reader)
-    transcript_retro = get_transcript(retro_url, reader)
-
-    # 2. Analyze Early Take Video (Rate limit inside analyze_video)
-    early_analysis_result = analyze_video(
-        video_type="Early_take",
-        subject=subject,
-        transcript=transcript_early,
-        llm=llm,
-        prompt_template=early_prompt,
-        rate_limiter=rate_limiter,
-        output_folder=output_folder
-    )
-
-    # 3. Analyze Retrospective Video (Rate limit inside analyze_video)
-    retro_analysis_result = analyze_video(
-        video_type="Retrospective",
-        subject=subject,
-        transcript=transcript_retro,
-        llm=llm,
-        prompt_template=retro_prompt,
-        rate_limiter=rate_limiter,
-        output_folder=output_folder
-    )
-
-    # 4. Compare Analyses (Rate limit inside compare_analyses)
-    comparison_result = compare_analyses(
-        subject=subject,
-        takeaways_early=early_analysis_result,
-        takeaways_retro=retro_analysis_result,
-        llm=llm,
-        compare_prompt_template=compare_prompt,
-        rate_limiter=rate_limiter,
-        output_folder=output_folder
-    )
+    analyses = set_analyses(video_set)
+    keys = [analysis['key'] for analysis in analyses]
+    artifacts = artifacts if artifacts is not None else AnalysisArtifacts()
+
+    logging.info(f"Processing set: '{subject}' ({len(analyses)} videos: {', '.join(keys)})")
+    metrics_token = metrics.current_set.set(subject) # Attribute recorded events to this set
+    artifacts.retain(keys)
+    try:
+        # 1. Fetch, compact (no-op unless preprocessing is enabled) and analyze each video
+        results = {}
+        for analysis in analyses:
+            results[analysis['key']] = artifacts.compute(analysis['key'], lambda analysis=analysis: analyze_video(
+                video_type=analysis['video_type'],
+                subject=subject,
+                transcript=preprocess_transcript(
+                    fetch_transcript(analysis['url'], reader, transcript_cache, refresh_transcripts, prefetcher),
+                    preprocess_settings, analysis['url']
+                ),
+                llm=llm,
+                prompt_template=prompt_templates[analysis['prompt']],
+                rate_limiter=rate_limiter,
+                output_folder=output_folder,
+                response_cache=response_cache,
+                manifest=manifest,
+                chunk_settings=chunk_settings,
+                artifact_id=analysis['video_id'],
+                structured_settings=structured_settings,
+                pundit=analysis['pundit'],
+                model_router=model_router,
+                quote_settings=quote_settings,
+                stream_settings=stream_settings
+            ))
+
+        # 2. Compare every early take with every retrospective
+        pairs = []
+        for pair in set_comparisons(video_set):
+            early_result, retro_result = results[pair['early_key']], results[pair['retro_key']]
+            comparison_result = compare_analyses(
+                subject=subject,
+                takeaways_early=early_result,
+                takeaways_retro=retro_result,
+                llm=llm,
+                compare_prompt_template=prompt_templates['compare'],
+                rate_limiter=rate_limiter,
+                output_folder=output_folder,
+                response_cache=response_cache,
+                manifest=manifest,
+                label=pair['label'],
+                structured_settings=structured_settings,
+                pundit=pair['pundit'],
+                model_router=model_router,
+                stream_settings=stream_settings
+            )
+            pairs.append(summarize_pair(pair, early_result, retro_result, comparison_result))
+    finally:
+        artifacts.release(keys)
+        metrics.current_set.reset(metrics_token)
 
     logging.info(f"Finished processing set: '{subject}'")
     # Return a summary dictionary (detailed results are saved to files)
+    return summarize_set(subject, pairs)
+
+def _status(result: str) -> str:
+    return "OK" if not result.startswith("Error:") else result
+
+def summarize_pair(pair: dict, early_result: str, retro_result: str, comparison_result: str) -> dict:
+    """Summary of one comparison; keeps the comparison text for the pundit rollup stage."""
+    return {
+        "pundit": pair['pundit'],
+        "label": pair['label'],
+        "early_take_url": pair['early_url'],
+        "retrospective_url": pair['retro_url'],
+        "early_take_status": _status(early_result),
+        "retrospective_status": _status(retro_result),
+        "comparison_status": _status(comparison_result),
+        "comparison": comparison_result if _status(comparison_result) == "OK" else None,
+    }
+
+def summarize_set(subject: str, pairs: list) -> dict:
+    """
+    Builds the per-set summary dictionary reported by main.py from its pair summaries.
+    Each status is "OK" or the first error among the set's pairs.
+    """
+    def combined(key):
+        return next((pair[key] for pair in pairs if pair[key] != "OK"), "OK")
+    def urls(key):
+        return ", ".join(dict.fromkeys(pair[key] for pair in pairs))
     return {
         "subject": subject,
-        "early_take_url": early_url,
-        "retrospective_url": retro_url,
-        "early_take_status": "OK" if not early_analysis_result.startswith("Error:") else early_analysis_result,
-        "retrospective_status": "OK" if not retro_analysis_result.startswith("Error:") else retro_analysis_result,
-        "comparison_status": "OK" if not comparison_result.startswith("Error:") else comparison_result,
+        "early_take_url": urls('early_take_url'),
+        "retrospective_url": urls('retrospective_url'),
+        "early_take_status": combined('early_take_status'),
+        "retrospective_status": combined('retrospective_status'),
+        "comparison_status": combined('comparison_status'),
+        "comparisons": pairs,
     }
+
+def add_video_set_tasks(
+    scheduler: StageScheduler,
+    video_set: dict,
+    reader: YoutubeTranscriptReader,
+    llm: Gemini,
+    prompt_templates: dict,
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    transcript_cache: TranscriptCache = None,
+    refresh_transcripts: bool = False,
+    response_cache: ResponseCache = None,
+    manifest: RunManifest = None,
+    chunk_settings: dict = None,
+    task_prefix: str = None,
+    prefetcher=None,
+    preprocess_settings: dict = None,
+    artifacts: AnalysisArtifacts = None,
+    structured_settings: dict = None,
+    model_router: ModelRouter = None,
+    quote_settings: dict = None,
+    stream_settings: dict = None
+) -> str:
+    """
+    Breaks one video set into stage tasks (fetch + analyze per video, compare per pair and a
+    final summary) on the scheduler. Returns the id of the final task, whose result is the
+    summary dict from summarize_set.
+    With a prefetcher, the fetch tasks only wait for the transcripts it is downloading.
+    Fetch tasks also run transcript preprocessing, so analyze tasks receive compacted transcripts.
+
+    Analyses are claimed in the shared artifacts registry: a video already claimed by another
+    set is neither fetched nor analysed again. While the owner's analyze task is pending,
+    this set's compare tasks depend on it directly; once it has finished, they take its
+    result from the registry. The set's keys are retained here; the caller releases
+    set_analysis_keys(video_set) once the final task has finished.
+    """
+    subject = video_set['subject']
+    prefix = f"{task_prefix or subject}:" # Task ids must be unique across sets
+    artifacts = artifacts if artifacts is not None else AnalysisArtifacts()
+    analyses = set_analyses(video_set)
+    artifacts.retain([analysis['key'] for analysis in analyses])
+
+    sources = {} # Analysis key -> id of the task producing it, or the future holding its finished result
+    for analysis in analyses:
+        analyze_id = prefix + f"analyze:{analysis['key']}"
+        future, owner = artifacts.claim(analysis['key'], analyze_id)
+        if not owner:
+            owner_task = artifacts.owner_task(analysis['key'])
+            sources[analysis['key']] = owner_task if owner_task is not None and scheduler.pending(owner_task) else future
+            continue
+
+        def fetch(analysis=analysis, future=future):
+            try:
+                return preprocess_transcript(
+                    fetch_transcript(analysis['url'], reader, transcript_cache, refresh_transcripts, prefetcher),
+                    preprocess_settings, analysis['url']
+                )
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+        def analyze(transcript, analysis=analysis, future=future):
+            return AnalysisArtifacts.fulfil(future, lambda: analyze_video(
+                analysis['video_type'], subject, transcript, llm, prompt_templates[analysis['prompt']],
+                rate_limiter, output_folder, response_cache, manifest, chunk_settings, analysis['video_id'],
+                structured_settings, analysis['pundit'], model_router, quote_settings, stream_settings
+            ))
+
+        fetch_task = scheduler.add_task(prefix + f"fetch:{analysis['key']}", "fetch", metrics.bind_set(subject, fetch))
+        sources[analysis['key']] = scheduler.add_task(analyze_id, "analyze", metrics.bind_set(subject, analyze), deps=[fetch_task])
+
+    compare_tasks = []
+    for number, pair in enumerate(set_comparisons(video_set)):
+        pair_sources = [sources[pair['early_key']], sources[pair['retro_key']]]
+
+        def compare(*dep_results, pair=pair, pair_sources=pair_sources):
+            # Task results arrive as arguments; analyses finished before this set was added are read from their futures
+            dep_results = iter(dep_results)
+            early_result, retro_result = [
+                source.result() if isinstance(source, concurrent.futures.Future) else next(dep_results) for source in pair_sources
+            ]
+            comparison_result = compare_analyses(
+                subject, early_result, retro_result, llm, prompt_templates['compare'],
+                rate_limiter, output_folder, response_cache, manifest, pair['label'], structured_settings, pair['pundit'],
+                model_router, stream_settings
+            )
+            return summarize_pair(pair, early_result, retro_result, comparison_result)
+
+        compare_tasks.append(scheduler.add_task(
+            prefix + f"compare:{number}", "compare", metrics.bind_set(subject, compare),
+            deps=[source for source in pair_sources if not isinstance(source, concurrent.futures.Future)]
+        ))
+
+    def summarize(*pairs):
+        logging.info(f"Finished processing set: '{subject}'")
+        return summarize_set(subject, list(pairs))
+
+    return scheduler.add_task(prefix + "summary", "compare", metrics.bind_set(subject, summarize), deps=compare_tasks)
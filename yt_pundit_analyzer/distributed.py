@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+# Import functions from the same package
+from . import metrics
+from .core import get_transcript, analyze_video, compare_analyses, summarize_pair, summarize_set
+from .artifacts import set_analyses, set_comparisons
+from .preprocess import preprocess_transcript
+from .jobqueue import JobQueue
+from .ratelimit import is_rate_limit_error
+from .utils import load_prompt
+
+# --- Job Definitions ---
+PROMPT_FILE_KEYS = {"early": "early_take_prompt_file", "retro": "retrospective_prompt_file", "compare": "compare_prompt_file"}
+PROMPT_STAGES = {"early": "analyze", "retro": "analyze", "compare": "compare"}
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+def job_signatures(config: dict) -> dict:
+    """
+    A short hash per prompt key ('early', 'retro', 'compare') of the config that determines
+    its jobs' results: the prompt file contents and the model running the stage (with its
+    'models' settings); analyses also depend on the chunking and preprocess settings.
+    """
+    stage_models = config.get('stage_models') or {}
+    signatures = {}
+    for prompt, file_key in PROMPT_FILE_KEYS.items():
+        stage = PROMPT_STAGES[prompt]
+        model = stage_models.get(stage) or config.get('llm_model_name')
+        inputs = [load_prompt(config[file_key]), model, (config.get('models') or {}).get(model)]
+        if stage == "analyze":
+            inputs += [config.get('chunking'), config.get('preprocess')]
+        signatures[prompt] = _digest(*inputs)
+    return signatures
+
+def video_set_jobs(video_set: dict, index: int, signatures: dict = None) -> list:
+    """
+    The queue jobs for one set: an analyze job per video (fetch + preprocess + analysis)
+    and a compare job per (early take, retrospective) pair that depends on both. Ids are
+    built from the set's content and the job signatures (see job_signatures), so
+    re-enqueueing the same config is a no-op for jobs that are already queued, while
+    editing a prompt or changing a stage's model enqueues new jobs instead of reusing
+    results produced with the old ones. Analyze jobs are keyed by video and prompt, so a
+    video shared by several sets is analysed once.
+    """
+    subject = video_set['subject']
+    signatures = signatures or {}
+
+    def analyze_id(key):
+        prompt = key.rsplit(':', 1)[1]
+        return f"analyze:{key}:{signatures[prompt]}" if prompt in signatures else f"analyze:{key}"
+
+    jobs = [
+        {"job_id": analyze_id(analysis['key']), "set_name": subject, "stage": "analyze", "priority": index,
+         "payload": {"subject": subject, "video_type": analysis['video_type'], "url": analysis['url'],
+                     "prompt": analysis['prompt'], "video_id": analysis['video_id'], "pundit": analysis['pundit']}}
+        for analysis in set_analyses(video_set)
+    ]
+    for pair in set_comparisons(video_set):
+        deps = [analyze_id(pair['early_key']), analyze_id(pair['retro_key'])]
+        jobs.append(
+            {"job_id": f"compare:{subject}:{pair['early_key']}:{pair['retro_key']}:{_digest(signatures.get('compare'), deps)}",
+             "set_name": subject, "stage": "compare", "priority": index, "payload": {"subject": subject, "pair": pair},
+             "deps": deps}
+        )
+    return jobs
+
+def enqueue_video_sets(queue: JobQueue, video_sets, batch_size: int = 500, signatures: dict = None) -> int:
+    """
+    Enqueues the jobs of all sets, reading video_sets (any iterable) in batches so large
+    streamed inputs are never held in memory. Returns the number of new jobs.
+    signatures (from job_signatures) tie the job ids to the prompts and models in use.
+    """
+    added, total, sets, batch = 0, 0, 0, []
+    for index, video_set in enumerate(video_sets):
+        batch.extend(video_set_jobs(video_set, index, signatures))
+        sets += 1
+        if sets % batch_size == 0:
+            added += queue.enqueue(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        added += queue.enqueue(batch)
+        total += len(batch)
+    logging.info(f"Enqueued {added} new jobs ({total} total) for {sets} sets.")
+    return added
+
+def run_job(job: dict, dep_results: list, components: dict, output_folder: str):
+    """Executes one queue job with this worker's reader/LLM/limiter; returns its result."""
+    payload = job['payload']
+    if job['stage'] == "analyze":
+        transcript = get_transcript(payload['url'], components['reader'], components['transcript_cache'], components['refresh_transcripts'])
+        transcript = preprocess_transcript(transcript, components['preprocess_settings'], payload['url'])
+        return analyze_video(
+            payload['video_type'], payload['subject'], transcript, components['llm'],
+            components['prompt_templates'][payload['prompt']], components['rate_limiter'], output_folder,
+            components['response_cache'], None, components['chunk_settings'], payload.get('video_id'),
+            components['structured_settings'], payload.get('pundit'), components['model_router'], components['quote_settings'],
+            components['stream_settings']
+        )
+    if job['stage'] == "compare":
+        early_result, retro_result = dep_results
+        pair = payload['pair']
+        comparison_result = compare_analyses(
+            payload['subject'], early_result, retro_result, components['llm'], components['prompt_templates']['compare'],
+            components['rate_limiter'], output_folder, components['response_cache'], None, pair['label'],
+            components['structured_settings'], pair['pundit'], components['model_router'], components['stream_settings']
+        )
+        # One summary per pair; the coordinator reports each of them
+        return summarize_set(payload['subject'], [summarize_pair(pair, early_result, retro_result, comparison_result)])
+    raise ValueError(f"Unknown job stage: {job['stage']}")
+
+# Transport failures worth another attempt; other error results (a missing transcript, an
+# upstream analysis that failed, a rejected prompt) would fail the same way again
+_TRANSIENT_ERROR = re.compile(
+    r"\b(?:500|502|503|504)\b|timed? ?out|timeout|deadline|temporar|service unavailable|connection|"
+    r"reset by peer|broken pipe|stalled|latency budget|overloaded|internal server error",
+    re.IGNORECASE
+)
+
+def _is_transient_error_result(result) -> bool:
+    """True for an error result caused by a rate limit or transport failure."""
+    if not (isinstance(result, str) and result.startswith("Error")):
+        return False
+    return is_rate_limit_error(RuntimeError(result)) or bool(_TRANSIENT_ERROR.search(result))
+
+
+# --- Worker ---
+class Worker:
+    """
+    Claims jobs from the shared queue and runs them on `concurrency` threads, using this
+    machine's own API key and rate limiter. Leases are kept alive by a heartbeat thread;
+    if the worker dies, its jobs are re-queued once their leases expire.
+
+    Jobs that raise, or whose error result comes from a rate limit or transport failure
+    (see _is_transient_error_result), are handed back to the queue for another attempt,
+    possibly on another worker; the last attempt's error result is kept so the set's
+    summary still reports it. Other error results are stored right away.
+    """
+
+    def __init__(self, queue: JobQueue, components: dict, output_folder: str, worker_id: str = None,
+                 concurrency: int = 4, lease_seconds: float = 600, poll_interval: float = 5, exit_when_idle: bool = True):
+        self.queue = queue
+        self.components = components
+        self.output_folder = output_folder
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+        self.completed = 0
+        self.failed = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                active = list(self._active)
+            try:
+                held = self.queue.heartbeat(active, self.worker_id, self.lease_seconds)
+            except Exception as e: # e.g. the queue database is locked or briefly unreachable
+                logging.error(f"Heartbeat for {len(active)} jobs failed: {e}; retrying at the next beat.")
+                continue
+            for job_id in set(active) - set(held):
+                logging.warning(f"Lost the lease on job '{job_id}'; its result will be discarded.")
+
+    def _run_one(self, job: dict):
+        token = metrics.current_set.set(job['set_name'])
+        try:
+            dep_results = [self.queue.results(job['deps'])[dep] for dep in job['deps']] if job['deps'] else []
+            result = run_job(job, dep_results, self.components, self.output_folder)
+            if _is_transient_error_result(result) and job['attempt'] < self.queue.max_attempts:
+                logging.warning(f"Job '{job['job_id']}' returned a transient error (attempt {job['attempt']}); re-queueing: {result[:200]}")
+                self.queue.fail(job['job_id'], self.worker_id, result)
+                return
+            if self.queue.complete(job['job_id'], self.worker_id, result):
+                with self._lock:
+                    self.completed += 1
+                logging.info(f"Completed job '{job['job_id']}'.")
+            else:
+                logging.warning(f"Job '{job['job_id']}' finished after its lease was taken over; result discarded.")
+        except Exception as e:
+            logging.error(f"Job '{job['job_id']}' failed: {e}", exc_info=True)
+            with self._lock:
+                self.failed += 1
+            self.queue.fail(job['job_id'], self.worker_id, f"{type(e).__name__}: {e}")
+        finally:
+            metrics.current_set.reset(token)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = self.queue.claim(self.worker_id, self.lease_seconds)
+            if job is None:
+                counts = self.queue.counts()
+                if self.exit_when_idle and counts['queued'] == 0 and counts['leased'] == 0:
+                    return
+                self._stop.wait(self.poll_interval) # Jobs are waiting on dependencies held by other workers
+                continue
+            with self._lock:
+                self._active.add(job['job_id'])
+            try:
+                self._run_one(job)
+            finally:
+                with self._lock:
+                    self._active.discard(job['job_id'])
+
+    def run(self) -> dict:
+        """Processes jobs until the queue is drained (or forever if exit_when_idle is False)."""
+        logging.info(f"Worker {self.worker_id} started with {self.concurrency} threads (lease: {self.lease_seconds}s).")
+        heartbeat = threading.Thread(target=self._heartbeat, name="Heartbeat", daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._loop, name=f"Job_{i}") for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            self._stop.set()
+            heartbeat.join()
+        logging.info(f"Worker {self.worker_id} finished: {self.completed} jobs completed, {self.failed} failed attempts.")
+        return {"completed": self.completed, "failed": self.failed}
+
+
+# --- Coordinator ---
+def wait_for_queue(queue: JobQueue, poll_interval: float = 10, on_progress=None) -> dict:
+    """Blocks until no job is queued or leased, calling on_progress(counts) on each poll."""
+    while True:
+        counts = queue.counts()
+        if on_progress is not None:
+            on_progress(counts)
+        if counts['queued'] == 0 and counts['leased'] == 0:
+            return counts
+        time.sleep(poll_interval)
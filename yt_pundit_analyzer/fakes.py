@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+
+# Offline stand-ins for YoutubeTranscriptReader and Gemini, used by benchmark.py.
+# They only implement the parts of the llama_index interfaces that the pipeline uses.
+
+_WORDS = (
+    "the format is fast aggro decks are great this card is a bomb I think removal is premium "
+    "green looks deep blue feels weak the common is underrated you want two drops here honestly "
+    "this archetype will be the best deck we were wrong about that the mechanic is really strong"
+).split()
+
+# --- Fake Transcript Reader ---
+class FakeDocument:
+    def __init__(self, text: str, video_id: str):
+        self.text = text
+        self.metadata = {"video_id": video_id}
+
+    def get_content(self) -> str:
+        return self.text
+
+
+class FakeTranscriptReader:
+    """
+    Deterministic replacement for YoutubeTranscriptReader: each URL yields a synthetic
+    caption-style transcript of ~transcript_chars characters, seeded by the URL.
+    """
+
+    def __init__(self, transcript_chars: int = 50000, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.transcript_chars = transcript_chars
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _transcript(self, url: str) -> str:
+        rng = random.Random(f"{self.seed}:{url}")
+        lines, length = [], 0
+        while length < self.transcript_chars:
+            line = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14)))
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
+
+    def load_data(self, ytlinks: list, **kwargs) -> list:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency * len(ytlinks)) # The real reader fetches links one after another
+        documents = []
+        for url in ytlinks:
+            rng = random.Random(f"{self.seed}:error:{url}")
+            if rng.random() < self.error_rate:
+                raise RuntimeError(f"Fake transcript unavailable for {url}")
+            documents.append(FakeDocument(self._transcript(url), hashlib.sha1(url.encode()).hexdigest()[:11]))
+        return documents
+
+
+# --- Fake Gemini LLM ---
+class ResourceExhausted(Exception):
+    """Mimics google.api_core.exceptions.ResourceExhausted (HTTP 429)."""
+    code = 429
+
+
+class FakeLLMError(Exception):
+    """A non-retryable failure from the fake LLM."""
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.role = "assistant"
+        self.content = content
+
+
+class FakeChatResponse:
+    def __init__(self, content: str, prompt_tokens: int, output_tokens: int, delta: str = None):
+        self.message = FakeMessage(content)
+        self.delta = delta
+        self.raw = {"usage_metadata": {"prompt_token_count": prompt_tokens, "candidates_token_count": output_tokens}}
+
+
+class FakeGemini:
+    """
+    Replacement for llama_index's Gemini with configurable behaviour:
+    latency is log-normally distributed around latency_median (spread set by latency_sigma,
+    0 for a fixed latency), plus per-prompt-token time; error_rate and rate_limit_rate give
+    the probability that a call raises FakeLLMError or ResourceExhausted (429).
+    Streamed calls send stream_chunks chunks spread over the latency; with probability
+    stall_rate, a stream hangs for stall_seconds after its first chunk.
+    """
+
+    def __init__(self, model: str = "models/fake-gemini", latency_median: float = 1.0, latency_sigma: float = 0.0,
+                 seconds_per_1k_prompt_tokens: float = 0.0, output_chars: int = 4000, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: int = 0, stream_chunks: int = 8, stall_rate: float = 0.0,
+                 stall_seconds: float = 600.0):
+        self.model = model
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.seconds_per_1k_prompt_tokens = seconds_per_1k_prompt_tokens
+        self.output_chars = output_chars
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_chunks = stream_chunks
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _plan_call(self, messages) -> tuple:
+        """Draws latency and outcome for one call. Returns (latency, error or None, response)."""
+        prompt_chars = sum(len(m.content or "") for m in messages)
+        prompt_tokens = prompt_chars // 4 + 1
+        with self._lock:
+            self.calls += 1
+            jitter = self._rng.lognormvariate(0, self.latency_sigma) if self.latency_sigma else 1.0
+            roll = self._rng.random()
+        latency = self.latency_median * jitter + prompt_tokens / 1000 * self.seconds_per_1k_prompt_tokens
+        error = None
+        if roll < self.rate_limit_rate:
+            error = ResourceExhausted("429 Resource has been exhausted (fake quota)")
+        elif roll < self.rate_limit_rate + self.error_rate:
+            error = FakeLLMError("Fake LLM failure")
+        if error is not None:
+            with self._lock:
+                self.failures += 1
+            return latency, error, None
+        digest = hashlib.sha1("".join(m.content or "" for m in messages).encode()).hexdigest()
+        content = f"# Fake takeaways {digest[:12]}\n\n" + ("- takeaway line\n" * (self.output_chars // 16))
+        return latency, None, FakeChatResponse(content, prompt_tokens, len(content) // 4 + 1)
+
+    def chat(self, messages, **kwargs) -> FakeChatResponse:
+        latency, error, response = self._plan_call(messages)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    async def achat(self, messages, **kwargs) -> FakeChatResponse:
+        latency, error, response = self._plan_call(messages)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    def _plan_stream(self, messages) -> tuple:
+        """Like _plan_call, plus the chunks of the response and whether the stream stalls."""
+        latency, error, response = self._plan_call(messages)
+        with self._lock:
+            stalls = self._rng.random() < self.stall_rate
+        if response is None:
+            return latency, error, [], stalls
+        content, usage = response.message.content, response.raw['usage_metadata']
+        size = max(1, len(content) // self.stream_chunks + 1)
+        chunks = []
+        for start in range(0, len(content), size):
+            chunk = FakeChatResponse(content[:start + size], usage['prompt_token_count'], usage['candidates_token_count'],
+                                     delta=content[start:start + size])
+            chunks.append(chunk)
+        return latency, error, chunks, stalls
+
+    def stream_chat(self, messages, **kwargs):
+        latency, error, chunks, stalls = self._plan_stream(messages)
+        time.sleep(latency / 2) # Time to first token
+        if error is not None:
+            raise error
+        for number, chunk in enumerate(chunks):
+            if number == 1 and stalls:
+                time.sleep(self.stall_seconds)
+            time.sleep(latency / 2 / len(chunks))
+            yield chunk
+
+    async def astream_chat(self, messages, **kwargs):
+        latency, error, chunks, stalls = self._plan_stream(messages)
+        await asyncio.sleep(latency / 2)
+        if error is not None:
+            raise error
+
+        async def stream():
+            for number, chunk in enumerate(chunks):
+                if number == 1 and stalls:
+                    await asyncio.sleep(self.stall_seconds)
+                await asyncio.sleep(latency / 2 / len(chunks))
+                yield chunk
+        return stream()
+
@@ -0,0 +1,288 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# --- Job Queue Interface ---
+class JobQueue(abc.ABC):
+    """
+    Durable queue of stage jobs shared by a coordinator and any number of workers.
+
+    A job is a dict with job_id, set_name, stage, payload (JSON-serializable), deps (job ids
+    that must be done first) and priority (lower runs first). Workers claim a job with a
+    lease that they keep alive with heartbeat(); a job whose lease expires is handed to
+    the next claimer. complete()/fail() only succeed for the current lease owner, so a
+    worker that lost its lease cannot overwrite the result of the one that took over.
+    """
+
+    max_attempts = 3 # Claims per job before it is marked failed
+
+    @abc.abstractmethod
+    def enqueue(self, jobs: list) -> int:
+        """Adds jobs, ignoring ids that already exist. Returns the number of new jobs."""
+
+    @abc.abstractmethod
+    def claim(self, owner: str, lease_seconds: float):
+        """Leases the next runnable job (all deps done) to owner; returns the job dict or None."""
+
+    @abc.abstractmethod
+    def heartbeat(self, job_ids: list, owner: str, lease_seconds: float) -> list:
+        """Extends the leases of owner's jobs. Returns the ids whose lease owner still holds."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, owner: str, result) -> bool:
+        """Stores a leased job's result. Returns False if owner no longer holds the lease."""
+
+    @abc.abstractmethod
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        """Returns the job to the queue, or marks it (and its dependents) failed after max_attempts."""
+
+    @abc.abstractmethod
+    def results(self, job_ids: list) -> dict:
+        """Maps job ids to their stored results."""
+
+    @abc.abstractmethod
+    def counts(self) -> dict:
+        """Number of jobs per status (queued, leased, done, failed)."""
+
+    @abc.abstractmethod
+    def finished_jobs(self, stage: str):
+        """Iterates the done and failed jobs of a stage, as dicts with result/error."""
+
+    def close(self):
+        pass
+
+
+# --- SQLite Backend ---
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs", "fuse.glusterfs",
+                       "fuse.sshfs", "lustre", "gpfs", "beegfs"}
+
+def on_network_filesystem(path: str) -> bool:
+    """True if path is on a network filesystem according to /proc/mounts (False where that is unavailable)."""
+    directory = os.path.dirname(os.path.realpath(path)) or '.'
+    best, best_type = "", None
+    try:
+        with open("/proc/mounts", 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                inside = directory == mount_point or directory.startswith(mount_point.rstrip('/') + '/')
+                if inside and len(mount_point) > len(best):
+                    best, best_type = mount_point, fields[2]
+    except OSError:
+        return False
+    return best_type in NETWORK_FILESYSTEMS
+
+class SQLiteJobQueue(JobQueue):
+    """
+    JobQueue stored in a SQLite database. Claims run in an IMMEDIATE transaction, so two
+    workers never lease the same job.
+
+    On a local disk the database uses WAL mode, which only works for processes on one
+    host (its -shm index is shared memory). With shared_filesystem (the default when the
+    path is on NFS, SMB and the like), it uses the rollback journal instead, so workers on
+    several machines coordinate through file locks alone; the share must implement POSIX
+    locking correctly (e.g. NFSv4, or NFSv3 with lockd), which synced folders do not.
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3, shared_filesystem: bool = None):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.shared_filesystem = on_network_filesystem(db_path) if shared_filesystem is None else shared_filesystem
+        self._lock = threading.Lock() # One connection shared by the worker's threads
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL needs shared memory between all processes; over a network share use the rollback journal
+        self._conn.execute(f"PRAGMA journal_mode={'DELETE' if self.shared_filesystem else 'WAL'}")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                set_name TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                result TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_deps (
+                job_id TEXT NOT NULL,
+                dep_id TEXT NOT NULL,
+                PRIMARY KEY (job_id, dep_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority);
+            CREATE INDEX IF NOT EXISTS idx_job_deps_dep ON job_deps (dep_id);
+        """)
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, jobs: list) -> int:
+        def insert(conn):
+            added = 0
+            now = time.time()
+            for job in jobs:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, set_name, stage, payload, priority, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job['job_id'], job['set_name'], job['stage'], json.dumps(job['payload']), job.get('priority', 0), now)
+                )
+                added += cursor.rowcount
+                conn.executemany(
+                    "INSERT OR IGNORE INTO job_deps (job_id, dep_id) VALUES (?, ?)",
+                    [(job['job_id'], dep) for dep in job.get('deps', ())]
+                )
+            return added
+        return self._transaction(insert)
+
+    def claim(self, owner: str, lease_seconds: float):
+        def take(conn):
+            now = time.time()
+            while True: # Jobs whose last lease expired on their final attempt are failed and skipped
+                row = conn.execute("""
+                    SELECT * FROM jobs j
+                    WHERE (j.status = 'queued' OR (j.status = 'leased' AND j.lease_expires < ?))
+                      AND NOT EXISTS (
+                          SELECT 1 FROM job_deps d JOIN jobs p ON p.job_id = d.dep_id
+                          WHERE d.job_id = j.job_id AND p.status != 'done'
+                      )
+                    ORDER BY j.priority, j.job_id
+                    LIMIT 1
+                """, (now,)).fetchone()
+                if row is None:
+                    return None
+                if row['attempts'] < self.max_attempts:
+                    if row['status'] == 'leased':
+                        logging.warning(f"Lease of job '{row['job_id']}' held by {row['lease_owner']} expired; re-queueing it.")
+                    break
+                logging.warning(f"Lease of job '{row['job_id']}' held by {row['lease_owner']} expired on its last attempt; failing it.")
+                self._mark_failed(conn, row['job_id'], f"Lease expired {row['attempts']} times (last owner: {row['lease_owner']}).")
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                (owner, now + lease_seconds, now, row['job_id'])
+            )
+            deps = [r['dep_id'] for r in conn.execute("SELECT dep_id FROM job_deps WHERE job_id = ?", (row['job_id'],))]
+            return {
+                "job_id": row['job_id'], "set_name": row['set_name'], "stage": row['stage'],
+                "payload": json.loads(row['payload']), "deps": deps, "attempt": row['attempts'] + 1
+            }
+        return self._transaction(take)
+
+    def heartbeat(self, job_ids: list, owner: str, lease_seconds: float) -> list:
+        if not job_ids:
+            return []
+        def extend(conn):
+            held = []
+            expires = time.time() + lease_seconds
+            for job_id in job_ids:
+                cursor = conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                    (expires, job_id, owner)
+                )
+                if cursor.rowcount:
+                    held.append(job_id)
+            return held
+        return self._transaction(extend)
+
+    def complete(self, job_id: str, owner: str, result) -> bool:
+        def finish(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, updated = ? "
+                "WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                (json.dumps(result), time.time(), job_id, owner)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    def _mark_failed(self, conn, job_id: str, error: str):
+        """Marks a job failed, along with every job that (transitively) depends on it."""
+        pending = [(job_id, error)]
+        while pending:
+            current, reason = pending.pop()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_owner = NULL, updated = ? WHERE job_id = ?",
+                (reason, time.time(), current)
+            )
+            for row in conn.execute("SELECT job_id FROM job_deps WHERE dep_id = ?", (current,)).fetchall():
+                pending.append((row['job_id'], f"Skipped because dependency '{current}' failed."))
+
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        def release(conn):
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE job_id = ? AND status = 'leased' AND lease_owner = ?", (job_id, owner)
+            ).fetchone()
+            if row is None:
+                return False
+            if row['attempts'] >= self.max_attempts:
+                self._mark_failed(conn, job_id, error)
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? WHERE job_id = ?",
+                    (error, time.time(), job_id)
+                )
+            return True
+        return self._transaction(release)
+
+    def results(self, job_ids: list) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id, result FROM jobs WHERE job_id IN ({','.join('?' * len(job_ids))})", list(job_ids)
+            ).fetchall()
+        return {row['job_id']: json.loads(row['result']) if row['result'] is not None else None for row in rows}
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update({row['status']: row['n'] for row in rows})
+        return counts
+
+    def finished_jobs(self, stage: str, page_size: int = 500):
+        last = ("", -1) # Keyset pagination, so huge queues are read a page at a time
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT job_id, set_name, status, priority, result, error FROM jobs "
+                    "WHERE stage = ? AND status IN ('done', 'failed') AND (priority > ? OR (priority = ? AND job_id > ?)) "
+                    "ORDER BY priority, job_id LIMIT ?",
+                    (stage, last[1], last[1], last[0], page_size)
+                ).fetchall()
+            for row in rows:
+                yield {"job_id": row['job_id'], "set_name": row['set_name'], "status": row['status'],
+                       "result": json.loads(row['result']) if row['result'] is not None else None, "error": row['error']}
+            if len(rows) < page_size:
+                return
+            last = (rows[-1]['job_id'], rows[-1]['priority'])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_job_queue(location: str, max_attempts: int = 3, shared_filesystem: bool = None) -> JobQueue:
+    """
+    Opens the job queue at location (currently a SQLite database path). shared_filesystem
+    (None: detect) selects the journal mode for a queue used from several machines.
+    """
+    queue = SQLiteJobQueue(location, max_attempts=max_attempts, shared_filesystem=shared_filesystem)
+    logging.info(f"Job queue at {location} ({'rollback journal, shared filesystem' if queue.shared_filesystem else 'WAL, single host'}).")
+    return queue
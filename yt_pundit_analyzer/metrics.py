@@ -0,0 +1,322 @@
+import array
+import contextlib
+import contextvars
+import csv
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+# Import functions from the same package
+from .ratelimit import estimate_tokens
+
+REPORT_BASENAME = "run_report"
+
+# Set currently being processed, so events recorded deep in the call stack are attributed to it
+current_set = contextvars.ContextVar('current_set', default=None)
+# Models that answered the LLM calls of the result being produced (see collect_models)
+current_models = contextvars.ContextVar('current_models', default=None)
+
+# --- Run Metrics ---
+RESERVOIR_SIZE = 4096 # Samples kept per stage for percentiles; exact below this many events
+
+class _Reservoir:
+    """
+    Count, total and max of a stream of values, plus a uniform random sample of at most
+    RESERVOIR_SIZE of them (Algorithm R) for percentiles, so memory stays bounded.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = array.array('d')
+        self._rng = random.Random(0) # Deterministic reports for the same run
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = value if self.count == 1 else max(self.max, value)
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "total": self.total, "max": self.max, "samples": list(self.samples)}
+
+def _percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RunMetrics:
+    """
+    Thread-safe recorder of per-stage timing events for one run.
+
+    Each event has a stage (fetch, llm, analyze, compare, save, ...), the set it belongs
+    to, its wall time and optional fields: wait_seconds (rate limiter), input_tokens,
+    output_tokens, transcript_chars, compacted_chars, saved_tokens, retries, cache_hit, label,
+    model (the model that answered an LLM call, or the models behind an analysis/comparison).
+
+    With events_path, events are appended to that CSV file as they are recorded and only
+    compact per-stage aggregates are kept in memory (totals, plus a bounded sample of wall
+    and wait times for percentiles), so long runs do not accumulate events.
+    close() flushes and closes that file; events recorded afterwards only update the aggregates.
+    """
+
+    FIELDS = ["ts", "set", "stage", "label", "model", "wall_seconds", "wait_seconds", "input_tokens",
+              "output_tokens", "transcript_chars", "compacted_chars", "saved_tokens", "retries", "cache_hit"]
+
+    def __init__(self, events_path: str = None):
+        self.started = time.time()
+        self.events_path = events_path
+        self._events = []
+        self._aggregates = {} # Stage -> running aggregates, when events stream to events_path
+        self._lock = threading.Lock()
+        self._events_file = None
+        if events_path:
+            os.makedirs(os.path.dirname(events_path) or '.', exist_ok=True)
+            self._events_file = open(events_path, 'w', encoding='utf-8', newline='')
+            self._events_writer = csv.DictWriter(self._events_file, fieldnames=self.FIELDS, extrasaction='ignore')
+            self._events_writer.writeheader()
+
+    def record(self, stage: str, wall_seconds: float, **fields):
+        event = {
+            "ts": datetime.datetime.now().isoformat(timespec='milliseconds'),
+            "set": fields.pop('set', None) or current_set.get(),
+            "stage": stage,
+            "wall_seconds": round(wall_seconds, 4),
+            **fields
+        }
+        with self._lock:
+            if self._events_file is None:
+                self._events.append(event)
+            else:
+                if not self._events_file.closed:
+                    self._events_writer.writerow(event)
+                _aggregate(self._aggregates, event)
+
+    def events(self) -> list:
+        """Recorded events (empty when they are streamed to events_path)."""
+        with self._lock:
+            return list(self._events)
+
+    def summary(self) -> dict:
+        """Per-stage aggregates: count, p50/p95/max wall time, p50/p95 wait time and token totals."""
+        with self._lock:
+            if self._events_file is None:
+                aggregates = {}
+                for event in self._events:
+                    _aggregate(aggregates, event)
+            else:
+                aggregates = self._aggregates
+            aggregates = {stage: {**agg, "walls": agg['walls'].snapshot(), "waits": agg['waits'].snapshot()}
+                          for stage, agg in aggregates.items()}
+        summary = {}
+        for stage, agg in sorted(aggregates.items()):
+            walls, waits = agg['walls'], agg['waits']
+            summary[stage] = {
+                "count": walls['count'],
+                "wall_p50": round(_percentile(walls['samples'], 50), 3),
+                "wall_p95": round(_percentile(walls['samples'], 95), 3),
+                "wall_max": round(walls['max'], 3),
+                "wall_total": round(walls['total'], 3),
+                "wait_p50": round(_percentile(waits['samples'], 50), 3),
+                "wait_p95": round(_percentile(waits['samples'], 95), 3),
+                "input_tokens": agg['input_tokens'],
+                "output_tokens": agg['output_tokens'],
+                "saved_tokens": agg['saved_tokens'],
+                "retries": agg['retries'],
+                "cache_hits": agg['cache_hits'],
+            }
+        return summary
+
+    def format_summary(self) -> str:
+        """Console table of per-stage p50/p95 timings."""
+        lines = [f"{'Stage':<10} {'Count':>6} {'p50 (s)':>9} {'p95 (s)':>9} {'Max (s)':>9} {'Wait p95':>9} {'Tokens in/out':>16}"]
+        for stage, stats in self.summary().items():
+            tokens = f"{stats['input_tokens']}/{stats['output_tokens']}"
+            lines.append(
+                f"{stage:<10} {stats['count']:>6} {stats['wall_p50']:>9.2f} {stats['wall_p95']:>9.2f} "
+                f"{stats['wall_max']:>9.2f} {stats['wait_p95']:>9.2f} {tokens:>16}"
+            )
+        return "\n".join(lines)
+
+    def to_prometheus(self, extra_gauges: dict = None) -> str:
+        """Renders the per-stage summary in Prometheus text exposition format."""
+        out = []
+        metrics = [
+            ("pundit_stage_events_total", "counter", "Number of recorded stage events", "count"),
+            ("pundit_stage_wall_seconds_total", "counter", "Total wall time spent per stage", "wall_total"),
+            ("pundit_stage_input_tokens_total", "counter", "Prompt tokens sent per stage", "input_tokens"),
+            ("pundit_stage_output_tokens_total", "counter", "Output tokens received per stage", "output_tokens"),
+            ("pundit_stage_retries_total", "counter", "Retried calls per stage", "retries"),
+        ]
+        summary = self.summary()
+        for name, kind, help_text, key in metrics:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for stage, stats in summary.items():
+                out.append(f'{name}{{stage="{stage}"}} {stats[key]}')
+        out.append("# HELP pundit_stage_wall_seconds Wall time per stage event")
+        out.append("# TYPE pundit_stage_wall_seconds summary")
+        for stage, stats in summary.items():
+            out.append(f'pundit_stage_wall_seconds{{stage="{stage}",quantile="0.5"}} {stats["wall_p50"]}')
+            out.append(f'pundit_stage_wall_seconds{{stage="{stage}",quantile="0.95"}} {stats["wall_p95"]}')
+        for name, value in (extra_gauges or {}).items():
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+    def write_report(self, output_folder: str, extra: dict = None, prometheus: bool = False) -> str:
+        """Writes run_report.json and run_report.csv (and run_report.prom) to the output folder."""
+        os.makedirs(output_folder, exist_ok=True)
+        json_path = os.path.join(output_folder, f"{REPORT_BASENAME}.json")
+        csv_path = os.path.join(output_folder, f"{REPORT_BASENAME}.csv")
+        report = {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            "wall_seconds": round(time.time() - self.started, 3),
+            "stages": self.summary(),
+            **(extra or {}),
+        }
+        if self._events_file is not None:
+            with self._lock:
+                if not self._events_file.closed:
+                    self._events_file.flush()
+            report["events_file"] = self.events_path # Streamed; not repeated in the JSON report
+        else:
+            report["events"] = self.events()
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        if self._events_file is None or os.path.abspath(self.events_path) != os.path.abspath(csv_path):
+            with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(report.get('events', []))
+
+        if prometheus:
+            gauges = {"pundit_run_wall_seconds": report['wall_seconds']}
+            for key, value in (extra or {}).get('rate_limiter', {}).items():
+                if isinstance(value, (int, float)):
+                    gauges[f"pundit_rate_limiter_{key}"] = value
+            with open(os.path.join(output_folder, f"{REPORT_BASENAME}.prom"), 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus(gauges))
+        logging.info(f"Run report written to {json_path}")
+        return json_path
+
+    def close(self):
+        """Flushes and closes the streamed events file, if any."""
+        with self._lock:
+            if self._events_file is not None and not self._events_file.closed:
+                self._events_file.close()
+
+
+def _aggregate(aggregates: dict, event: dict):
+    """Adds one event to the per-stage aggregates used by RunMetrics.summary()."""
+    agg = aggregates.get(event['stage'])
+    if agg is None:
+        agg = aggregates[event['stage']] = {
+            "walls": _Reservoir(), "waits": _Reservoir(), "input_tokens": 0,
+            "output_tokens": 0, "saved_tokens": 0, "retries": 0, "cache_hits": 0,
+        }
+    agg['walls'].add(event['wall_seconds'])
+    if event.get('wait_seconds') is not None:
+        agg['waits'].add(event['wait_seconds'])
+    for key in ("input_tokens", "output_tokens", "saved_tokens", "retries"):
+        agg[key] += event.get(key) or 0
+    agg['cache_hits'] += 1 if event.get('cache_hit') else 0
+
+
+# --- Module-level recorder (no-op unless enabled) ---
+_recorder = None
+
+def enable_metrics(stream_folder: str = None) -> RunMetrics:
+    """
+    Installs a fresh process-wide recorder and returns it. With stream_folder, events are
+    written to run_report.csv in that folder as they happen instead of kept in memory.
+    """
+    global _recorder
+    events_path = os.path.join(stream_folder, f"{REPORT_BASENAME}.csv") if stream_folder else None
+    _recorder = RunMetrics(events_path)
+    return _recorder
+
+def get_recorder():
+    return _recorder
+
+def record(stage: str, wall_seconds: float, **fields):
+    """Records an event on the active recorder, if any."""
+    if _recorder is not None:
+        _recorder.record(stage, wall_seconds, **fields)
+
+@contextlib.contextmanager
+def timed(stage: str, **fields):
+    """Times the enclosed block; the yielded dict can be filled with extra event fields."""
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(stage, time.perf_counter() - start, **fields)
+
+def bind_set(set_name: str, fn):
+    """
+    Wraps fn so that events it records (in any thread) are attributed to set_name, and the
+    models it calls are added to the caller's collect_models() set, if any.
+    """
+    models = current_models.get()
+    def run_in_set(*args, **kwargs):
+        token, models_token = current_set.set(set_name), current_models.set(models)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_models.reset(models_token)
+            current_set.reset(token)
+    return run_in_set
+
+@contextlib.contextmanager
+def collect_models():
+    """Yields a set filled with the names of the models that answer LLM calls made in the block."""
+    models = set()
+    token = current_models.set(models)
+    try:
+        yield models
+    finally:
+        current_models.reset(token)
+
+def note_model(name: str):
+    """Adds a model to the current collect_models() set, if any."""
+    models = current_models.get()
+    if models is not None:
+        models.add(name)
+
+def models_label(models: set):
+    """The models of a collect_models() set as one report field, or None if no call was made."""
+    return ", ".join(sorted(models)) or None
+
+def response_token_usage(response, estimated_input: int, content: str) -> tuple:
+    """
+    Returns (input_tokens, output_tokens) for an LLM response, preferring the usage metadata
+    reported by Gemini and falling back to character-based estimates.
+    """
+    raw = getattr(response, 'raw', None)
+    usage = None
+    if isinstance(raw, dict):
+        usage = raw.get('usage_metadata')
+    elif raw is not None:
+        usage = getattr(raw, 'usage_metadata', None)
+    if usage is not None:
+        get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+        prompt_tokens, output_tokens = get('prompt_token_count'), get('candidates_token_count')
+        if prompt_tokens is not None and output_tokens is not None:
+            return int(prompt_tokens), int(output_tokens)
+    return estimated_input, estimate_tokens(content) if content else 0
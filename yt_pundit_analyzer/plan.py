@@ -0,0 +1,498 @@
+import json
+import math
+import os
+import re
+import sqlite3
+# Import functions from the same package
+from .utils import extract_video_id
+from .ratelimit import CHARS_PER_TOKEN, estimate_tokens
+from .cache import TranscriptCache
+from .run_manifest import MANIFEST_FILENAME
+from .preprocess import PREPROCESS_STEPS
+from .video_sets import ROLES, VIDEO_SET_FORMATS, iter_video_sets_file
+from .artifacts import set_analyses, set_comparisons
+from .core import analysis_names
+from .structured import STRUCTURED_SCHEMAS
+from .routing import ROUTED_STAGES
+
+# --- Config Schema ---
+# A spec is a type (or tuple of types) or a dict with 'type' plus optional 'required',
+# 'min', 'max', 'choices', 'items' (spec of list items), 'keys' (specs of a section's keys),
+# 'values' (spec of every value of a mapping), 'prompt' (a prompt file that must exist
+# and only use known template variables), 'file' (a path that must exist) and 'regex'.
+# In sections with an 'enabled' flag, 'required' keys are only required when enabled.
+# None (an empty YAML value) means "not set" and is accepted for optional keys.
+NUMBER = (int, float)
+POSITIVE_INT = {"type": int, "min": 1}
+COUNT = {"type": int, "min": 0}
+SECONDS = {"type": NUMBER, "min": 0}
+SHARE = {"type": NUMBER, "min": 0, "max": 1}
+PROMPT_FILE = {"type": str, "required": True, "prompt": True}
+PROMPT_VARIABLES = {"subject"} # Variables the stage prompt files may use
+
+CONFIG_SCHEMA = {
+    "google_api_key": str,
+    "rate_limit_calls": POSITIVE_INT,
+    "rate_limit_period": POSITIVE_INT,
+    "rate_limit_tokens_per_minute": POSITIVE_INT,
+    "rate_limit_max_retries": COUNT,
+    "llm_model_name": str,
+    "models": {"type": dict, "values": {"type": dict, "keys": {
+        "rate_limit_calls": POSITIVE_INT, "rate_limit_period": POSITIVE_INT, "rate_limit_tokens_per_minute": POSITIVE_INT,
+        "fallback": str, "max_latency_seconds": {"type": NUMBER, "min": 1}, "spill_after_seconds": SECONDS,
+    }}},
+    "stage_models": {"type": dict, "keys": {stage: str for stage in ROUTED_STAGES}},
+    "output_folder": str,
+    "max_workers": POSITIVE_INT,
+    "stage_workers": {"type": dict, "values": POSITIVE_INT},
+    "async_max_concurrency": POSITIVE_INT,
+    "max_sets_in_flight": POSITIVE_INT,
+    "run_report": bool,
+    "run_report_prometheus": bool,
+    "transcript_cache_dir": str,
+    "transcript_cache_max_mb": {"type": NUMBER, "min": 0},
+    "transcript_cache_max_age_days": {"type": NUMBER, "min": 0},
+    "streaming": {"type": dict, "keys": {
+        "enabled": bool, "first_token_timeout_seconds": {"type": NUMBER, "min": 1},
+        "stall_timeout_seconds": {"type": NUMBER, "min": 1}, "max_stall_retries": COUNT,
+    }},
+    "distributed": {"type": dict, "keys": {
+        "queue_path": str, "max_attempts": POSITIVE_INT, "lease_seconds": {"type": NUMBER, "min": 1},
+        "poll_interval": SECONDS, "worker_concurrency": POSITIVE_INT, "shared_filesystem": bool,
+    }},
+    "transcript_prefetch": {"type": dict, "keys": {
+        "enabled": bool, "workers": POSITIVE_INT, "batch_size": POSITIVE_INT, "max_attempts": POSITIVE_INT,
+        "retry_base_delay": SECONDS, "retry_max_delay": SECONDS, "lookahead_sets": COUNT,
+    }},
+    "preprocess": {"type": dict, "keys": {
+        "enabled": bool,
+        "steps": {"type": list, "items": {"type": str, "choices": PREPROCESS_STEPS}},
+        "filler_words": {"type": list, "items": str},
+        "paragraph_chars": POSITIVE_INT, "timestamp_interval_seconds": POSITIVE_INT,
+        "dedupe_window": POSITIVE_INT, "min_overlap_words": POSITIVE_INT,
+        "drop_segments": {"type": list, "items": {"type": dict, "keys": {
+            "start": {"type": str, "required": True, "regex": True},
+            "end": {"type": str, "regex": True},
+            "max_lines": POSITIVE_INT,
+        }}},
+    }},
+    "response_cache_path": str,
+    "response_cache_ttl_days": {"type": NUMBER, "min": 0},
+    "response_cache_max_entries": POSITIVE_INT,
+    "early_take_prompt_file": PROMPT_FILE,
+    "retrospective_prompt_file": PROMPT_FILE,
+    "compare_prompt_file": PROMPT_FILE,
+    "chunking": {"type": dict, "keys": {
+        "enabled": bool, "max_chars": POSITIVE_INT, "overlap_chars": COUNT, "max_parallel": POSITIVE_INT,
+        "merge_prompt_file": PROMPT_FILE,
+    }},
+    "rollup": {"type": dict, "keys": {
+        "enabled": bool, "prompt_file": PROMPT_FILE, "max_chars": POSITIVE_INT, "workers": POSITIVE_INT,
+    }},
+    "structured_output": {"type": dict, "keys": {
+        "enabled": bool, "takeaways_prompt_file": PROMPT_FILE, "comparison_prompt_file": PROMPT_FILE,
+        "max_attempts": POSITIVE_INT, "index_path": str,
+    }},
+    "quote_check": {"type": dict, "keys": {
+        "enabled": bool, "min_similarity": SHARE, "verified_similarity": SHARE,
+        "timestamp_tolerance_seconds": COUNT, "index_dir": str,
+    }},
+    "plan": {"type": dict, "keys": {
+        "transcript_chars": POSITIVE_INT, "output_tokens_per_call": POSITIVE_INT,
+        "seconds_per_call": SECONDS, "seconds_per_fetch": SECONDS,
+        "input_price_per_million_tokens": {"type": NUMBER, "min": 0},
+        "output_price_per_million_tokens": {"type": NUMBER, "min": 0},
+    }},
+    "video_sets_file": {"type": str, "file": True},
+    "video_sets_format": {"type": str, "choices": VIDEO_SET_FORMATS},
+    "video_sets": list, # Each set is checked by check_video_set
+}
+
+_TYPE_NAMES = {int: "an integer", float: "a number", str: "a string", bool: "true/false", list: "a list", dict: "a mapping"}
+_TEMPLATE_VARIABLE = re.compile(r'{{\s*([A-Za-z_][A-Za-z0-9_]*)')
+
+def check_prompt_file(path: str) -> list:
+    """Problems with a stage prompt file: missing, unreadable, empty or malformed template."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return [f"prompt file not found: {path}"]
+    except (OSError, UnicodeDecodeError) as e:
+        return [f"prompt file {path} cannot be read as UTF-8 text: {e}"]
+    if not text.strip():
+        return [f"prompt file {path} is empty"]
+    problems = []
+    if text.count("{{") != text.count("}}") or text.count("{%") != text.count("%}"):
+        problems.append(f"prompt file {path} has unbalanced '{{{{ }}}}' or '{{% %}}' template tags")
+    unknown = sorted(set(_TEMPLATE_VARIABLE.findall(text)) - PROMPT_VARIABLES)
+    if unknown:
+        problems.append(f"prompt file {path} uses unknown template variables: {', '.join(unknown)} (available: {', '.join(sorted(PROMPT_VARIABLES))})")
+    return problems
+
+def _check_value(value, spec, path: str, errors: list, warnings: list, enabled: bool = True):
+    spec = spec if isinstance(spec, dict) else {"type": spec}
+    if value is None:
+        if spec.get('required') and enabled:
+            errors.append(f"{path}: is required")
+        return
+    expected = spec['type'] if isinstance(spec['type'], tuple) else (spec['type'],)
+    if isinstance(value, bool) and bool not in expected or not isinstance(value, expected):
+        errors.append(f"{path}: must be {' or '.join(_TYPE_NAMES.get(t, t.__name__) for t in expected)}, got {value!r}")
+        return
+    if 'min' in spec and value < spec['min']:
+        errors.append(f"{path}: must be at least {spec['min']}, got {value}")
+    if 'max' in spec and value > spec['max']:
+        errors.append(f"{path}: must be at most {spec['max']}, got {value}")
+    if 'choices' in spec and value not in spec['choices']:
+        errors.append(f"{path}: unknown value {value!r} (available: {', '.join(spec['choices'])})")
+    if spec.get('regex'):
+        try:
+            re.compile(value)
+        except re.error as e:
+            errors.append(f"{path}: invalid regular expression: {e}")
+    if spec.get('file') and not os.path.exists(value):
+        errors.append(f"{path}: file not found: {value}")
+    if spec.get('prompt') and enabled:
+        errors.extend(f"{path}: {problem}" for problem in check_prompt_file(value))
+    if 'items' in spec:
+        for index, item in enumerate(value):
+            _check_value(item, spec['items'], f"{path}[{index}]", errors, warnings)
+    if 'values' in spec:
+        for key, item in value.items():
+            _check_value(item, spec['values'], f"{path}.{key}", errors, warnings)
+    if 'keys' in spec:
+        _check_section(value, spec['keys'], path, errors, warnings)
+
+def _check_section(section: dict, schema: dict, path: str, errors: list, warnings: list):
+    # Sections with an 'enabled' flag only need their required keys when enabled
+    enabled = section.get('enabled', True) if 'enabled' in schema else True
+    for key, spec in schema.items():
+        _check_value(section.get(key), spec, f"{path}.{key}" if path else key, errors, warnings, enabled)
+    for key in section:
+        if key not in schema:
+            warnings.append(f"{f'{path}.' if path else ''}{key}: unknown setting (ignored; misspelled?)")
+
+def validate_config(config) -> tuple:
+    """Checks a loaded config.yaml against CONFIG_SCHEMA. Returns (errors, warnings) as lists of messages."""
+    errors, warnings = [], []
+    if not isinstance(config, dict):
+        return ["config: the file must contain a YAML mapping"], warnings
+    _check_section(config, CONFIG_SCHEMA, "", errors, warnings)
+    chunking = config.get('chunking') or {}
+    if isinstance(chunking, dict) and isinstance(chunking.get('overlap_chars'), int) and isinstance(chunking.get('max_chars'), int) \
+            and chunking['overlap_chars'] >= chunking['max_chars']:
+        errors.append("chunking.overlap_chars: must be smaller than chunking.max_chars")
+    if not config.get('video_sets') and not config.get('video_sets_file'):
+        errors.append("video_sets: no 'video_sets' list or 'video_sets_file' configured")
+    models, stage_models = config.get('models') or {}, config.get('stage_models') or {}
+    if isinstance(models, dict) and isinstance(stage_models, dict):
+        known = set(models) | {config.get('llm_model_name', 'models/gemini-1.5-flash')}
+        for stage, name in stage_models.items():
+            if isinstance(name, str) and name not in known:
+                errors.append(f"stage_models.{stage}: model '{name}' is not configured under 'models'")
+        for name, model_config in models.items():
+            fallback = model_config.get('fallback') if isinstance(model_config, dict) else None
+            if isinstance(fallback, str) and fallback not in known:
+                errors.append(f"models.{name}.fallback: model '{fallback}' is not configured under 'models'")
+    return errors, warnings
+
+def _stage_rate_limits(config: dict) -> dict:
+    """
+    Per routed stage: (model name, calls, period, tokens per minute) of the model it runs on,
+    as set up by routing.setup_model_router. Fallback models are not counted as capacity.
+    """
+    models, stage_models = config.get('models') or {}, config.get('stage_models') or {}
+    default_name = config.get('llm_model_name', 'models/gemini-1.5-flash')
+    limits = {}
+    for stage in ROUTED_STAGES:
+        name = stage_models.get(stage, default_name)
+        model_config = models.get(name) or {}
+        limits[stage] = (
+            name,
+            model_config.get('rate_limit_calls', config.get('rate_limit_calls', 5)),
+            model_config.get('rate_limit_period', config.get('rate_limit_period', 60)),
+            model_config.get('rate_limit_tokens_per_minute', config.get('rate_limit_tokens_per_minute')),
+        )
+    return limits
+
+def check_video_set(video_set) -> list:
+    """Problems with one set: missing subject or videos, or URLs without a YouTube video id."""
+    if not isinstance(video_set, dict):
+        return ["is not a mapping"]
+    problems = []
+    if not isinstance(video_set.get('subject'), str) or not video_set['subject'].strip():
+        problems.append("has no subject")
+    for role in ROLES:
+        entries = video_set.get(role)
+        entries = entries if isinstance(entries, list) else [entries]
+        if not entries or not all(isinstance(entry, dict) for entry in entries):
+            problems.append(f"has no {role} video")
+            continue
+        for entry in entries:
+            try:
+                extract_video_id(entry.get('url'))
+            except ValueError as e:
+                problems.append(f"{role}: {e}")
+    return problems
+
+
+# --- Run Estimate ---
+DEFAULT_ASSUMPTIONS = {
+    "transcript_chars": 60000,         # Transcripts that are not cached yet (about an hour of speech)
+    "output_tokens_per_call": 2000,    # Response size of each LLM call
+    "seconds_per_call": 30,            # LLM latency per call
+    "seconds_per_fetch": 3,            # Transcript download time per video
+    "input_price_per_million_tokens": None,
+    "output_price_per_million_tokens": None,
+}
+
+def _load_manifest_done(output_folder: str) -> set:
+    """(set, stage) pairs recorded as done in the output folder's run manifest."""
+    path = os.path.join(output_folder, MANIFEST_FILENAME)
+    latest = {}
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                latest[(record['set'], record['stage'])] = record.get('status')
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return {key for key, status in latest.items() if status == 'done'}
+
+def _response_cache_entries(db_path: str):
+    if not db_path or not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=1)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+def _prompt_tokens(path: str) -> int:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return estimate_tokens(f.read())
+    except (OSError, UnicodeDecodeError, TypeError):
+        return 0
+
+def _chunk_count(chars: int, chunking: dict) -> int:
+    """Number of chunks split_transcript produces for a transcript of this length (approximately)."""
+    if not chunking.get('enabled') or chars <= chunking.get('max_chars', 120000):
+        return 1
+    max_chars, overlap = chunking.get('max_chars', 120000), chunking.get('overlap_chars', 2000)
+    return math.ceil((chars - overlap) / (max_chars - overlap))
+
+def build_plan(config: dict, video_sets, output_folder: str, resume: bool = False, refresh_transcripts: bool = False,
+               use_async: bool = False, max_set_problems: int = 20) -> dict:
+    """
+    Walks the sets (streamed, so any input size works) without fetching or calling the LLM,
+    and estimates the work of a run: transcripts to download, LLM calls, tokens, cost and
+    duration. Transcript lengths come from the transcript cache where available; stages
+    recorded as done in the run manifest are free with resume.
+    """
+    assumptions = {**DEFAULT_ASSUMPTIONS, **{k: v for k, v in (config.get('plan') or {}).items() if v is not None}}
+    output_chars = assumptions['output_tokens_per_call'] * CHARS_PER_TOKEN
+    chunking = config.get('chunking') or {}
+    rollup = config.get('rollup') or {}
+    structured = config.get('structured_output') or {}
+    cache_dir = config.get('transcript_cache_dir')
+    max_age_days = config.get('transcript_cache_max_age_days')
+    transcript_cache = TranscriptCache(cache_dir, max_age_seconds=max_age_days * 86400 if max_age_days else None) \
+        if cache_dir and os.path.isdir(cache_dir) and not refresh_transcripts else None
+    done = _load_manifest_done(output_folder) if resume else set()
+    prompt_tokens = {
+        'early': _prompt_tokens(config.get('early_take_prompt_file')),
+        'retro': _prompt_tokens(config.get('retrospective_prompt_file')),
+        'compare': _prompt_tokens(config.get('compare_prompt_file')),
+        'merge': _prompt_tokens(chunking.get('merge_prompt_file')),
+        'rollup': _prompt_tokens(rollup.get('prompt_file')),
+        # Extraction requests also carry the record schema
+        'takeaways': _prompt_tokens(structured.get('takeaways_prompt_file')) + estimate_tokens(json.dumps(STRUCTURED_SCHEMAS['takeaways'], indent=2)),
+        'comparison': _prompt_tokens(structured.get('comparison_prompt_file')) + estimate_tokens(json.dumps(STRUCTURED_SCHEMAS['comparison'], indent=2)),
+    }
+
+    plan = {
+        "sets": 0, "invalid_sets": 0, "set_problems": [], "videos": 0, "cached_transcripts": 0,
+        "analyses": 0, "chunked_analyses": 0, "comparisons": 0, "resumed_stages": 0, "pundits": 0,
+        "calls": {"analyze": 0, "compare": 0, "extract": 0, "rollup": 0}, "input_tokens": 0, "output_tokens": 0,
+        "stage_input_tokens": {"analyze": 0, "compare": 0, "extract": 0, "rollup": 0},
+    }
+    seen_analyses, transcript_sizes, pundit_chars = set(), {}, {} # transcript_sizes: video id -> cached size or None
+
+    def add_calls(stage, calls, input_tokens):
+        plan['calls'][stage] += calls
+        plan['input_tokens'] += input_tokens
+        plan['stage_input_tokens'][stage] += input_tokens
+        plan['output_tokens'] += calls * assumptions['output_tokens_per_call']
+
+    def add_extraction(kind, name, stage):
+        # Journaled separately from the result it is extracted from (one call, unless repairs are needed)
+        if structured.get('enabled') and (name, f"{stage} JSON") not in done:
+            add_calls('extract', 1, prompt_tokens[kind] + assumptions['output_tokens_per_call'])
+
+    for number, video_set in enumerate(video_sets, 1):
+        problems = check_video_set(video_set)
+        if problems:
+            plan['invalid_sets'] += 1
+            if len(plan['set_problems']) < max_set_problems:
+                subject = video_set.get('subject') if isinstance(video_set, dict) else None
+                plan['set_problems'].append(f"set {number} ('{subject or 'MISSING'}'): {'; '.join(problems)}")
+            continue
+        plan['sets'] += 1
+        subject = video_set['subject']
+        for analysis in set_analyses(video_set):
+            if analysis['video_id'] not in transcript_sizes:
+                size = transcript_cache.stored_size(analysis['url']) if transcript_cache is not None else None
+                transcript_sizes[analysis['video_id']] = size
+                plan['videos'] += 1
+                plan['cached_transcripts'] += size is not None
+            if analysis['key'] in seen_analyses:
+                continue # Analysed once per run, however many sets use it
+            seen_analyses.add(analysis['key'])
+            plan['analyses'] += 1
+            size = transcript_sizes[analysis['video_id']]
+            record_name = analysis_names(subject, analysis['video_id'])[0]
+            add_extraction('takeaways', record_name, analysis['video_type'])
+            if (record_name, analysis['video_type']) in done:
+                plan['resumed_stages'] += 1
+                continue
+            chars = size if size is not None else assumptions['transcript_chars']
+            chunks = _chunk_count(chars, chunking)
+            add_calls('analyze', chunks, prompt_tokens[analysis['prompt']] * chunks + chars // CHARS_PER_TOKEN)
+            if chunks > 1:
+                plan['chunked_analyses'] += 1
+                add_calls('analyze', 1, prompt_tokens['merge'] + chunks * output_chars // CHARS_PER_TOKEN)
+        for pair in set_comparisons(video_set):
+            plan['comparisons'] += 1
+            if pair['pundit']:
+                pundit_chars[pair['pundit']] = pundit_chars.get(pair['pundit'], 0) + output_chars
+            add_extraction('comparison', pair['label'], "Analysis")
+            if (pair['label'], "Analysis") in done:
+                plan['resumed_stages'] += 1
+                continue
+            add_calls('compare', 1, prompt_tokens['compare'] + 2 * output_chars // CHARS_PER_TOKEN)
+
+    if rollup.get('enabled'):
+        plan['pundits'] = len(pundit_chars)
+        max_chars = rollup.get('max_chars', 120000)
+        for chars in pundit_chars.values():
+            groups = max(1, math.ceil(chars / max_chars))
+            calls = groups + (1 if groups > 1 else 0) # Group rollups, then one call combining them
+            add_calls('rollup', calls, prompt_tokens['rollup'] * calls + (chars + (groups if groups > 1 else 0) * output_chars) // CHARS_PER_TOKEN)
+
+    # Cost and duration
+    total_calls = sum(plan['calls'].values())
+    input_price, output_price = assumptions['input_price_per_million_tokens'], assumptions['output_price_per_million_tokens']
+    if input_price is not None and output_price is not None:
+        plan['cost'] = round(plan['input_tokens'] / 1e6 * input_price + plan['output_tokens'] / 1e6 * output_price, 2)
+    stage_workers = config.get('stage_workers') or {}
+    max_workers = config.get('max_workers', 4)
+    if use_async:
+        llm_concurrency = config.get('async_max_concurrency', 64)
+    else:
+        llm_concurrency = stage_workers.get('analyze', max_workers) + stage_workers.get('compare', max_workers)
+    prefetch = config.get('transcript_prefetch') or {}
+    fetch_workers = prefetch.get('workers', 8) if prefetch.get('enabled') else stage_workers.get('fetch', max_workers)
+    downloads = plan['videos'] - plan['cached_transcripts']
+    # Each model has its own limiter (see routing.py): stages on the same model share its quota
+    model_load = {}
+    for stage, (name, limit_calls, period, tokens_per_minute) in _stage_rate_limits(config).items():
+        load = model_load.setdefault(name, {"calls": 0, "input_tokens": 0, "limits": (limit_calls, period, tokens_per_minute)})
+        load['calls'] += plan['calls'][stage]
+        load['input_tokens'] += plan['stage_input_tokens'][stage]
+    request_bounds, token_bounds = {}, {}
+    for name, load in model_load.items():
+        limit_calls, period, tokens_per_minute = load['limits']
+        request_bounds[name] = load['calls'] * period / limit_calls
+        token_bounds[name] = load['input_tokens'] / tokens_per_minute * 60 if tokens_per_minute else 0
+    plan['model_calls'] = {name: load['calls'] for name, load in model_load.items()}
+    bounds = {
+        "requests per period": max(request_bounds.values()),
+        "tokens per minute": max(token_bounds.values()),
+        "LLM latency": total_calls * assumptions['seconds_per_call'] / max(1, llm_concurrency),
+        "transcript downloads": downloads * assumptions['seconds_per_fetch'] / max(1, fetch_workers),
+    }
+    plan['bottleneck'], plan['seconds'] = max(bounds.items(), key=lambda item: item[1])
+    plan['time_bounds'] = bounds
+    plan['downloads'] = downloads
+    plan['fetch_workers'] = fetch_workers
+    plan['llm_concurrency'] = llm_concurrency
+    plan['response_cache_entries'] = _response_cache_entries(config.get('response_cache_path'))
+    plan['assumptions'] = assumptions
+    return plan
+
+def iter_planned_video_sets(config: dict, cli_video_sets_file: str = None):
+    """The raw sets of a run (unvalidated, so the plan can report the invalid ones)."""
+    path = cli_video_sets_file or config.get('video_sets_file')
+    if path:
+        return iter_video_sets_file(path, config.get('video_sets_format'))
+    return iter(config.get('video_sets') or [])
+
+
+# --- Plan Report ---
+def _format_duration(seconds: float) -> str:
+    hours, rest = divmod(int(round(seconds)), 3600)
+    return f"{hours}h {rest // 60:02d}m" if hours else f"{rest // 60}m {rest % 60:02d}s"
+
+def format_dag(config: dict, plan: dict, use_async: bool = False) -> str:
+    """The stage graph of a run, with the pool of each stage and the work planned for it."""
+    stage_workers = config.get('stage_workers') or {}
+    max_workers = config.get('max_workers', 4)
+    def pool(stage):
+        return "async" if use_async else f"{stage_workers.get(stage, max_workers)} threads"
+    preprocess = (config.get('preprocess') or {}).get('enabled')
+    prefetch = (config.get('transcript_prefetch') or {}).get('enabled')
+    calls = plan['calls']
+    lines = [
+        f"fetch [{'prefetch, ' if prefetch else ''}{plan['fetch_workers']} workers]  {plan['videos']} transcripts "
+        f"({plan['cached_transcripts']} cached, {plan['downloads']} to download)",
+        f"`-> preprocess [in fetch tasks]  {'enabled' if preprocess else 'disabled'}",
+        f"    `-> analyze [{pool('analyze')}]  {plan['analyses']} analyses, {calls['analyze']} LLM calls "
+        f"({plan['chunked_analyses']} chunked)",
+        f"        `-> compare [{pool('compare')}]  {plan['comparisons']} comparisons, {calls['compare']} LLM calls",
+        f"            `-> summary  set_summaries.jsonl",
+    ]
+    if (config.get('structured_output') or {}).get('enabled'):
+        lines.append(f"(+ JSON extraction in analyze and compare tasks: {calls['extract']} LLM calls, indexed for 'query')")
+    if (config.get('quote_check') or {}).get('enabled'):
+        lines.append(f"(+ quote verification in analyze tasks: {plan['analyses']} analyses checked against their transcripts, no LLM calls)")
+    if (config.get('rollup') or {}).get('enabled'):
+        lines.append(f"                `-> rollup [{(config.get('rollup') or {}).get('workers', 2)} threads]  "
+                     f"{plan['pundits']} pundits, {calls['rollup']} LLM calls")
+    return "\n".join(lines)
+
+def format_plan(config: dict, plan: dict, use_async: bool = False) -> str:
+    """Human-readable plan: the stage DAG, then token, cost and time estimates."""
+    assumptions = plan['assumptions']
+    total_calls = sum(plan['calls'].values())
+    lines = [
+        f"Sets: {plan['sets']} valid, {plan['invalid_sets']} invalid; {plan['videos']} unique videos.",
+        "",
+        f"Stage DAG ({'asyncio, up to ' + str(plan['llm_concurrency']) + ' requests in flight' if use_async else 'threaded stage scheduler'}):",
+        format_dag(config, plan, use_async),
+        "",
+        f"LLM calls:     {total_calls} (" + ", ".join(f"{stage} {calls}" for stage, calls in plan['calls'].items()) + ")",
+        f"Input tokens:  ~{plan['input_tokens']:,}",
+        f"Output tokens: ~{plan['output_tokens']:,} (assuming {assumptions['output_tokens_per_call']} per call)",
+    ]
+    if len(plan['model_calls']) > 1:
+        lines.append("Per model:     " + ", ".join(f"{name} {calls}" for name, calls in plan['model_calls'].items())
+                     + " calls (before any spill-over to fallbacks)")
+    if 'cost' in plan:
+        lines.append(f"Cost:          ~${plan['cost']:,.2f}")
+    else:
+        lines.append("Cost:          set plan.input_price_per_million_tokens / output_price_per_million_tokens to estimate")
+    lines.append(f"Duration:      ~{_format_duration(plan['seconds'])} (bound by {plan['bottleneck']})")
+    if plan['resumed_stages']:
+        lines.append(f"Resumed:       {plan['resumed_stages']} stages already done in the run manifest")
+    if plan['response_cache_entries'] is not None:
+        lines.append(f"Response cache: {plan['response_cache_entries']} entries; identical requests are served from it for free (not deducted above)")
+    lines.append(f"Uncached transcripts are assumed to be {assumptions['transcript_chars']:,} characters; "
+                 f"preprocessing savings are not deducted.")
+    return "\n".join(lines)
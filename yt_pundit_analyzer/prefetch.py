@@ -0,0 +1,258 @@
+from __future__ import annotations
+import collections
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.readers.youtube_transcript import YoutubeTranscriptReader
+# Import functions from the same package
+from .utils import extract_video_id
+from . import metrics
+from .cache import TranscriptCache
+from .core import transcript_from_documents
+
+# youtube_transcript_api errors that will not go away on retry
+PERMANENT_FETCH_ERRORS = {"TranscriptsDisabled", "NoTranscriptFound", "NoTranscriptAvailable", "VideoUnavailable", "InvalidVideoId"}
+
+def _is_permanent_fetch_error(error: Exception) -> bool:
+    return type(error).__name__ in PERMANENT_FETCH_ERRORS
+
+
+# --- Transcript Prefetch Stage ---
+class TranscriptPrefetcher:
+    """
+    Downloads all transcripts of a run up front, before (and while) the LLM stages run.
+
+    URLs are deduplicated by video ID, so a video listed in several sets is fetched once.
+    Unique videos are fetched in batches of batch_size links per reader.load_data call on
+    a bounded thread pool, in the order the sets were given, so the first sets can be
+    analysed while later transcripts are still downloading. Failed batches are retried
+    with exponential backoff and jitter; if a batch still fails, its links are retried
+    one by one so a single unavailable video does not fail its neighbours.
+
+    Consumers call get(url) (blocking) or future(url) (for asyncio.wrap_future); both
+    return the transcript, or an "Error fetching transcript: ..." string like get_transcript.
+
+    For streamed inputs, prefetch_ahead() keeps downloads a bounded number of sets ahead
+    of processing, and release() drops transcripts once every set using them is done.
+    """
+
+    def __init__(
+        self,
+        reader: YoutubeTranscriptReader,
+        transcript_cache: TranscriptCache = None,
+        refresh: bool = False,
+        max_workers: int = 8,
+        batch_size: int = 4,
+        max_attempts: int = 3,
+        retry_base_delay: float = 2.0,
+        retry_max_delay: float = 30.0
+    ):
+        self.reader = reader
+        self.transcript_cache = transcript_cache
+        self.refresh = refresh
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.requested = 0 # URLs asked for, including duplicates
+        self.fetched = 0 # Transcripts downloaded successfully
+        self.cached = 0 # Transcripts served from the transcript cache
+        self.failed = 0
+        self.unique = 0 # Distinct videos queued
+        self._futures = {} # Video ID (or raw URL if unparseable) -> Future
+        self._refs = collections.Counter() # Video ID -> sets queued but not released
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='Prefetch')
+
+    @staticmethod
+    def _key(url: str) -> str:
+        try:
+            return extract_video_id(url)
+        except ValueError:
+            return url # Let the reader report the invalid URL
+
+    def _queue(self, urls: list) -> int:
+        batch, batch_futures, new = [], [], 0
+        with self._lock:
+            for url in urls:
+                self.requested += 1
+                key = self._key(url)
+                self._refs[key] += 1
+                if key in self._futures:
+                    continue
+                future = concurrent.futures.Future()
+                self._futures[key] = future
+                batch.append(url)
+                batch_futures.append(future)
+                new += 1
+                if len(batch) == self.batch_size:
+                    self._executor.submit(self._run_batch, batch, batch_futures)
+                    batch, batch_futures = [], []
+            if batch:
+                self._executor.submit(self._run_batch, batch, batch_futures)
+            self.unique += new
+        return new
+
+    def start(self, urls: list) -> int:
+        """Queues all URLs for download (non-blocking). Returns the number of new unique videos."""
+        new = self._queue(urls)
+        logging.info(f"Prefetching {new} unique transcripts ({len(urls)} links, batches of {self.batch_size}).")
+        return new
+
+    def prefetch_ahead(self, video_sets, lookahead: int, urls_of):
+        """
+        Yields video_sets unchanged while keeping the transcripts of up to lookahead sets
+        beyond the consumer queued for download. urls_of(video_set) lists a set's URLs.
+        Pair with release() so finished sets do not keep their transcripts in memory.
+        """
+        buffered = collections.deque()
+        pending_urls, pending_sets = [], 0 # Newest sets, queued once they fill a batch
+
+        def flush():
+            nonlocal pending_urls, pending_sets
+            if pending_urls:
+                self._queue(pending_urls)
+            pending_urls, pending_sets = [], 0
+
+        for video_set in video_sets:
+            pending_urls.extend(urls_of(video_set))
+            pending_sets += 1
+            buffered.append(video_set)
+            if len(pending_urls) >= self.batch_size:
+                flush()
+            if len(buffered) > lookahead:
+                if pending_sets >= len(buffered): # The set handed out has not been queued yet
+                    flush()
+                yield buffered.popleft()
+        flush()
+        while buffered:
+            yield buffered.popleft()
+
+    def release(self, urls: list):
+        """Drops the transcripts of a finished set unless a set still in progress uses them."""
+        with self._lock:
+            for url in urls:
+                key = self._key(url)
+                if self._refs[key] > 1:
+                    self._refs[key] -= 1
+                    continue
+                self._refs.pop(key, None)
+                self._futures.pop(key, None)
+
+    def future(self, url: str) -> concurrent.futures.Future:
+        """The future resolving to the transcript of url; queues it if it was not prefetched."""
+        with self._lock:
+            future = self._futures.get(self._key(url))
+        if future is None:
+            self._queue([url])
+            with self._lock:
+                future = self._futures[self._key(url)]
+        return future
+
+    def get(self, url: str) -> str:
+        """Blocks until the transcript of url is available."""
+        return self.future(url).result()
+
+    def close(self):
+        """Stops the prefetch pool, abandoning downloads that have not started."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_result("Error fetching transcript: Prefetch was cancelled.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requested": self.requested, "unique": self.unique, "cached": self.cached,
+                    "fetched": self.fetched, "failed": self.failed}
+
+    # --- Workers ---
+    def _run_batch(self, urls: list, futures: list):
+        try:
+            self._fetch_batch(urls, futures)
+        except Exception as e:
+            logging.error(f"Unexpected error while prefetching {urls}: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_result(f"Error fetching transcript: {e}")
+
+    def _fetch_batch(self, urls: list, futures: list):
+        pending = []
+        for url, future in zip(urls, futures):
+            cached = None
+            if self.transcript_cache is not None and not self.refresh:
+                cached = self.transcript_cache.get(url)
+            if cached is not None:
+                metrics.record("fetch", 0.0, label=url, cache_hit=True, transcript_chars=len(cached))
+                with self._lock:
+                    self.cached += 1
+                future.set_result(cached)
+            else:
+                pending.append((url, future))
+        if not pending:
+            return
+
+        links = [url for url, _ in pending]
+        start = time.perf_counter()
+        documents, attempts, error = self._load_with_retry(links)
+        wall = time.perf_counter() - start
+        if error is None and len(documents) == len(links):
+            # YoutubeTranscriptReader returns one document per link, in order
+            for (url, future), document in zip(pending, documents):
+                transcript = transcript_from_documents(url, [document])
+                self._resolve(url, future, transcript, wall / len(links), attempts - 1)
+            return
+        if len(links) == 1:
+            transcript = transcript_from_documents(links[0], documents) if error is None else f"Error fetching transcript: {error}"
+            self._resolve(links[0], pending[0][1], transcript, wall, attempts - 1)
+            return
+        logging.warning(f"Batch fetch of {len(links)} transcripts failed ({error or 'unexpected document count'}); fetching them one by one.")
+        for url, future in pending:
+            self._fetch_batch([url], [future])
+
+    def _load_with_retry(self, links: list) -> tuple:
+        """Calls reader.load_data with retries. Returns (documents, attempts, last error or None)."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.reader.load_data(ytlinks=links), attempt, None
+            except Exception as e:
+                if _is_permanent_fetch_error(e) or attempt == self.max_attempts:
+                    return [], attempt, e
+                delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logging.warning(f"Transcript fetch failed for {len(links)} link(s) ({e}); retrying in {delay:.1f}s ({attempt}/{self.max_attempts - 1}).")
+                time.sleep(delay)
+
+    def _resolve(self, url: str, future: concurrent.futures.Future, transcript: str, wall: float, retries: int):
+        if transcript.startswith("Error fetching transcript"):
+            logging.error(f"Failed to prefetch transcript for {url}: {transcript}")
+            with self._lock:
+                self.failed += 1
+            metrics.record("fetch", wall, label=url, retries=retries)
+        else:
+            with self._lock:
+                self.fetched += 1
+            metrics.record("fetch", wall, label=url, retries=retries, transcript_chars=len(transcript))
+            if self.transcript_cache is not None:
+                self.transcript_cache.put(url, transcript) # Only successful fetches are cached
+        future.set_result(transcript)
+
+
+def setup_transcript_prefetch(config: dict, reader: YoutubeTranscriptReader, transcript_cache: TranscriptCache = None, refresh: bool = False):
+    """Builds the TranscriptPrefetcher from config, or returns None if prefetching is disabled."""
+    prefetch_config = config.get('transcript_prefetch') or {}
+    if not prefetch_config.get('enabled'):
+        return None
+    return TranscriptPrefetcher(
+        reader,
+        transcript_cache=transcript_cache,
+        refresh=refresh,
+        max_workers=int(prefetch_config.get('workers', 8)),
+        batch_size=int(prefetch_config.get('batch_size', 4)),
+        max_attempts=int(prefetch_config.get('max_attempts', 3)),
+        retry_base_delay=float(prefetch_config.get('retry_base_delay', 2.0)),
+        retry_max_delay=float(prefetch_config.get('retry_max_delay', 30.0))
+    )
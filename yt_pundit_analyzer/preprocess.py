@@ -0,0 +1,234 @@
+import logging
+import re
+import time
+# Import functions from the same package
+from . import metrics
+from .ratelimit import estimate_tokens
+
+# Optional timestamp at the start of a caption line: "12:34", "1:02:03", "[12:34]", "(12:34.5)"
+_TIMESTAMP = re.compile(r'^\s*[\[(]?((?:\d{1,2}:)?\d{1,2}:\d{2})(?:[.,]\d+)?[\])]?\s+')
+# Non-speech caption annotations and speaker-change markers
+_ANNOTATION = re.compile(r'\[(?:music|applause|laughter|laughs|inaudible|silence|noise|cheering|__)\]|>>', re.IGNORECASE)
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]?$')
+_SPACES = re.compile(r'\s+')
+
+DEFAULT_STEPS = ["annotations", "dedupe", "fillers", "drop_segments", "merge"]
+DEFAULT_FILLERS = ["um", "uh", "uhm", "erm", "hmm", "mhm"]
+
+# --- Caption Line Parsing ---
+def _parse_seconds(stamp: str) -> int:
+    seconds = 0
+    for part in stamp.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def _format_seconds(seconds: int) -> str:
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60:02d}:{rest % 60:02d}"
+
+def split_timestamp(raw: str) -> tuple:
+    """(seconds or None, index where the caption text starts) of one raw transcript line."""
+    match = _TIMESTAMP.match(raw)
+    return (_parse_seconds(match.group(1)), match.end()) if match else (None, 0)
+
+def parse_lines(transcript: str) -> list:
+    """Splits a transcript into [seconds or None, text] caption lines."""
+    lines = []
+    for raw in transcript.splitlines():
+        seconds, start = split_timestamp(raw)
+        lines.append([seconds, _SPACES.sub(' ', raw[start:]).strip()])
+    return lines
+
+
+# --- Compaction Steps ---
+# Each step takes and returns the list of [seconds, text] lines. Register custom steps
+# with register_preprocess_step() and list them under preprocess.steps in config.yaml.
+def remove_annotations(lines: list, settings: dict) -> list:
+    """Drops [Music]/[Applause]-style annotations, >> markers and lines left empty."""
+    for line in lines:
+        line[1] = _SPACES.sub(' ', _ANNOTATION.sub(' ', line[1])).strip()
+    return [line for line in lines if line[1]]
+
+def dedupe_lines(lines: list, settings: dict) -> list:
+    """
+    Collapses repeated caption lines and the rolling overlap of auto-captions, where
+    each line repeats the last words of the previous one.
+    """
+    window = settings.get('dedupe_window', 3)
+    min_overlap = settings.get('min_overlap_words', 3)
+    kept, recent = [], []
+    for seconds, text in lines:
+        key = text.lower()
+        if key in recent:
+            continue
+        if kept:
+            previous = kept[-1][1].split()
+            words = text.split()
+            for size in range(min(len(previous), len(words)), min_overlap - 1, -1):
+                if [w.lower() for w in previous[-size:]] == [w.lower() for w in words[:size]]:
+                    words = words[size:]
+                    break
+            text = " ".join(words)
+            if not text:
+                continue
+        kept.append([seconds, text])
+        recent = (recent + [key])[-window:]
+    return kept
+
+def remove_fillers(lines: list, settings: dict) -> list:
+    """
+    Removes single-word fillers ("um", "uh", ...) where they stand alone: a whole line, or
+    set off by commas or sentence punctuation ("Um, so", "so, uh, the", "right, um.").
+    A filler inside a phrase is kept, since the same word may carry meaning there.
+    """
+    fillers = settings.get('filler_words') or []
+    if not fillers:
+        return lines
+    words = r'\b(?:' + "|".join(re.escape(f) for f in fillers) + r')\b'
+    # Filler followed by a comma (after the line start or punctuation), or ending a clause after a comma
+    pattern = re.compile(
+        r'(?:^|(?<=[,.!?;:]))\s*' + words + r'\s*,|(?:^|,)\s*' + words + r'\s*(?=[.!?;:]|$)', re.IGNORECASE
+    )
+    for line in lines:
+        line[1] = _SPACES.sub(' ', pattern.sub('', line[1])).strip()
+    return [line for line in lines if line[1]]
+
+def drop_segments(lines: list, settings: dict) -> list:
+    """
+    Drops configured segments such as sponsor reads: from a line matching a segment's
+    'start' pattern up to the line matching its 'end' pattern, or at most max_lines lines.
+    """
+    rules = settings.get('drop_segments') or []
+    if not rules:
+        return lines
+    kept, index = [], 0
+    while index < len(lines):
+        text = lines[index][1]
+        rule = next((r for r in rules if r['start'].search(text)), None)
+        if rule is None:
+            kept.append(lines[index])
+            index += 1
+            continue
+        end = index
+        while end < min(len(lines), index + rule['max_lines']) - 1 and not (rule['end'] and rule['end'].search(lines[end][1])):
+            end += 1
+        logging.debug(f"Dropping {end - index + 1} caption lines starting with: '{text[:60]}'")
+        index = end + 1
+    return kept
+
+def merge_lines(lines: list, settings: dict) -> list:
+    """
+    Merges caption fragments into paragraphs of about paragraph_chars characters, ending
+    on sentence boundaries where possible, or spanning at most timestamp_interval_seconds.
+    Paragraphs are prefixed with the timestamp of their first line, at most once per interval.
+    """
+    max_chars = settings.get('paragraph_chars', 600)
+    interval = settings.get('timestamp_interval_seconds', 60)
+    paragraphs, current, current_len, last_marker = [], [], 0, None
+
+    def flush():
+        nonlocal last_marker
+        seconds = next((s for s, _ in current if s is not None), None)
+        text = " ".join(t for _, t in current)
+        if seconds is not None and (last_marker is None or seconds - last_marker >= interval):
+            text = f"[{_format_seconds(seconds)}] {text}"
+            last_marker = seconds
+        paragraphs.append([seconds, text])
+
+    for seconds, text in lines:
+        start = next((s for s, _ in current if s is not None), None)
+        if current and seconds is not None and start is not None and seconds - start >= interval:
+            flush()
+            current, current_len = [], 0
+        current.append((seconds, text))
+        current_len += len(text) + 1
+        at_sentence_end = _SENTENCE_END.search(text) is not None
+        if current_len >= max_chars and (at_sentence_end or current_len >= max_chars * 1.5):
+            flush()
+            current, current_len = [], 0
+    if current:
+        flush()
+    return paragraphs
+
+PREPROCESS_STEPS = {
+    "annotations": remove_annotations,
+    "dedupe": dedupe_lines,
+    "fillers": remove_fillers,
+    "drop_segments": drop_segments,
+    "merge": merge_lines,
+}
+
+def register_preprocess_step(name: str, fn):
+    """Makes a custom step fn(lines, settings) -> lines available to preprocess.steps."""
+    PREPROCESS_STEPS[name] = fn
+
+
+# --- Preprocessing Stage ---
+def compact_transcript(transcript: str, settings: dict) -> str:
+    """Runs the configured compaction steps over a raw transcript."""
+    lines = parse_lines(transcript)
+    for step in settings['steps']:
+        lines = PREPROCESS_STEPS[step](lines, settings)
+    return "\n".join(text for _, text in lines)
+
+def preprocess_transcript(transcript: str, settings: dict, label: str = None) -> str:
+    """
+    Compacts a fetched transcript before analysis and records the token savings.
+    Error strings from fetching and disabled preprocessing (settings None) pass through unchanged.
+    """
+    if settings is None or not transcript or transcript.startswith("Error fetching transcript"):
+        return transcript
+    start = time.perf_counter()
+    try:
+        compacted = compact_transcript(transcript, settings)
+    except Exception as e:
+        logging.error(f"Transcript preprocessing failed for {label}; using the raw transcript: {e}", exc_info=True)
+        return transcript
+    if not compacted.strip():
+        logging.warning(f"Transcript preprocessing removed everything for {label}; using the raw transcript.")
+        return transcript
+    saved_tokens = estimate_tokens(transcript) - estimate_tokens(compacted)
+    logging.info(
+        f"Compacted transcript for {label}: {len(transcript)} -> {len(compacted)} chars "
+        f"(~{saved_tokens} tokens saved, {1 - len(compacted) / len(transcript):.0%})."
+    )
+    metrics.record(
+        "preprocess", time.perf_counter() - start, label=label, transcript_chars=len(transcript),
+        compacted_chars=len(compacted), saved_tokens=saved_tokens
+    )
+    return compacted
+
+def _single_words(fillers: list) -> list:
+    """The filler words that are single tokens; phrases such as "you know" are ignored with a warning."""
+    phrases = [filler for filler in fillers if len(filler.split()) != 1]
+    if phrases:
+        logging.warning(f"Ignoring multi-word preprocess.filler_words (only single words are removed): {', '.join(phrases)}")
+    return [filler.strip() for filler in fillers if len(filler.split()) == 1]
+
+def setup_preprocessing(config: dict):
+    """Builds the preprocessing settings dict from config, or returns None if it is disabled."""
+    preprocess_config = config.get('preprocess') or {}
+    if not preprocess_config.get('enabled'):
+        return None
+    steps = preprocess_config.get('steps') or DEFAULT_STEPS
+    unknown = [step for step in steps if step not in PREPROCESS_STEPS]
+    if unknown:
+        raise ValueError(f"Unknown preprocess steps in config.yaml: {', '.join(unknown)}. Available: {', '.join(PREPROCESS_STEPS)}.")
+    settings = {
+        'steps': list(steps),
+        'filler_words': _single_words(preprocess_config.get('filler_words', DEFAULT_FILLERS)),
+        'paragraph_chars': int(preprocess_config.get('paragraph_chars', 600)),
+        'timestamp_interval_seconds': int(preprocess_config.get('timestamp_interval_seconds', 60)),
+        'dedupe_window': int(preprocess_config.get('dedupe_window', 3)),
+        'min_overlap_words': int(preprocess_config.get('min_overlap_words', 3)),
+        'drop_segments': [
+            {
+                'start': re.compile(segment['start'], re.IGNORECASE),
+                'end': re.compile(segment['end'], re.IGNORECASE) if segment.get('end') else None,
+                'max_lines': int(segment.get('max_lines', 1 if not segment.get('end') else 40)),
+            }
+            for segment in preprocess_config.get('drop_segments') or []
+        ],
+    }
+    logging.info(f"Transcript preprocessing enabled: {', '.join(settings['steps'])}.")
+    return settings
@@ -0,0 +1,317 @@
+import array
+import bisect
+import collections
+import difflib
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import zlib
+# Import functions from the same package
+from .preprocess import split_timestamp
+
+QUOTE_INDEX_SUFFIX = ".qidx"
+NGRAM = 3 # Words per indexed shingle; quotes shorter than this are not checked
+
+_WORD = re.compile(r"\w+(?:['’]\w+)*")
+_QUOTE = re.compile(r'["“]([^"“”\n]{8,})["”]')
+_TIMESTAMP_FIELD = re.compile(r'timestamp[^:\n]*:\**\s*\[?((?:\d{1,2}:)?\d{1,2}:\d{2})', re.IGNORECASE)
+_SECTION_START = re.compile(r'^\s*(?:#|---|\*\*\*)')
+_UNSAFE_NAME = re.compile(r'[^\w-]')
+
+# --- Tokens and Shingles ---
+def tokenize(text: str) -> list:
+    """(casefolded word, character offset) for every word of a text."""
+    return [(match.group().casefold().replace('’', "'"), match.start()) for match in _WORD.finditer(text)]
+
+def _word_hash(word: str) -> int:
+    return zlib.crc32(word.encode('utf-8')) # Stable across processes, unlike hash()
+
+def _shingle_key(h1: int, h2: int, h3: int) -> int:
+    return ((h1 << 32) | h2) ^ ((h3 * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+
+def _shingle_keys(hashes) -> list:
+    return [_shingle_key(hashes[i], hashes[i + 1], hashes[i + 2]) for i in range(len(hashes) - NGRAM + 1)]
+
+def parse_timestamp(stamp: str):
+    """Seconds of an "HH:MM:SS" / "MM:SS" timestamp, or None."""
+    if not stamp:
+        return None
+    seconds = 0
+    try:
+        for part in stamp.strip().strip('[]()').split(':'):
+            seconds = seconds * 60 + int(part)
+    except ValueError:
+        return None
+    return seconds
+
+def format_timestamp(seconds: int) -> str:
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+# --- Transcript Index ---
+class QuoteIndex:
+    """
+    Word 3-gram index of one transcript, for locating quotes.
+
+    Stores, per word, its character offset and a 32-bit hash, plus the sorted shingle
+    keys with the word position each starts at, and the timestamps of caption lines (as
+    (word position, seconds) pairs). Saved indexes are memory-mapped, so opening one
+    reads only the pages its lookups touch.
+    """
+
+    _HEADER = struct.Struct("<8sIIII") # Magic, words, shingles, timestamps, reserved
+    _MAGIC = b"QIDX\x00\x00\x00\x01"
+
+    def __init__(self, offsets, hashes, keys, positions, stamp_positions, stamp_seconds, source=None):
+        self.offsets = offsets
+        self.hashes = hashes
+        self.keys = keys
+        self.positions = positions
+        self.stamp_positions = stamp_positions
+        self.stamp_seconds = stamp_seconds
+        self._source = source # mmap backing the arrays of a loaded index
+
+    @classmethod
+    def build(cls, transcript: str) -> "QuoteIndex":
+        offsets, hashes, stamp_positions, stamp_seconds = array.array('I'), array.array('I'), array.array('I'), array.array('I')
+        line_start = 0
+        for raw in transcript.splitlines(keepends=True):
+            seconds, text_start = split_timestamp(raw)
+            if seconds is not None and (not stamp_seconds or seconds != stamp_seconds[-1]):
+                stamp_positions.append(len(offsets))
+                stamp_seconds.append(seconds)
+            for word, offset in tokenize(raw[text_start:]):
+                offsets.append(line_start + text_start + offset)
+                hashes.append(_word_hash(word))
+            line_start += len(raw)
+        pairs = sorted(zip(_shingle_keys(hashes), range(len(hashes))))
+        keys = array.array('Q', (key for key, _ in pairs))
+        positions = array.array('I', (position for _, position in pairs))
+        return cls(offsets, hashes, keys, positions, stamp_positions, stamp_seconds)
+
+    def save(self, path: str):
+        """Writes the index atomically (temp file + os.replace)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._HEADER.pack(self._MAGIC, len(self.offsets), len(self.keys), len(self.stamp_seconds), 0))
+                # 8-byte keys first, so every array starts aligned to its item size
+                for values in (self.keys, self.offsets, self.hashes, self.positions, self.stamp_positions, self.stamp_seconds):
+                    f.write(values.tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "QuoteIndex":
+        """Memory-maps a saved index. Raises ValueError if the file is not a complete index."""
+        with open(path, 'rb') as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(source)
+        magic, words, shingles, stamps, _ = cls._HEADER.unpack_from(view)
+        sizes = [('Q', shingles), ('I', words), ('I', words), ('I', shingles), ('I', stamps), ('I', stamps)]
+        if magic != cls._MAGIC or len(view) != cls._HEADER.size + sum(8 * n if code == 'Q' else 4 * n for code, n in sizes):
+            view.release()
+            source.close()
+            raise ValueError(f"{path} is not a complete quote index")
+        arrays, start = [], cls._HEADER.size
+        for code, count in sizes:
+            end = start + count * (8 if code == 'Q' else 4)
+            arrays.append(view[start:end].cast(code))
+            start = end
+        keys, offsets, hashes, positions, stamp_positions, stamp_seconds = arrays
+        return cls(offsets, hashes, keys, positions, stamp_positions, stamp_seconds, source)
+
+    def seconds_at(self, position: int):
+        """Timestamp of the caption line a word belongs to, or None if the transcript has none."""
+        index = bisect.bisect_right(self.stamp_positions, position) - 1
+        return self.stamp_seconds[index] if index >= 0 else None
+
+    def lookup(self, keys) -> dict:
+        """Word positions of many shingle keys at once: {key: positions}. Keys are probed in sorted order."""
+        found, lo = {}, 0
+        for key in sorted(set(keys)):
+            lo = bisect.bisect_left(self.keys, key, lo)
+            hi = lo
+            while hi < len(self.keys) and self.keys[hi] == key:
+                hi += 1
+            if hi > lo:
+                found[key] = self.positions[lo:hi]
+            lo = hi
+        return found
+
+
+# --- Index Store ---
+class QuoteIndexStore:
+    """
+    Saved quote indexes, one per transcript text, under <index_dir>/<id[:2]>/<id>.<digest>.qidx
+    (the transcript cache layout, so the cache's size and age limits also apply to them).
+    The digest of the indexed text is part of the name: a re-fetched or differently
+    preprocessed transcript gets a new index. Without index_dir, indexes live in memory.
+    Saved indexes are reported to transcript_cache (when they share its directory), so
+    they count towards its size limit as they are written.
+    """
+
+    def __init__(self, index_dir: str = None, transcript_cache=None):
+        self.index_dir = index_dir
+        self.transcript_cache = transcript_cache
+        self.built = 0
+        self.loaded = 0
+        self.checked = collections.Counter() # Totals of summarize_matches over the run
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _path(self, video_id: str, digest: str) -> str:
+        video_id = _UNSAFE_NAME.sub('_', video_id)
+        return os.path.join(self.index_dir, video_id[:2], f"{video_id}.{digest}{QUOTE_INDEX_SUFFIX}")
+
+    def index_for(self, video_id: str, transcript: str) -> QuoteIndex:
+        digest = hashlib.sha256(transcript.encode('utf-8')).hexdigest()[:16]
+        if self.index_dir is None:
+            with self._lock:
+                index = self._memory.get((video_id, digest))
+            if index is None:
+                index = QuoteIndex.build(transcript)
+                with self._lock:
+                    self._memory[(video_id, digest)] = index
+                    self.built += 1
+            return index
+        path = self._path(video_id, digest)
+        try:
+            index = QuoteIndex.load(path)
+            os.utime(path) # Keep hot indexes from LRU eviction
+            with self._lock:
+                self.loaded += 1
+            return index
+        except (OSError, ValueError, struct.error):
+            pass
+        index = QuoteIndex.build(transcript)
+        with self._lock:
+            self.built += 1
+        try:
+            index.save(path)
+            if self.transcript_cache is not None:
+                self.transcript_cache.added(os.path.getsize(path))
+        except OSError as e:
+            logging.warning(f"Could not save quote index {path}: {e}")
+        return index
+
+    def add_checked(self, summary: dict):
+        with self._lock:
+            self.checked.update(summary)
+
+    def stats(self) -> dict:
+        """Indexes built and loaded, and quote check totals, for the run report."""
+        with self._lock:
+            return {"indexes_built": self.built, "indexes_loaded": self.loaded, **self.checked}
+
+
+# --- Quote Extraction and Matching ---
+def extract_quotes(document: str) -> list:
+    """
+    Quoted statements of an analysis, each with the timestamp of the take it belongs to:
+    [{"quote", "timestamp", "line"}]. A take's timestamp is the last "Timestamp:" field
+    since the previous heading or rule.
+    """
+    quotes, timestamp = [], None
+    for line_number, line in enumerate(document.splitlines(), 1):
+        if _SECTION_START.match(line):
+            timestamp = None
+        match = _TIMESTAMP_FIELD.search(line)
+        if match:
+            timestamp = match.group(1)
+        for quote in _QUOTE.finditer(line):
+            quotes.append({"quote": quote.group(1).strip(), "timestamp": timestamp, "line": line_number})
+    return quotes
+
+def match_quotes(index: QuoteIndex, quotes: list, settings: dict) -> list:
+    """
+    Locates a batch of quotes from extract_quotes in one transcript index. Each quote's
+    shingles vote for where it starts; the best candidate span is then aligned word by
+    word, and similarity is the share of the quote's words found in order. Adds to each
+    quote: status (verified / fuzzy / not_found / too_short), similarity, offset (in the
+    transcript), transcript_timestamp and timestamp_ok (None when either side has none).
+    """
+    tokenized = [[_word_hash(word) for word, _ in tokenize(quote['quote'])] for quote in quotes]
+    found = index.lookup(key for hashes in tokenized for key in _shingle_keys(hashes))
+    tolerance = settings['timestamp_tolerance_seconds']
+    results = []
+    for quote, hashes in zip(quotes, tokenized):
+        result = {**quote, "status": "too_short", "similarity": None, "offset": None,
+                  "transcript_timestamp": None, "timestamp_ok": None}
+        results.append(result)
+        if len(hashes) < NGRAM:
+            continue
+        votes = collections.Counter()
+        for shift, key in enumerate(_shingle_keys(hashes)):
+            for position in found.get(key, ()):
+                votes[position - shift] += 1
+        if not votes:
+            result.update(status="not_found", similarity=0.0)
+            continue
+        start = max(0, votes.most_common(1)[0][0])
+        slack = max(2, len(hashes) // 4) # Room for words the model dropped or inserted
+        window_start = max(0, start - slack)
+        window = index.hashes[window_start:start + len(hashes) + slack]
+        blocks = [block for block in difflib.SequenceMatcher(None, hashes, list(window), autojunk=False).get_matching_blocks() if block.size]
+        similarity = sum(block.size for block in blocks) / len(hashes)
+        position = window_start + blocks[0].b if blocks else start
+        result.update(similarity=round(similarity, 3), offset=index.offsets[position])
+        if similarity >= settings['verified_similarity']:
+            result['status'] = "verified"
+        elif similarity >= settings['min_similarity']:
+            result['status'] = "fuzzy"
+        else:
+            result['status'] = "not_found"
+            continue
+        seconds = index.seconds_at(position)
+        claimed = parse_timestamp(quote.get('timestamp'))
+        if seconds is not None:
+            result['transcript_timestamp'] = format_timestamp(seconds)
+            if claimed is not None:
+                result['timestamp_ok'] = abs(claimed - seconds) <= tolerance
+    return results
+
+def summarize_matches(results: list) -> dict:
+    """Counts of a match_quotes result, for logs and the run report."""
+    statuses = collections.Counter(result['status'] for result in results)
+    return {
+        "quotes": len(results),
+        "verified": statuses['verified'],
+        "fuzzy": statuses['fuzzy'],
+        "not_found": statuses['not_found'],
+        "too_short": statuses['too_short'],
+        "timestamp_mismatches": sum(1 for result in results if result['timestamp_ok'] is False),
+    }
+
+
+# --- Quote Check Settings ---
+def setup_quote_check(config: dict, transcript_cache=None):
+    """
+    Builds the quote check settings dict from config, or returns None if the check is disabled.
+    Indexes saved in transcript_cache's directory count towards its size limit.
+    """
+    check_config = config.get('quote_check') or {}
+    if not check_config.get('enabled'):
+        return None
+    index_dir = check_config.get('index_dir') or config.get('transcript_cache_dir')
+    shares_cache = (transcript_cache is not None and index_dir is not None
+                    and os.path.abspath(index_dir) == os.path.abspath(transcript_cache.cache_dir))
+    settings = {
+        'store': QuoteIndexStore(index_dir, transcript_cache if shares_cache else None),
+        'min_similarity': float(check_config.get('min_similarity', 0.7)),
+        'verified_similarity': float(check_config.get('verified_similarity', 0.95)),
+        'timestamp_tolerance_seconds': int(check_config.get('timestamp_tolerance_seconds', 60)),
+    }
+    where = f"indexes saved in {os.path.abspath(index_dir)}" if index_dir else "indexes kept in memory"
+    logging.info(f"Quote check enabled ({where}).")
+    return settings
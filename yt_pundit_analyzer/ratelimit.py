@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import threading
+import time
+
+# --- Token Estimation ---
+CHARS_PER_TOKEN = 4 # Rough average for English text with Gemini's tokenizer
+
+def estimate_tokens(text: str) -> int:
+    """Cheap prompt-size estimate used for tokens-per-minute budgeting."""
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+def estimate_message_tokens(messages) -> int:
+    """Estimates the prompt tokens of a list of chat messages."""
+    return sum(estimate_tokens(m.content) for m in messages)
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """True for HTTP 429 / ResourceExhausted style quota errors from the Gemini client."""
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests", "RateLimitError"):
+        return True
+    if getattr(exc, 'code', None) == 429 or getattr(exc, 'status_code', None) == 429:
+        return True
+    text = str(exc)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "Resource has been exhausted" in text
+
+
+# --- Token Bucket Rate Limiter ---
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class _Bucket:
+    """A token bucket refilled continuously at capacity/period tokens per second."""
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / self.period * scale)
+        self.updated = now
+
+    def time_until(self, amount: float, scale: float) -> float:
+        # Requests larger than the whole bucket are admitted once it is full (the level goes negative)
+        needed = min(amount, self.capacity) - self.level
+        return 0.0 if needed <= 0 else needed * self.period / (self.capacity * scale)
+
+
+class TokenBucketRateLimiter:
+    """
+    Thread-safe limiter with separate request (RPM) and token (TPM) buckets.
+
+    Callers are admitted in FIFO order across threads and coroutines (one ticket queue
+    serves acquire() and acquire_async()), so long prompts can't be starved by short ones.
+    Sleeping happens outside the internal lock. When the API reports a
+    429/ResourceExhausted, report_throttled() pauses admission with exponential backoff
+    and temporarily scales the refill rate down; report_success() restores it gradually.
+    """
+
+    def __init__(self, max_calls: int, period: float = 60, tokens_per_minute: int = None,
+                 max_retries: int = 3, base_backoff: float = 5.0, max_backoff: float = 120.0):
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._requests = _Bucket(max_calls, period)
+        self._tokens = _Bucket(tokens_per_minute, 60) if tokens_per_minute else None
+        self._scale = 1.0 # Adaptive refill multiplier, lowered on 429s
+        self._backoff = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set() # Tickets whose callers gave up (interrupted or cancelled) before their turn
+        self._async_waiters = {} # Ticket -> (event loop, future) of a coroutine waiting for its turn
+        # Metrics
+        self._acquired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._throttled = 0
+        self._tokens_admitted = 0
+
+    def _reserve(self, tokens: int) -> float:
+        """Consumes capacity if available (returns 0), else returns seconds to wait. Caller holds the lock."""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._requests.refill(now, self._scale)
+        delay = self._requests.time_until(1, self._scale)
+        if self._tokens is not None:
+            self._tokens.refill(now, self._scale)
+            delay = max(delay, self._tokens.time_until(tokens, self._scale))
+        if delay > 0:
+            return delay
+        self._requests.level -= 1
+        if self._tokens is not None:
+            self._tokens.level -= tokens
+        return 0.0
+
+    def _take_ticket(self) -> int:
+        """Caller holds the lock."""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        return ticket
+
+    def _finish_ticket(self, ticket: int):
+        """Ends a ticket's turn, or drops it from the queue if its turn has not come. Caller holds the lock."""
+        if ticket == self._serving:
+            self._serving += 1
+        else:
+            self._abandoned.add(ticket)
+        while self._serving in self._abandoned:
+            self._abandoned.remove(self._serving)
+            self._serving += 1
+        self._lock.notify_all()
+        waiter = self._async_waiters.pop(self._serving, None)
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _record_wait(self, waited: float, tokens: int):
+        with self._lock:
+            self._acquired += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._tokens_admitted += tokens
+        if waited >= 1:
+            logging.warning(f"Rate limit hit. Waited {waited:.1f} seconds (estimated prompt tokens: {tokens}).")
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Blocks until a request with the given estimated prompt tokens may be sent. Returns seconds waited."""
+        start = time.monotonic()
+        with self._lock:
+            ticket = self._take_ticket()
+        try:
+            with self._lock:
+                while ticket != self._serving:
+                    self._lock.wait()
+            while True:
+                with self._lock:
+                    delay = self._reserve(tokens)
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+        finally: # Also runs if the caller is interrupted, so later tickets are never stranded
+            with self._lock:
+                self._finish_ticket(ticket)
+        waited = time.monotonic() - start
+        self._record_wait(waited, tokens)
+        return waited
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Coroutine version of acquire(), sharing its ticket queue; waiting never blocks the event loop."""
+        start = time.monotonic()
+        turn = None
+        with self._lock:
+            ticket = self._take_ticket()
+            if ticket != self._serving:
+                loop = asyncio.get_running_loop()
+                turn = loop.create_future()
+                self._async_waiters[ticket] = (loop, turn)
+        try:
+            if turn is not None:
+                await turn
+            while True:
+                with self._lock:
+                    delay = self._reserve(tokens)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            with self._lock:
+                self._async_waiters.pop(ticket, None)
+                self._finish_ticket(ticket)
+        waited = time.monotonic() - start
+        self._record_wait(waited, tokens)
+        return waited
+
+    def expected_wait(self, tokens: int = 0) -> float:
+        """Seconds a request of this size would wait if it were sent now, without reserving anything."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            queued = self._next_ticket - self._serving - len(self._abandoned) # Earlier callers are admitted first
+            self._requests.refill(now, self._scale)
+            delay = self._requests.time_until(1 + queued, self._scale)
+            if self._tokens is not None:
+                self._tokens.refill(now, self._scale)
+                delay = max(delay, self._tokens.time_until(tokens, self._scale))
+            return delay
+
+    def report_throttled(self, retry_after: float = None):
+        """Feedback for a 429/ResourceExhausted: back off and slow the refill rate."""
+        with self._lock:
+            self._throttled += 1
+            self._backoff = min(self.max_backoff, max(self.base_backoff, self._backoff * 2))
+            pause = retry_after if retry_after else self._backoff
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            self._scale = max(0.25, self._scale * 0.5)
+            self._requests.level = min(self._requests.level, 0.0)
+        logging.warning(f"API quota exceeded (429). Pausing requests for {pause:.1f}s; refill rate scaled to {self._scale:.0%}.")
+
+    def report_success(self):
+        """Feedback for a successful call: gradually restore the configured rate."""
+        with self._lock:
+            self._backoff = 0.0
+            self._scale = min(1.0, self._scale + 0.1)
+
+    def metrics(self) -> dict:
+        """Snapshot of admission and wait statistics."""
+        with self._lock:
+            return {
+                "acquired": self._acquired,
+                "total_wait_seconds": round(self._total_wait, 3),
+                "mean_wait_seconds": round(self._total_wait / self._acquired, 3) if self._acquired else 0.0,
+                "max_wait_seconds": round(self._max_wait, 3),
+                "throttled_429": self._throttled,
+                "estimated_tokens_admitted": self._tokens_admitted,
+                "rate_scale": round(self._scale, 2),
+            }
+
+    # Context manager form (no token estimate), kept for simple call sites
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
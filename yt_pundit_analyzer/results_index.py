@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+RESULTS_INDEX_FILENAME = "results_index.sqlite"
+COUNT_COLUMNS = ("verdict", "confidence", "pundit", "subject", "kind", "topic")
+
+# --- Record Flattening ---
+def _record_items(record: dict) -> list:
+    """One searchable row per takeaway or verdict of a structured record (see structured.build_record)."""
+    data = record.get('data') or {}
+    if record['kind'] == "comparison":
+        return [
+            {"topic": verdict.get('topic'), "category": verdict.get('category'),
+             "body": "\n".join(part for part in (verdict.get('initial_take'), verdict.get('retrospective'), verdict.get('key_factors')) if part),
+             "timestamp": verdict.get('early_timestamp'),
+             "quotes": "\n".join((verdict.get('early_quotes') or []) + (verdict.get('retrospective_quotes') or [])),
+             "confidence": None, "verdict": verdict.get('verdict')}
+            for verdict in data.get('verdicts') or []
+        ]
+    return [
+        {"topic": takeaway.get('topic'), "category": takeaway.get('category'), "body": takeaway.get('take'),
+         "timestamp": takeaway.get('timestamp'), "quotes": "\n".join(takeaway.get('quotes') or []),
+         "confidence": takeaway.get('confidence'), "verdict": None}
+        for takeaway in data.get('takeaways') or []
+    ]
+
+
+# --- Results Index ---
+class ResultsIndex:
+    """
+    SQLite database of the structured records of all analyses and comparisons, with an
+    FTS5 full-text index over their takeaways and verdicts (topic, text and quotes).
+
+    Records are ingested one at a time as results are produced; re-ingesting a record
+    with the same doc_id replaces it, so re-runs never duplicate rows. Filters on pundit,
+    subject, kind and verdict use ordinary indexes.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.ingested = 0
+        self._lock = threading.Lock() # One connection shared by all worker threads
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL") # Records can be rebuilt from their .json files
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " doc_id TEXT PRIMARY KEY, kind TEXT NOT NULL, stage TEXT NOT NULL, subject TEXT, label TEXT,"
+                " pundit TEXT, video_id TEXT, file TEXT, overview TEXT, indexed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, position INTEGER NOT NULL, topic TEXT, category TEXT,"
+                " body TEXT, timestamp TEXT, quotes TEXT, confidence TEXT, verdict TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_items_doc ON items(doc_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_items_verdict ON items(verdict COLLATE NOCASE)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_pundit ON documents(pundit COLLATE NOCASE)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_subject ON documents(subject COLLATE NOCASE)")
+            # External-content FTS table kept in sync with items by triggers
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+                " topic, category, body, quotes, content='items', content_rowid='id', tokenize='porter unicode61')"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN"
+                " INSERT INTO items_fts(rowid, topic, category, body, quotes) VALUES (new.id, new.topic, new.category, new.body, new.quotes);"
+                " END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN"
+                " INSERT INTO items_fts(items_fts, rowid, topic, category, body, quotes)"
+                " VALUES ('delete', old.id, old.topic, old.category, old.body, old.quotes);"
+                " END"
+            )
+
+    def _ingest(self, record: dict):
+        self._conn.execute("DELETE FROM items WHERE doc_id = ?", (record['doc_id'],))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (doc_id, kind, stage, subject, label, pundit, video_id, file, overview, indexed_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record['doc_id'], record['kind'], record['stage'], record.get('subject'), record.get('label'), record.get('pundit'),
+             record.get('video_id'), record.get('file'), (record.get('data') or {}).get('overview'), time.time())
+        )
+        self._conn.executemany(
+            "INSERT INTO items (doc_id, position, topic, category, body, timestamp, quotes, confidence, verdict)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(record['doc_id'], position, item['topic'], item['category'], item['body'], item['timestamp'],
+              item['quotes'], item['confidence'], item['verdict'])
+             for position, item in enumerate(_record_items(record))]
+        )
+        self.ingested += 1
+
+    def ingest(self, record: dict):
+        """Adds or replaces one structured record. Errors are logged, never raised."""
+        try:
+            with self._lock, self._conn:
+                self._ingest(record)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to index structured record {record.get('doc_id')} in {self.db_path}: {e}")
+
+    def ingest_folder(self, folder: str) -> int:
+        """Re-indexes every structured record (.json) saved in an output folder. Returns the number ingested."""
+        count = 0
+        with self._lock, self._conn:
+            for entry in os.scandir(folder):
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        record = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.warning(f"Skipping unreadable structured record {entry.path}: {e}")
+                    continue
+                if isinstance(record, dict) and record.get('doc_id') and record.get('kind'):
+                    self._ingest(record)
+                    count += 1
+        logging.info(f"Indexed {count} structured records from {folder}")
+        return count
+
+    @staticmethod
+    def _filters(text: str, pundit: str, subject: str, verdict: str, kind: str) -> tuple:
+        clauses, params = [], []
+        if text:
+            clauses.append("items_fts MATCH ?")
+            params.append(text)
+        for column, value in (("d.pundit", pundit), ("d.subject", subject), ("i.verdict", verdict), ("d.kind", kind)):
+            if value:
+                clauses.append(f"{column} = ? COLLATE NOCASE")
+                params.append(value)
+        source = "items i JOIN documents d ON d.doc_id = i.doc_id"
+        if text:
+            source = "items_fts JOIN items i ON i.id = items_fts.rowid JOIN documents d ON d.doc_id = i.doc_id"
+        return source, (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, sql: str, params: list, text: str) -> list:
+        try:
+            with self._lock:
+                return self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            if text: # FTS5 reports malformed MATCH expressions as operational errors
+                raise ValueError(f"Invalid search query '{text}': {e}. Quote phrases with \"...\".") from e
+            raise
+
+    def search(self, text: str = None, pundit: str = None, subject: str = None, verdict: str = None, kind: str = None,
+               limit: int = 20) -> list:
+        """
+        Takeaways and verdicts matching an FTS5 query (words, "phrases", OR, prefix*) and the
+        given filters, best matches first (newest first without a text query).
+        """
+        source, where, params = self._filters(text, pundit, subject, verdict, kind)
+        snippet = "snippet(items_fts, 2, '[', ']', '...', 24)" if text else "i.body"
+        order = "bm25(items_fts)" if text else "d.indexed_at DESC, i.position"
+        sql = (f"SELECT d.kind, d.subject, d.label, d.pundit, d.video_id, d.file, i.topic, i.category, i.timestamp,"
+               f" i.confidence, i.verdict, {snippet} AS snippet FROM {source}{where} ORDER BY {order} LIMIT ?")
+        return [dict(row) for row in self._query(sql, params + [limit], text)]
+
+    def count(self, by: str, text: str = None, pundit: str = None, subject: str = None, verdict: str = None,
+              kind: str = None) -> dict:
+        """Number of matching takeaways/verdicts per value of one column (see COUNT_COLUMNS), most frequent first."""
+        if by not in COUNT_COLUMNS:
+            raise ValueError(f"Cannot count by '{by}'. Available: {', '.join(COUNT_COLUMNS)}.")
+        column = f"d.{by}" if by in ("pundit", "subject", "kind") else f"i.{by}"
+        source, where, params = self._filters(text, pundit, subject, verdict, kind)
+        sql = f"SELECT {column} AS value, COUNT(*) AS n FROM {source}{where} GROUP BY {column} ORDER BY n DESC"
+        return {row['value']: row['n'] for row in self._query(sql, params, text)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            items = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        return {"documents": documents, "items": items, "ingested": self.ingested}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.llms.gemini import Gemini
+# Import functions from the same package
+from . import metrics
+from .utils import load_prompt, create_chat_prompt_template, generate_output_filename
+from .cache import ResponseCache
+from .chunking import group_for_merge
+from .core import chat_with_cache, save_output
+from .ratelimit import TokenBucketRateLimiter
+
+ROLLUP_INPUTS_FILENAME = "rollup_inputs.jsonl"
+
+# --- Comparison Spool ---
+class RollupCollector:
+    """
+    Spools each finished set's successful comparisons to rollup_inputs.jsonl in the output
+    folder, indexed by pundit, so the rollup stage reads one pundit's comparisons at a time
+    instead of holding every comparison of the run in memory.
+    """
+
+    def __init__(self, output_folder: str):
+        self.path = os.path.join(output_folder, ROLLUP_INPUTS_FILENAME)
+        self._offsets = collections.defaultdict(list) # Pundit -> byte offsets of its lines
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'wb')
+
+    def add_set(self, summary: dict):
+        """Adds the comparisons of a summary from summarize_set that have a pundit and succeeded."""
+        for comparison in summary.get('comparisons') or []:
+            if not comparison.get('pundit') or comparison.get('comparison_status') != "OK" or not comparison.get('comparison'):
+                continue
+            record = {"pundit": comparison['pundit'], "subject": summary['subject'],
+                      "label": comparison.get('label') or summary['subject'], "comparison": comparison['comparison']}
+            with self._lock:
+                self._offsets[comparison['pundit']].append(self._file.tell())
+                self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+
+    def pundits(self) -> dict:
+        """Number of spooled comparisons per pundit."""
+        with self._lock:
+            return {pundit: len(offsets) for pundit, offsets in self._offsets.items()}
+
+    def read(self, pundit: str):
+        """Yields the spooled comparison records of one pundit, in the order they finished."""
+        with self._lock:
+            self._file.flush()
+            offsets = list(self._offsets.get(pundit, ()))
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+    def close(self):
+        self._file.close()
+
+
+# --- Pundit Rollups ---
+def rollup_pundit(
+    pundit: str,
+    records,
+    llm: Gemini,
+    rollup_settings: dict,
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    response_cache: ResponseCache = None
+) -> str:
+    """
+    Summarizes all comparisons of one pundit with a hierarchical reduce: comparisons are
+    grouped to fit rollup_settings['max_chars'], each group is summarized, and the partial
+    rollups are combined level by level until one remains. Saves and returns the rollup.
+    """
+    stage_start = time.perf_counter()
+    partials = [f"## {record['label']}\n\n{record['comparison']}" for record in records]
+    count = len(partials)
+    logging.info(f"Rolling up {count} comparisons for pundit '{pundit}'...")
+    level = 1
+    try:
+        with metrics.collect_models() as models:
+            while True:
+                groups = group_for_merge(partials, rollup_settings['max_chars'])
+                if len(groups) == len(partials) and len(partials) > 1:
+                    groups = [partials] # Nothing fits together; combine everything in one call
+                merged = []
+                for number, group in enumerate(groups, 1):
+                    heading = "Comparisons of early takes with retrospectives" if level == 1 else "Partial rollups"
+                    body = f"# {heading} for '{pundit}'\n\n" + "\n\n".join(group)
+                    messages = rollup_settings['template'].format_messages(transcript=body, subject=pundit)
+                    description = f"rollup for pundit '{pundit}' (level {level}, group {number}/{len(groups)})"
+                    merged.append(chat_with_cache(llm, messages, rate_limiter, description, response_cache))
+                if not all(merged):
+                    result = "Error: Empty response from LLM."
+                    break
+                if len(merged) == 1:
+                    result = merged[0]
+                    save_output(output_folder, generate_output_filename(pundit, "Rollup"), result)
+                    break
+                partials = [f"## Partial rollup {i} of {len(merged)}\n\n{partial}" for i, partial in enumerate(merged, 1)]
+                level += 1
+    except Exception as e:
+        logging.error(f"Error during rollup LLM call for pundit '{pundit}': {e}", exc_info=True)
+        result = f"Error rolling up comparisons: {e}"
+    metrics.record("rollup", time.perf_counter() - stage_start, label=pundit, comparisons=count, levels=level,
+                   model=metrics.models_label(models))
+    return result
+
+def run_rollups(
+    collector: RollupCollector,
+    llm: Gemini,
+    rollup_settings: dict,
+    rate_limiter: TokenBucketRateLimiter,
+    output_folder: str,
+    response_cache: ResponseCache = None
+) -> dict:
+    """Rolls up every pundit in the collector, a few pundits at a time. Returns {pundit: "OK" or error}."""
+    pundits = collector.pundits()
+    if not pundits:
+        logging.info("No comparisons with a pundit to roll up.")
+        return {}
+    logging.info(f"Rolling up comparisons for {len(pundits)} pundits.")
+    statuses = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=rollup_settings['workers'], thread_name_prefix='Rollup') as executor:
+        futures = {
+            executor.submit(metrics.bind_set(pundit, rollup_pundit), pundit, collector.read(pundit), llm,
+                            rollup_settings, rate_limiter, output_folder, response_cache): pundit
+            for pundit in pundits
+        }
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            statuses[futures[future]] = "OK" if not result.startswith("Error") else result
+    return statuses
+
+def setup_rollup(config: dict):
+    """Builds the rollup settings dict from config, or returns None if the rollup stage is disabled."""
+    rollup_config = config.get('rollup') or {}
+    if not rollup_config.get('enabled'):
+        return None
+    settings = {
+        'template': create_chat_prompt_template(load_prompt(rollup_config['prompt_file'])),
+        'max_chars': int(rollup_config.get('max_chars', 120000)),
+        'workers': max(1, int(rollup_config.get('workers', 2))),
+    }
+    logging.info(f"Pundit rollups enabled (up to {settings['max_chars']} characters per call).")
+    return settings
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.llms.gemini import Gemini
+# Import functions from the same package
+from .ratelimit import TokenBucketRateLimiter, is_rate_limit_error
+from .utils import setup_rate_limiter
+
+ROUTED_STAGES = ("analyze", "compare", "extract", "rollup")
+
+# --- Errors ---
+class LatencyExceeded(TimeoutError):
+    """A model did not answer within its route's max_latency_seconds."""
+
+
+# --- Model Routes ---
+class ModelRoute:
+    """
+    One configured model: its LLM client, its own rate limiter, and the route that work
+    spills over to when this model is out of quota or too slow (see select_route).
+
+    A route is passed to the pipeline in place of the LLM. It exposes the model name and
+    generation params of its client, so it hashes like that model: requests are looked up
+    under the primary model, and answers are cached and journaled under the route of the
+    model that gave them (see core.chat_with_cache and core.answered_hash).
+    """
+
+    def __init__(self, name: str, llm: Gemini, rate_limiter: TokenBucketRateLimiter, fallback: ModelRoute = None,
+                 max_latency_seconds: float = None, spill_after_seconds: float = 5.0, max_parallel: int = 32,
+                 owns_llm: bool = False):
+        self.name = name
+        self.llm = llm
+        self.rate_limiter = rate_limiter
+        self.fallback = fallback
+        self.max_latency_seconds = max_latency_seconds
+        self.spill_after_seconds = spill_after_seconds
+        self.max_parallel = max_parallel
+        self.owns_llm = owns_llm # Close the client with the route (not the shared default LLM)
+        self.calls = 0
+        self.spilled = {"quota": 0, "latency": 0} # Requests moved on to the fallback, by reason
+        self._lock = threading.Lock()
+        self._executor = None # Runs calls with a latency budget; created on first use
+
+    @property
+    def model(self):
+        return self.name
+
+    @property
+    def temperature(self):
+        return getattr(self.llm, 'temperature', None)
+
+    @property
+    def max_tokens(self):
+        return getattr(self.llm, 'max_tokens', None)
+
+    @property
+    def generation_config(self):
+        return getattr(self.llm, 'generation_config', None)
+
+    def chain(self) -> list:
+        """This route followed by its fallbacks, in spill-over order."""
+        routes = [self]
+        while routes[-1].fallback is not None:
+            routes.append(routes[-1].fallback)
+        return routes
+
+    def latency_budget(self, skipped: set):
+        """Seconds to wait for an answer before spilling over, or None if nothing is left to spill to."""
+        if self.max_latency_seconds is None or not any(route.name not in skipped for route in self.chain()[1:]):
+            return None
+        return self.max_latency_seconds
+
+    def count(self, reason: str = None):
+        with self._lock:
+            if reason is None:
+                self.calls += 1
+            else:
+                self.spilled[reason] += 1
+
+    def chat_within(self, messages: list, timeout: float):
+        """Calls the client, raising LatencyExceeded after timeout seconds (the call itself is abandoned)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='Model')
+        future = self._executor.submit(self.llm.chat, messages)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            raise LatencyExceeded(f"{self.name} did not answer within {timeout}s") from None
+
+    async def achat_within(self, messages: list, timeout: float):
+        """Coroutine version of chat_within(); the call is cancelled on timeout."""
+        try:
+            return await asyncio.wait_for(self.llm.achat(messages), timeout)
+        except asyncio.TimeoutError:
+            raise LatencyExceeded(f"{self.name} did not answer within {timeout}s") from None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "spilled_quota": self.spilled['quota'], "spilled_latency": self.spilled['latency'],
+                    "fallback": self.fallback.name if self.fallback is not None else None,
+                    "rate_limiter": self.rate_limiter.metrics()}
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        if self.owns_llm and hasattr(self.llm, 'close'):
+            self.llm.close()
+
+
+def select_route(llm, tokens: int, skipped: set = frozenset()):
+    """
+    The route to send the next request of a ModelRoute to, or None for a plain LLM.
+    Walks the fallback chain past models skipped for this request and models whose
+    limiter would hold a request of this size for more than spill_after_seconds
+    (quota exhausted or backing off after 429s). The last model is always used.
+    """
+    if not isinstance(llm, ModelRoute):
+        return None
+    candidates = [route for route in llm.chain() if route.name not in skipped]
+    for route in candidates[:-1]:
+        if route.rate_limiter.expected_wait(tokens) <= route.spill_after_seconds:
+            return route
+        route.count("quota")
+        logging.info(f"Model {route.name} is saturated; sending the request to its fallback.")
+    return candidates[-1]
+
+def spill_reason(route: ModelRoute, error: Exception, skipped: set):
+    """Why a failed call should move on to the route's fallback ('quota' / 'latency'), or None to handle it as usual."""
+    if route is None or not any(other.name not in skipped for other in route.chain()[1:]):
+        return None
+    if isinstance(error, LatencyExceeded):
+        return "latency"
+    if is_rate_limit_error(error):
+        return "quota"
+    return None
+
+
+# --- Stage Routing ---
+class ModelRouter:
+    """The configured model routes by name, and the route each pipeline stage uses."""
+
+    def __init__(self, routes: dict, stage_routes: dict):
+        self.routes = routes
+        self.stage_routes = stage_routes
+
+    def route_for(self, stage: str):
+        return self.stage_routes.get(stage)
+
+    def stats(self) -> dict:
+        """Per-model calls, spill-overs and rate limiter metrics, for the run report."""
+        return {name: route.stats() for name, route in self.routes.items()}
+
+    def close(self):
+        for route in self.routes.values():
+            route.close()
+
+
+def stage_model(model_router: ModelRouter, stage: str, llm: Gemini, rate_limiter: TokenBucketRateLimiter) -> tuple:
+    """(llm, rate_limiter) a stage should use: its configured route, or the shared defaults."""
+    route = model_router.route_for(stage) if model_router is not None else None
+    if route is None:
+        return llm, rate_limiter
+    return route, route.rate_limiter
+
+def setup_model_router(config: dict, llm: Gemini, rate_limiter: TokenBucketRateLimiter, make_llm):
+    """
+    Builds a ModelRouter from the 'models' and 'stage_models' config sections, or returns
+    None if neither is set. Stages without an entry in stage_models use the default model
+    (llm_model_name), which keeps the shared llm and rate limiter unless 'models' gives it
+    limits of its own. Every other model is created with make_llm(model_name) and gets its
+    own limiter (with the top-level rate_limit_* values unless it sets its own).
+    Raises ValueError for unknown stages or models and for fallback cycles.
+    """
+    stage_models = config.get('stage_models') or {}
+    models = config.get('models') or {}
+    if not stage_models and not models:
+        return None
+    default_name = config.get('llm_model_name', 'models/gemini-1.5-flash')
+    for stage, name in stage_models.items():
+        if stage not in ROUTED_STAGES:
+            raise ValueError(f"Unknown stage '{stage}' in stage_models (stages: {', '.join(ROUTED_STAGES)}).")
+        if name != default_name and name not in models:
+            raise ValueError(f"stage_models.{stage} names model '{name}', which is not configured under 'models'.")
+
+    routes = {}
+    def build(name: str, path: tuple) -> ModelRoute:
+        if name in path:
+            raise ValueError(f"Model fallbacks form a cycle: {' -> '.join(path + (name,))}.")
+        if name in routes:
+            return routes[name]
+        model_config = models.get(name) or {}
+        if name != default_name and name not in models:
+            raise ValueError(f"Fallback model '{name}' is not configured under 'models'.")
+        route_limiter = rate_limiter
+        if name != default_name or 'rate_limit_calls' in model_config:
+            route_limiter = setup_rate_limiter(
+                model_config.get('rate_limit_calls', config.get('rate_limit_calls', 5)),
+                model_config.get('rate_limit_period', config.get('rate_limit_period', 60)),
+                tokens_per_minute=model_config.get('rate_limit_tokens_per_minute', config.get('rate_limit_tokens_per_minute')),
+                max_retries=config.get('rate_limit_max_retries', 3)
+            )
+        fallback = build(model_config['fallback'], path + (name,)) if model_config.get('fallback') else None
+        routes[name] = ModelRoute(
+            name, llm if name == default_name else make_llm(name), route_limiter, fallback,
+            max_latency_seconds=model_config.get('max_latency_seconds'),
+            spill_after_seconds=model_config.get('spill_after_seconds', 5.0),
+            max_parallel=config.get('async_max_concurrency', 64),
+            owns_llm=name != default_name
+        )
+        return routes[name]
+
+    stage_routes = {stage: build(stage_models.get(stage, default_name), ()) for stage in ROUTED_STAGES}
+    for stage, route in stage_routes.items():
+        logging.info(f"Stage '{stage}' uses model {' -> '.join(r.name for r in route.chain())}")
+    return ModelRouter(routes, stage_routes)
@@ -0,0 +1,93 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+MANIFEST_FILENAME = "run_manifest.jsonl"
+
+# --- Run Manifest (resumable runs) ---
+class RunManifest:
+    """
+    Append-only JSON-lines journal of stage outcomes, stored in the output folder.
+
+    Each line records one stage of one set: {"set", "stage", "status", "input_hash",
+    "output_file", ...}; the latest line for a (set, stage) pair wins. With resume=True,
+    completed stages whose input hash still matches are served from their saved output
+    file instead of calling the LLM again. Lines are flushed and fsynced as they are
+    written, so the journal survives a crash up to the last finished stage.
+    """
+
+    def __init__(self, output_folder: str, resume: bool = False):
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.resume = resume
+        self.run_started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.resumed_stages = 0
+        self._lock = threading.Lock()
+        self._latest = {} # (set, stage) -> latest record
+        if resume:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logging.info(f"No run manifest found at {self.path}; starting from scratch.")
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                    self._latest[(record['set'], record['stage'])] = record
+                except (json.JSONDecodeError, KeyError):
+                    # A crash can leave a truncated last line; skip it
+                    logging.warning(f"Ignoring malformed line {line_number} in run manifest {self.path}")
+        done = sum(1 for record in self._latest.values() if record.get('status') == 'done')
+        logging.info(f"Loaded run manifest {self.path}: {done} completed stages available for resume.")
+
+    def record(self, set_name: str, stage: str, status: str, input_hash: str = None, output_file: str = None, **details):
+        """Appends one stage outcome to the journal."""
+        record = {
+            "ts": datetime.datetime.now().isoformat(timespec='seconds'),
+            "run_started": self.run_started,
+            "set": set_name,
+            "stage": stage,
+            "status": status,
+            "input_hash": input_hash,
+            "output_file": output_file,
+            **details
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self.resume: # Only resumed runs look records up; others just append
+                self._latest[(set_name, stage)] = record
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logging.error(f"Failed to write run manifest {self.path}: {e}")
+
+    def completed(self, stages: tuple) -> list:
+        """Latest records of the given stages that completed, in journal order. Needs resume=True."""
+        with self._lock:
+            return [record for (_set, stage), record in self._latest.items() if stage in stages and record.get('status') == 'done']
+
+    def load_completed(self, set_name: str, stage: str, input_hash: str):
+        """Returns the saved output of a completed stage with matching inputs, or None."""
+        if not self.resume:
+            return None
+        with self._lock:
+            record = self._latest.get((set_name, stage))
+        if not record or record.get('status') != 'done' or record.get('input_hash') != input_hash:
+            return None
+        output_file = record.get('output_file')
+        try:
+            with open(output_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except (OSError, TypeError):
+            logging.warning(f"Output for completed stage {stage} of '{set_name}' is missing ({output_file}); re-running it.")
+            return None
+        with self._lock:
+            self.resumed_stages += 1
+        logging.info(f"Resuming: {stage} for '{set_name}' already completed; loaded {output_file}")
+        return content
@@ -0,0 +1,149 @@
+import logging
+import queue
+import concurrent.futures
+
+# --- Stage Task Graph Scheduler ---
+class _Task:
+    """A single node in the stage graph."""
+    __slots__ = ('task_id', 'stage', 'fn', 'deps', 'dependents', 'remaining', 'result', 'error')
+
+    def __init__(self, task_id, stage, fn, deps):
+        self.task_id = task_id
+        self.stage = stage
+        self.fn = fn
+        self.deps = deps
+        self.dependents = []
+        self.remaining = len(deps)
+        self.result = None
+        self.error = None
+
+
+class UpstreamTaskError(Exception):
+    """Raised for tasks that were skipped because a dependency failed."""
+
+
+class StageScheduler:
+    """
+    Runs a DAG of stage tasks (fetch, analyze, compare, ...) on shared thread pools,
+    one pool per stage type. A task is submitted as soon as all of its dependencies
+    have finished, so independent stages of the same set and stages of different
+    sets overlap freely; the rate limiter is the only global throttle.
+
+    Each task function is called with the results of its dependencies as positional
+    arguments, in the order the dependencies were declared. Stage pools are created on
+    first use, so tasks may also be registered while run() is in progress (see feed).
+    """
+
+    def __init__(self, pool_sizes: dict, default_pool_size: int = 4):
+        self.pool_sizes = dict(pool_sizes or {})
+        self.default_pool_size = default_pool_size
+        self._tasks = {}
+
+    def add_task(self, task_id: str, stage: str, fn, deps=()) -> str:
+        """Registers a task. Dependencies must already be registered."""
+        if task_id in self._tasks:
+            raise ValueError(f"Duplicate task id: {task_id}")
+        dep_tasks = []
+        for dep_id in deps:
+            if dep_id not in self._tasks:
+                raise ValueError(f"Task '{task_id}' depends on unknown task '{dep_id}'")
+            dep_tasks.append(self._tasks[dep_id])
+        task = _Task(task_id, stage, fn, dep_tasks)
+        for dep in dep_tasks:
+            dep.dependents.append(task)
+        self._tasks[task_id] = task
+        return task_id
+
+    def pending(self, task_id: str) -> bool:
+        """True if the task is registered and has not finished, so new tasks can still depend on it."""
+        return task_id in self._tasks
+
+    def __len__(self):
+        """Number of registered tasks that have not finished yet."""
+        return len(self._tasks)
+
+    def run(self, feed=None, max_in_flight: int = None):
+        """
+        Executes all registered tasks, yielding (task_id, result, error) as each one
+        finishes. error is None on success, otherwise the exception raised.
+
+        feed is an optional iterator that registers more tasks each time it is advanced
+        (e.g. one video set) and yields the id of the task that completes that group. It
+        is advanced lazily, keeping at most max_in_flight groups registered at a time, so
+        a large input is never materialized as tasks up front. Finished tasks are dropped
+        (results are only held until their dependents have started), so memory stays
+        bounded by the window rather than the input size.
+        """
+        executors = {}
+        finished = queue.Queue() # Completed tasks, consumed on the calling thread only
+        open_groups = set() # Final task ids of groups pulled from feed that have not finished
+        window = max(1, max_in_flight or 1)
+
+        def executor_for(stage):
+            if stage not in executors:
+                size = max(1, int(self.pool_sizes.get(stage, self.default_pool_size)))
+                executors[stage] = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix=stage.capitalize())
+                logging.info(f"Started stage pool: {stage}={size}")
+            return executors[stage]
+
+        def submit(task):
+            args = [dep.result for dep in task.deps]
+            task.deps = () # Dependencies' results are now held by the submitted call only
+            future = executor_for(task.stage).submit(task.fn, *args)
+            future.add_done_callback(lambda f, t=task: finished.put((t, f)))
+
+        submitted = set()
+        def submit_ready():
+            for task in list(self._tasks.values()):
+                if task.remaining == 0 and task.task_id not in submitted:
+                    submitted.add(task.task_id)
+                    submit(task)
+
+        def pull():
+            """Advances feed until the window is full (or it is exhausted) and submits ready tasks."""
+            nonlocal feed
+            while feed is not None and len(open_groups) < window:
+                try:
+                    open_groups.add(next(feed))
+                except StopIteration:
+                    feed = None
+            submit_ready()
+
+        logging.info(f"Scheduling {len(self._tasks)} tasks" + (f" (streaming input, up to {window} groups in flight)" if feed is not None else ""))
+        try:
+            pull()
+            while self._tasks:
+                task, future = finished.get()
+                if future is not None:
+                    try:
+                        task.result = future.result()
+                    except Exception as e:
+                        task.error = e
+
+                # Release dependents before handing the result to the caller
+                for dependent in task.dependents:
+                    dependent.remaining -= 1
+                    if dependent.remaining:
+                        continue
+                    failed = [dep.task_id for dep in dependent.deps if dep.error is not None]
+                    if failed:
+                        dependent.error = UpstreamTaskError(f"Skipped because dependencies failed: {', '.join(failed)}")
+                        dependent.deps = ()
+                        submitted.add(dependent.task_id)
+                        finished.put((dependent, None))
+                    else:
+                        submitted.add(dependent.task_id)
+                        submit(dependent)
+
+                # Forget the finished task; pending dependents keep it alive until they start
+                del self._tasks[task.task_id]
+                submitted.discard(task.task_id)
+                result, error = task.result, task.error
+                task.fn, task.dependents = None, []
+                if task.task_id in open_groups:
+                    open_groups.discard(task.task_id)
+                    pull()
+                yield task.task_id, result, error
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,219 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.core.llms import ChatResponse
+    from llama_index.llms.gemini import Gemini
+# Import functions from the same package
+from .routing import LatencyExceeded
+
+PARTIAL_SUFFIX = ".partial"
+
+# --- Errors ---
+class StreamStalled(LatencyExceeded):
+    """
+    A streamed response sent no first chunk within first_token_timeout_seconds, or no new
+    chunk for stall_timeout_seconds. Like other LatencyExceeded errors, it spills over to
+    a fallback model when the route has one; otherwise the call is retried.
+    """
+
+
+# --- Streamed Output Files ---
+class StreamFile:
+    """
+    An output file written while its response streams in. Chunks are appended to
+    <path>.partial and flushed as they arrive, so progress is visible on disk, and
+    commit() renames the finished file into place atomically. If every attempt fails,
+    the partial output of the last one stays in <path>.partial; an empty response is
+    discarded, so the caller saves its error result instead.
+    """
+
+    def __init__(self, output_folder: str, filename: str):
+        self.path = os.path.join(output_folder, filename)
+        self.partial_path = self.path + PARTIAL_SUFFIX
+        self.committed = False
+        self.chars = 0
+        self._file = None
+
+    def start(self):
+        """Starts (or restarts, for a retried call) writing the partial file."""
+        self.abandon()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.partial_path, 'w', encoding='utf-8')
+        self.chars = 0
+        self.committed = False
+
+    def write(self, text: str):
+        self._file.write(text)
+        self._file.flush()
+        self.chars += len(text)
+
+    def commit(self):
+        self._file.close()
+        self._file = None
+        os.replace(self.partial_path, self.path)
+        self.committed = True
+
+    def abandon(self):
+        """Stops writing; the partial file is kept for inspection."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Stops writing and removes the partial file."""
+        self.abandon()
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+    def saved_path(self, content: str):
+        """Path of the committed file if it holds this (non-empty) result, else None (save it normally)."""
+        return self.path if self.committed and content else None
+
+
+# --- Watched Streaming Calls ---
+def can_stream(client, use_async: bool = False) -> bool:
+    """True if the client has llama_index's streaming chat API."""
+    return hasattr(client, 'astream_chat' if use_async else 'stream_chat')
+
+def _chunk_timeout(settings: dict, received: int, started: float, max_seconds: float) -> tuple:
+    """(seconds to wait for the next chunk, True if that wait is cut short by max_seconds)."""
+    now = time.monotonic()
+    if received:
+        timeout = settings['stall_timeout_seconds']
+    else: # The first token is due first_token_timeout_seconds after the call started
+        timeout = max(0.0, started + settings['first_token_timeout_seconds'] - now)
+    if max_seconds is not None:
+        remaining = max(0.0, started + max_seconds - now)
+        if remaining < timeout:
+            return remaining, True
+    return timeout, False
+
+def _timed_out(description: str, received: int, waited: float, deadline: bool) -> LatencyExceeded:
+    if deadline:
+        return LatencyExceeded(f"{description} did not finish within its latency budget")
+    if not received:
+        return StreamStalled(f"{description} sent no first token within {waited:.1f}s")
+    return StreamStalled(f"{description} stalled for {waited:.1f}s after {received} chunks")
+
+def _finish(last, parts: list, stream_file: StreamFile = None):
+    """
+    Completes a streamed call: the last chunk carries the full message and usage metadata.
+    Returns None for a stream without chunks; the stream file of an empty response is discarded.
+    """
+    text = "".join(parts)
+    if last is not None and last.message is not None and not last.message.content:
+        last.message.content = text
+    if stream_file is not None:
+        if last is not None and last.message is not None and last.message.content:
+            stream_file.commit()
+        else:
+            stream_file.discard()
+    return last
+
+def stream_chat(client: Gemini, messages: list, settings: dict, description: str, stream_file: StreamFile = None,
+                max_seconds: float = None) -> ChatResponse:
+    """
+    Calls client.stream_chat and collects the response, writing chunks to stream_file as
+    they arrive. The stream is read on a helper thread, so a call that hangs raises
+    StreamStalled (or LatencyExceeded after max_seconds) in the caller instead of blocking
+    its worker; the helper stops reading and closes the stream once it gets control back.
+    Returns the last chunk, whose message holds the whole response (None if no chunk came).
+    """
+    chunks = queue.Queue()
+    cancelled = threading.Event()
+
+    def pump():
+        try:
+            stream = client.stream_chat(messages)
+            for chunk in stream:
+                if cancelled.is_set():
+                    if hasattr(stream, 'close'):
+                        stream.close()
+                    return
+                chunks.put((chunk, None))
+            chunks.put((None, None))
+        except BaseException as e:
+            chunks.put((None, e))
+
+    started = time.monotonic()
+    threading.Thread(target=pump, name="Stream", daemon=True).start()
+    if stream_file is not None:
+        stream_file.start()
+    last, parts = None, []
+    try:
+        while True:
+            timeout, deadline = _chunk_timeout(settings, len(parts), started, max_seconds)
+            try:
+                chunk, error = chunks.get(timeout=timeout)
+            except queue.Empty:
+                cancelled.set()
+                raise _timed_out(description, len(parts), time.monotonic() - started if not parts else timeout, deadline) from None
+            if error is not None:
+                raise error
+            if chunk is None:
+                return _finish(last, parts, stream_file)
+            last = chunk
+            parts.append(chunk.delta or "")
+            if stream_file is not None and chunk.delta:
+                stream_file.write(chunk.delta)
+    finally:
+        if stream_file is not None:
+            stream_file.abandon()
+
+async def astream_chat(client: Gemini, messages: list, settings: dict, description: str, stream_file: StreamFile = None,
+                       max_seconds: float = None) -> ChatResponse:
+    """Coroutine version of stream_chat(); a hung call is cancelled, which releases its connection."""
+    started = time.monotonic()
+    if stream_file is not None:
+        stream_file.start()
+    last, parts, stream = None, [], None
+    try:
+        timeout, deadline = _chunk_timeout(settings, 0, started, max_seconds)
+        try:
+            stream = await asyncio.wait_for(client.astream_chat(messages), timeout)
+            while True:
+                timeout, deadline = _chunk_timeout(settings, len(parts), started, max_seconds)
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return _finish(last, parts, stream_file)
+                last = chunk
+                parts.append(chunk.delta or "")
+                if stream_file is not None and chunk.delta:
+                    stream_file.write(chunk.delta)
+        except asyncio.TimeoutError:
+            raise _timed_out(description, len(parts), time.monotonic() - started if not parts else timeout, deadline) from None
+    finally:
+        if stream_file is not None:
+            stream_file.abandon()
+        if stream is not None and hasattr(stream, 'aclose'):
+            try:
+                await stream.aclose()
+            except Exception as e:
+                logging.debug(f"Closing the response stream of {description} failed: {e}")
+
+
+# --- Streaming Settings ---
+def setup_streaming(config: dict):
+    """Builds the streaming settings dict from config, or returns None if streaming is disabled."""
+    stream_config = config.get('streaming') or {}
+    if not stream_config.get('enabled'):
+        return None
+    settings = {
+        'first_token_timeout_seconds': float(stream_config.get('first_token_timeout_seconds', 60)),
+        'stall_timeout_seconds': float(stream_config.get('stall_timeout_seconds', 30)),
+        'max_stall_retries': int(stream_config.get('max_stall_retries', 2)),
+    }
+    logging.info(
+        f"Streaming LLM responses (first token within {settings['first_token_timeout_seconds']:.0f}s, "
+        f"stalls after {settings['stall_timeout_seconds']:.0f}s, {settings['max_stall_retries']} retries)."
+    )
+    return settings
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import re
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.core.prompts import RichPromptTemplate
+# Import functions from the same package
+from .utils import load_prompt, create_chat_prompt_template
+from .results_index import ResultsIndex, RESULTS_INDEX_FILENAME
+
+# --- Record Schemas ---
+# JSON Schema subset (type, enum, required, properties, items) describing the records the
+# extraction prompts must return. The schema is also shown to the model in each request.
+VERDICTS = ("Highly Accurate", "Partially Accurate", "Mostly Inaccurate", "Completely Wrong")
+CONFIDENCE_LEVELS = ("High", "Medium", "Low")
+
+_TEXT = {"type": "string"}
+_OPTIONAL_TEXT = {"type": ["string", "null"]}
+_QUOTES = {"type": "array", "items": _TEXT}
+
+TAKEAWAYS_SCHEMA = {
+    "type": "object",
+    "required": ["overview", "takeaways"],
+    "properties": {
+        "overview": _TEXT,
+        "takeaways": {"type": "array", "items": {
+            "type": "object",
+            "required": ["topic", "take"],
+            "properties": {
+                "topic": _TEXT, # Card, mechanic, archetype or color pair
+                "category": _OPTIONAL_TEXT,
+                "take": _TEXT,
+                "timestamp": _OPTIONAL_TEXT, # HH:MM:SS as written in the takeaways
+                "quotes": _QUOTES,
+                "confidence": {"enum": [*CONFIDENCE_LEVELS, None]},
+            },
+        }},
+    },
+}
+
+COMPARISON_SCHEMA = {
+    "type": "object",
+    "required": ["overview", "verdicts"],
+    "properties": {
+        "overview": _TEXT,
+        "verdicts": {"type": "array", "items": {
+            "type": "object",
+            "required": ["topic", "initial_take", "verdict"],
+            "properties": {
+                "topic": _TEXT,
+                "category": _OPTIONAL_TEXT,
+                "initial_take": _TEXT,
+                "retrospective": _OPTIONAL_TEXT,
+                "key_factors": _OPTIONAL_TEXT,
+                "early_timestamp": _OPTIONAL_TEXT,
+                "early_quotes": _QUOTES,
+                "retrospective_quotes": _QUOTES,
+                "verdict": {"enum": list(VERDICTS)},
+            },
+        }},
+        "patterns": _QUOTES,
+    },
+}
+
+STRUCTURED_SCHEMAS = {"takeaways": TAKEAWAYS_SCHEMA, "comparison": COMPARISON_SCHEMA}
+
+_JSON_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool, "array": list, "object": dict, "null": type(None)}
+
+def validate_json(value, schema: dict, path: str = "$") -> list:
+    """Problems of a parsed JSON value against a schema (see above), as messages naming the offending path."""
+    problems = []
+    if 'enum' in schema and value not in schema['enum']:
+        allowed = ", ".join(json.dumps(choice) for choice in schema['enum'])
+        return [f"{path}: must be one of {allowed}, got {json.dumps(value)[:80]}"]
+    types = schema.get('type')
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if isinstance(value, bool) and "boolean" not in types or not isinstance(value, tuple(_JSON_TYPES[t] for t in types)):
+            return [f"{path}: must be {' or '.join(types)}, got {type(value).__name__}"]
+    if isinstance(value, dict):
+        for key in schema.get('required', ()):
+            if key not in value:
+                problems.append(f"{path}: missing required key '{key}'")
+        for key, spec in schema.get('properties', {}).items():
+            if key in value:
+                problems.extend(validate_json(value[key], spec, f"{path}.{key}"))
+    if isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            problems.extend(validate_json(item, schema['items'], f"{path}[{index}]"))
+    return problems
+
+_JSON_FENCE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+def parse_structured_output(text: str, schema: dict) -> tuple:
+    """
+    Parses a model response into JSON and validates it. Accepts a bare object or one
+    wrapped in a ```json fence. Returns (data, problems); data is None if unparseable.
+    """
+    if not text:
+        return None, ["the response is empty"]
+    fenced = _JSON_FENCE.search(text)
+    candidate = fenced.group(1) if fenced else text[text.find('{'):text.rfind('}') + 1]
+    try:
+        data = json.loads(candidate)
+    except json.JSONDecodeError as e:
+        return None, [f"the response is not valid JSON: {e}"]
+    return data, validate_json(data, schema)
+
+
+# --- Extraction Prompts ---
+def format_extraction_messages(template: RichPromptTemplate, kind: str, subject: str, document: str,
+                               previous: str = None, problems: list = None) -> list:
+    """
+    Renders the extraction prompt for one Markdown result. When a previous answer failed
+    validation, it is included with its problems so the model can correct it.
+    """
+    body = (f"# JSON schema\n\n```json\n{json.dumps(STRUCTURED_SCHEMAS[kind], indent=2)}\n```\n\n"
+            f"# Document\n\n{document}")
+    if problems:
+        listed = "\n".join(f"- {problem}" for problem in problems[:20])
+        body += f"\n\n# Your previous answer\n\n{previous}\n\n# Problems to fix\n\n{listed}"
+    return template.format_messages(transcript=body, subject=subject)
+
+def structured_target(kind: str, stage: str, name: str, subject: str, file_subject: str,
+                      label: str = None, pundit: str = None, video_id: str = None) -> dict:
+    """
+    Describes the result a record is extracted from: its kind ('takeaways' / 'comparison'),
+    journal stage and name, and the metadata the results index can filter on.
+    """
+    return {"kind": kind, "stage": stage, "name": name, "subject": subject, "file_subject": file_subject,
+            "label": label or subject, "pundit": pundit, "video_id": video_id}
+
+def structured_stage(target: dict) -> str:
+    """Journal stage of a record, next to the stage of the result it was extracted from."""
+    return f"{target['stage']} JSON"
+
+def build_record(target: dict, data: dict, filename: str) -> dict:
+    """
+    The stored form of an extraction: the validated data plus what it was extracted from.
+    doc_id ('<stage>:<journal name>') identifies the result across runs.
+    """
+    return {
+        "doc_id": f"{target['stage']}:{target['name']}",
+        "kind": target['kind'],
+        "stage": target['stage'],
+        "subject": target['subject'],
+        "label": target['label'],
+        "pundit": target['pundit'],
+        "video_id": target['video_id'],
+        "file": filename,
+        "data": data,
+    }
+
+
+# --- Structured Output Settings ---
+def results_index_path(config: dict, output_folder: str) -> str:
+    """The results database: 'structured_output.index_path', or results_index.sqlite in the output folder."""
+    path = (config.get('structured_output') or {}).get('index_path')
+    return path or os.path.join(output_folder, RESULTS_INDEX_FILENAME)
+
+def setup_structured_output(config: dict, output_folder: str):
+    """Builds the structured output settings dict from config, or returns None if extraction is disabled."""
+    structured_config = config.get('structured_output') or {}
+    if not structured_config.get('enabled'):
+        return None
+    settings = {
+        'templates': {
+            'takeaways': create_chat_prompt_template(load_prompt(structured_config['takeaways_prompt_file'])),
+            'comparison': create_chat_prompt_template(load_prompt(structured_config['comparison_prompt_file'])),
+        },
+        'max_attempts': max(1, int(structured_config.get('max_attempts', 2))),
+        'index': ResultsIndex(results_index_path(config, output_folder)),
+    }
+    logging.info(f"Structured output enabled; records are indexed in {settings['index'].db_path}")
+    return settings
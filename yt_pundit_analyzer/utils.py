@@ -1,12 +1,14 @@
+from __future__ import annotations
 import yaml
 import os
 import logging
-import time
 import datetime
 import re
-from ratelimiter import RateLimiter
-from llama_index.core.prompts import RichPromptTemplate
-from dotenv import load_dotenv
+import urllib.parse
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from llama_index.core.prompts import RichPromptTemplate
+from .ratelimit import TokenBucketRateLimiter
 
 # --- Configuration Loading ---
 def load_config(config_path="config.yaml"):
@@ -28,6 +30,7 @@ def load_config(config_path="config.yaml"):
 
 def get_api_key(config):
     """Gets the Google API key, prioritizing environment variables."""
+    from dotenv import load_dotenv # Only needed for commands that call the API
     load_dotenv() # Load .env file if it exists
     api_key = os.getenv("GOOGLE_API_KEY")
     if api_key:
@@ -88,25 +91,61 @@ Please perform the analysis based on the instructions.
 {% endif %}
 {% endchat %}
 """
+    from llama_index.core.prompts import RichPromptTemplate # Deferred: slow to import
     # Pass the loaded system prompt content as a variable to the Jinja template
     return RichPromptTemplate(chat_template, system_prompt_template_str=system_prompt_template_str)
 
 
 # --- Rate Limiting ---
-def limited_callback(until):
-    """Callback function for when rate limit is hit."""
-    duration = int(round(until - time.time()))
-    logging.warning(f"Rate limit hit. Sleeping for ~{duration} seconds.")
-    # The ratelimiter library handles the actual sleep
-
-def setup_rate_limiter(max_calls: int, period: int) -> RateLimiter:
-    """Creates and returns a RateLimiter instance."""
+def setup_rate_limiter(max_calls: int, period: int, tokens_per_minute: int = None, max_retries: int = 3) -> TokenBucketRateLimiter:
+    """Creates and returns a TokenBucketRateLimiter (requests per period, plus optional tokens per minute)."""
     if not isinstance(max_calls, int) or max_calls <= 0:
         raise ValueError("rate_limit_calls must be a positive integer in config.yaml.")
     if not isinstance(period, int) or period <= 0:
         raise ValueError("rate_limit_period must be a positive integer in config.yaml.")
-    logging.info(f"Setting up rate limiter: {max_calls} calls / {period} seconds")
-    return RateLimiter(max_calls=max_calls, period=period, callback=limited_callback)
+    if tokens_per_minute is not None and (not isinstance(tokens_per_minute, int) or tokens_per_minute <= 0):
+        raise ValueError("rate_limit_tokens_per_minute must be a positive integer in config.yaml.")
+    if not isinstance(max_retries, int) or max_retries < 0:
+        raise ValueError("rate_limit_max_retries must be a non-negative integer in config.yaml.")
+    token_desc = f", {tokens_per_minute} tokens / minute" if tokens_per_minute else ""
+    logging.info(f"Setting up rate limiter: {max_calls} calls / {period} seconds{token_desc}")
+    return TokenBucketRateLimiter(max_calls, period, tokens_per_minute=tokens_per_minute, max_retries=max_retries)
+
+
+# --- YouTube URL Utilities ---
+_VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+def extract_video_id(url: str) -> str:
+    """
+    Extracts the 11-character YouTube video ID from a URL, so that equivalent forms
+    (watch?v=, youtu.be/, /shorts/, /embed/, /live/, extra params like &t=) map to one key.
+    """
+    if not url or not isinstance(url, str):
+        raise ValueError(f"Invalid YouTube URL: {url!r}")
+    candidate = url.strip()
+    if _VIDEO_ID_PATTERN.match(candidate):
+        return candidate # Already a bare video ID
+
+    parsed = urllib.parse.urlparse(candidate if "://" in candidate else f"https://{candidate}")
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+
+    video_id = None
+    if host == "youtu.be":
+        video_id = parsed.path.lstrip("/").split("/")[0]
+    elif host in ("youtube.com", "music.youtube.com", "youtube-nocookie.com"):
+        query_ids = urllib.parse.parse_qs(parsed.query).get("v")
+        if query_ids:
+            video_id = query_ids[0]
+        else:
+            parts = [p for p in parsed.path.split("/") if p]
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                video_id = parts[1]
+
+    if not video_id or not _VIDEO_ID_PATTERN.match(video_id):
+        raise ValueError(f"Could not extract a YouTube video ID from URL: {url}")
+    return video_id
 
 
 # --- Filename Generation Utility ---
@@ -121,10 +160,10 @@ def sanitize_filename(name: str) -> str:
     # Limit length if necessary
     return name[:100] # Limit filename length for compatibility
 
-def generate_output_filename(subject: str, analysis_type: str) -> str:
+def generate_output_filename(subject: str, analysis_type: str, extension: str = "md") -> str:
     """Generates the output filename based on the specified format."""
     # analysis_type should be "Early_take", "Retrospective", or "Analysis"
     date_str = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M")
     sanitized_subject = sanitize_filename(subject)
     sanitized_type = sanitize_filename(analysis_type)
-    return f"{date_str}_{sanitized_subject}_{sanitized_type}.md"
+    return f"{date_str}_{sanitized_subject}_{sanitized_type}.{extension}"
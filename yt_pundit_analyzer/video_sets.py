@@ -0,0 +1,188 @@
+import csv
+import json
+import logging
+import os
+# Import functions from the same package
+from .utils import extract_video_id
+
+SUMMARY_FILENAME = "set_summaries.jsonl"
+VIDEO_SET_FORMATS = ("jsonl", "csv", "playlist")
+ROLES = ("early_take", "retrospective")
+
+# --- Set Structure ---
+# A set's early_take / retrospective is one video ({"url": ..., "pundit": ...}) or a list of
+# them; every early take is compared with every retrospective of the set. A video's pundit
+# (or channel) defaults to the set's, and is used to group comparisons in the rollup stage.
+def set_videos(video_set: dict, role: str) -> list:
+    """The videos of a set for one role ('early_take' or 'retrospective'), each with url and pundit."""
+    entries = video_set.get(role)
+    entries = entries if isinstance(entries, list) else [entries]
+    default_pundit = video_set.get('pundit') or video_set.get('channel')
+    return [
+        {"url": entry['url'], "pundit": entry.get('pundit') or entry.get('channel') or default_pundit}
+        for entry in entries
+    ]
+
+def video_set_urls(video_set: dict) -> list:
+    """The unique video URLs of a set, in processing order."""
+    urls = []
+    for role in ROLES:
+        for video in set_videos(video_set, role):
+            if video['url'] not in urls:
+                urls.append(video['url'])
+    return urls
+
+def _valid_videos(entries) -> bool:
+    entries = entries if isinstance(entries, list) else [entries]
+    return bool(entries) and all(isinstance(entry, dict) and entry.get('url') for entry in entries)
+
+def iter_valid_video_sets(video_sets):
+    """Yields the sets with a subject and at least one URL per role, logging the ones that are skipped."""
+    for video_set in video_sets:
+        # Basic validation of the set structure
+        subject = video_set.get('subject') if isinstance(video_set, dict) else None
+        if not subject or not all(_valid_videos(video_set.get(role)) for role in ROLES):
+            logging.warning(f"Skipping invalid video set structure: Set name '{subject or 'MISSING'}'. Check URLs and structure.")
+            continue
+        yield video_set
+
+
+# --- Streaming Set Readers ---
+# Each reader yields one set dict at a time, so a file with any number of sets is never
+# held in memory. Sets have the same shape as the 'video_sets' entries in config.yaml.
+def _set_from_record(record: dict) -> dict:
+    """
+    Accepts nested sets (as in config.yaml) or flat rows with early_url/retrospective_url
+    columns, which may hold several URLs separated by ';', and an optional pundit column.
+    """
+    if 'early_take' in record or 'retrospective' in record:
+        return record
+    def videos(value):
+        urls = [url.strip() for url in (value or "").split(';') if url.strip()]
+        return [{"url": url} for url in urls] if len(urls) != 1 else {"url": urls[0]}
+    video_set = {
+        "subject": (record.get('subject') or "").strip(),
+        "early_take": videos(record.get('early_url') or record.get('early_take_url')),
+        "retrospective": videos(record.get('retrospective_url') or record.get('retro_url')),
+    }
+    pundit = (record.get('pundit') or record.get('channel') or "").strip()
+    if pundit:
+        video_set['pundit'] = pundit
+    return video_set
+
+def read_jsonl_sets(path: str):
+    """One JSON object per line, e.g. {"subject": ..., "early_url": ..., "retrospective_url": ...}."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield _set_from_record(json.loads(line))
+            except (json.JSONDecodeError, AttributeError):
+                logging.warning(f"Ignoring malformed line {line_number} in {path}")
+
+def read_csv_sets(path: str):
+    """CSV with a header row: subject, early_url, retrospective_url (and optionally pundit)."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield _set_from_record(row)
+
+def read_playlist_sets(path: str):
+    """
+    A playlist export: one video per line, either a bare URL or a JSON object with url
+    (or webpage_url / id) and title, as printed by `yt-dlp --flat-playlist -j`. Consecutive
+    videos form a set (early take, then retrospective), named after the early take's title.
+    """
+    def entries():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if not line.startswith('{'):
+                    yield line, None
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring malformed playlist entry in {path}: {line[:80]}")
+                    continue
+                url = entry.get('webpage_url') or entry.get('url') or (f"https://www.youtube.com/watch?v={entry['id']}" if entry.get('id') else None)
+                yield url, entry.get('title')
+
+    early = None
+    for url, title in entries():
+        if early is None:
+            early = (url, title)
+            continue
+        early_url, early_title = early
+        early = None
+        subject = early_title
+        if not subject:
+            try:
+                subject = extract_video_id(early_url)
+            except ValueError:
+                subject = early_url
+        yield {"subject": subject, "early_take": {"url": early_url}, "retrospective": {"url": url}}
+    if early is not None:
+        logging.warning(f"Playlist {path} has an odd number of videos; ignoring the last one ({early[0]}).")
+
+VIDEO_SET_READERS = {
+    "jsonl": read_jsonl_sets,
+    "csv": read_csv_sets,
+    "playlist": read_playlist_sets,
+}
+
+def iter_video_sets_file(path: str, file_format: str = None):
+    """Streams the sets of a file; the format is taken from the extension unless given."""
+    if not file_format:
+        extension = os.path.splitext(path)[1].lower().lstrip('.')
+        file_format = {"jsonl": "jsonl", "ndjson": "jsonl", "csv": "csv"}.get(extension, "playlist")
+    if file_format not in VIDEO_SET_READERS:
+        raise ValueError(f"Unknown video sets format '{file_format}'. Available: {', '.join(VIDEO_SET_FORMATS)}.")
+    if not os.path.exists(path):
+        raise ValueError(f"Video sets file not found: {path}")
+    logging.info(f"Streaming video sets from {path} ({file_format}).")
+    return VIDEO_SET_READERS[file_format](path)
+
+def setup_video_sets(config: dict, cli_video_sets_file: str = None) -> tuple:
+    """
+    Returns (iterator over valid sets, number of sets or None if streamed from a file).
+    A sets file (CLI override or 'video_sets_file') takes precedence over 'video_sets'.
+    """
+    path = cli_video_sets_file or config.get('video_sets_file')
+    if path:
+        return iter_valid_video_sets(iter_video_sets_file(path, config.get('video_sets_format'))), None
+    video_sets = config.get('video_sets')
+    if not video_sets or not isinstance(video_sets, list):
+        raise ValueError("No valid 'video_sets' list or 'video_sets_file' found in configuration. Ensure one is defined in config.yaml.")
+    return iter_valid_video_sets(video_sets), len(video_sets)
+
+
+# --- Streaming Set Summaries ---
+class SetSummaryWriter:
+    """
+    Appends each finished set's summary to set_summaries.jsonl in the output folder as it
+    arrives, instead of keeping all summaries in memory until the end of the run.
+    """
+
+    def __init__(self, output_folder: str):
+        self.path = os.path.join(output_folder, SUMMARY_FILENAME)
+        self.written = 0
+        self.failed = 0
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    def write(self, summary: dict):
+        if summary.get('comparisons'): # Comparison texts are in the output files; keep the summary small
+            summary = {**summary, "comparisons": [{k: v for k, v in c.items() if k != 'comparison'} for c in summary['comparisons']]}
+        self._file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.written += 1
+        if summary.get('error') or any(str(value).startswith("Error") for key, value in summary.items() if key.endswith('_status')):
+            self.failed += 1
+
+    def close(self):
+        self._file.close()
+
+    def stats(self) -> dict:
+        return {"file": self.path, "sets": self.written, "failed": self.failed}